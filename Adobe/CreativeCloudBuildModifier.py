@@ -14,44 +14,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-# for debugging
-from pprint import pprint
 import os.path
+import sys
 from autopkglib import Processor, ProcessorError
-from xml.etree import ElementTree
 
-__all__ = ["CreativeCloudBuildModifier"]
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ccplib import pkgmeta  # pylint: disable=wrong-import-position
+from ccplib.buildpolicy import PolicyError, SUPPRESS_CCDA_POLICY, compile_policy  # pylint: disable=wrong-import-position
+from ccplib.fileutil import load_state, save_state, stat_fingerprint  # pylint: disable=wrong-import-position
+from ccplib.logutil import ProcessorLog  # pylint: disable=wrong-import-position
+from ccplib.profiling import profiled  # pylint: disable=wrong-import-position
 
-ACC_PACKAGE_SETS = {
-    'AAM': [
-        'UWA',
-        'PDApp',
-        'D6',
-        'DECore',
-        'DWA',
-        'P6',
-        'LWA',
-        'CCM',
-        'P7',
-        'AdobeGCClient',
-        'IPC'
-    ],
-    'ADC': [
-        'Runtime',
-        'Core',
-        'HEX',
-        'CEF',
-        'CoreExt',
-        'ElevationManager',
-        'TCC',
-        'Notifications',
-        'SignInApp'
-    ],
-    'ACC': [
-        'HDCore',
-        'AppsPanel'
-    ]
-}
+__all__ = ["CreativeCloudBuildModifier"]
 
 
 class CreativeCloudBuildModifier(Processor):
@@ -66,167 +40,127 @@ class CreativeCloudBuildModifier(Processor):
             "description": "Suppress the installation of Creative Cloud Desktop Application.",
             "required": False,
             "default": True
+        },
+        "build_policy": {
+            "description": ("A dictionary describing the modifications to make, with the keys 'suppress', "
+                            "'remove_packages', 'package_set_overrides', 'panels' and 'features'. "
+                            "See ccplib/buildpolicy.py for details. If given, suppress_ccda is ignored."),
+            "required": False,
+        },
+        "dry_run": {
+            "description": "Report the modifications as a diff without writing them to the package.",
+            "required": False,
+            "default": False
+        },
+        "ccp_profile": {
+            "required": False,
+            "description": ("Profile this processor with cProfile and an allocation tracer, writing reports to "
+                            "RECIPE_CACHE_DIR/profiles. Can also be enabled with the CCP_PROFILE environment variable."),
+        },
+        "ccp_profile_top": {
+            "required": False,
+            "description": "Number of hotspots to print when profiling (default 20).",
+        }
+    }
+    output_variables = {
+        "build_modifier_diff": {
+            "description": "Unified diff of the modifications made, or which would be made in a dry run."
         }
     }
-    output_variables = {}
-
-    def _addPackage(self, parent, name):
-        """Add a package element w/name to a set"""
-        pkg = ElementTree.SubElement(parent, 'package')
-        name_el = ElementTree.SubElement(pkg, 'name')
-        name_el.text = name
-
-    def _addPackageSet(self, parent, set_name, package_names):
-        """Add a package set given a name and list of package names"""
-        pkg_set = ElementTree.SubElement(parent, 'packageSet')
-        pkg_set_name = ElementTree.SubElement(pkg_set, 'name')
-        pkg_set_name.text = set_name
-
-        pkgs = ElementTree.SubElement(pkg_set, 'packages')
-        for pkg_name in package_names:
-            self._addPackage(pkgs, pkg_name)
-
-    def _addOverrides(self, aam_info):
-        """Add the overrideXML parts for disabling CCDA"""
-        overridexml = ElementTree.SubElement(aam_info, 'overrideXML')
-        override_app = ElementTree.SubElement(overridexml, 'application')
-        package_sets = ElementTree.SubElement(override_app, 'packageSets')
-
-        for sap, packages in ACC_PACKAGE_SETS.items():
-            self._addPackageSet(package_sets, sap, packages)
-
-    def _removeASUPackages(self):
-        """Remove ASU packages"""
-        asu_appinfo_path = os.path.join(self.env['pkg_path'], 'Contents', 'Resources', 'ASU', 'packages',
-                                        'ApplicationInfo.xml')
-        asu_appinfo = ElementTree.parse(asu_appinfo_path)
-        asu_appinfo_root = asu_appinfo.getroot()
-
-        acc_packageset = asu_appinfo_root.find(".//packageSet[name='ACC']/packages")
-        if acc_packageset is None:
-            raise ProcessorError('Tried to modify ACC installation, but no packageSet element was found. This should' +
-                                 'never happen')
-
-        adc_packageset = asu_appinfo_root.find(".//packageSet[name='ADC']/packages")
-        if adc_packageset is None:
-            raise ProcessorError('Tried to modify ACC(ADC) installation, but no packageSet element was found. This should' +
-                                 'never happen')
-
-        packages_to_remove = [
-            'ACCC',
-            'Utils',
-            'CoreSync',
-            'CoreSyncExtension',
-            'LiveType',
-            'ExchangePlugin',
-            'DesignLibraryPlugin',
-            'SynKit',
-            'CCSyncPlugin',
-            'CCLibrary',
-            'HomePanel',
-            'AssetsPanel',
-            'FilesPanel',
-            'FontsPanel',
-            'MarketPanel',
-            'BehancePanel',
-            'SPanel',
-            'CCXProcess'
-        ]
-
-        # also remove package 'ADC' from 'ADC' set
-
-        for to_remove in packages_to_remove:
-            remove_pkg = acc_packageset.find(".//package[name='{}']".format(to_remove))
-            if remove_pkg is not None:
-                self.output('Removing package {}'.format(to_remove))
-                self.output(remove_pkg)
-                acc_packageset.remove(remove_pkg)
-            else:
-                self.output('Could not find package "{}" to remove.'.format(to_remove))
-
-        with open(asu_appinfo_path, 'wb') as fd:
-            fd.write(ElementTree.tostring(asu_appinfo_root))
-
-    # <ACCPanelMaskingConfig>
-    # <config>
-    #     <panel>
-    #         <name>AppsPanel</name>
-    #         <visible>false</visible>
-    #     </panel>
-    #     <feature>
-    #       <name>SelfServeInstalls</name>
-    #       <enabled>false</enabled>
-    #     </feature>
-    # </config>
-    # </ACCPanelMaskingConfig>
-    def _addPanelMasking(self, root):
-        """Disable the apps and updates panels.
-
-        AppsPanel = false
-        SelfServeInstalls = false
-        """
-        panels = root.findall('.//Configurations/ACCPanelMaskingConfig/config')
-
-        for panel_or_feature in panels:
-            self.output(panel_or_feature)
-        return root
-
-
-    def _suppressCcda(self, root):
-        """Suppress the CCDA from being installed."""
-        acc = root.find('.//Configurations/SuppressOptions/ACC')
-        if acc is None:
-            raise ProcessorError('Expected to find element .//Configurations/SuppressOptions/ACC')
 
-        acc_suppressed = acc.get('suppress')
-        self.output('Creative Cloud Desktop Application (ACC) suppressed? {}'.format(acc_suppressed))
+    def build_policy(self):
+        """Compile the policy from the build_policy input, or from suppress_ccda if none was given."""
+        policy = self.env.get('build_policy')
+        if policy is None:
+            policy = SUPPRESS_CCDA_POLICY if self.env.get('suppress_ccda', False) else {}
 
-        if acc_suppressed == 'true':
-            self.output('Already suppressed, no changes required.')
-        else:
-            self.output('Setting ACC suppress to True')
-            acc.set('suppress', 'true')
+        try:
+            return compile_policy(policy)
+        except PolicyError as err:
+            raise ProcessorError('Invalid build_policy: {}'.format(err))
 
-        update = root.find('.//Configurations/SuppressOptions/Update')
-        if update is None:
-            raise ProcessorError('Expected to find element .//Configurations/SuppressOptions/Update')
+    def apply(self, load, apply_fn, dry_run):
+        """Apply part of the policy to an XML file of the package.
 
-        update_suppressed = update.get('isEnabled')
-        self.output('User initiated updates suppressed? {}'.format(update_suppressed))
-
-        if update_suppressed == '1':
-            self.output('Already suppressed, no changes required.')
+        Args:
+            load (callable): Returns the file's parsed metadata from ccplib.pkgmeta, shared with the other processors
+        Returns:
+            list: Unified diff lines of the changes made.
+        """
+        # Not needed when the package is unchanged since the last run, so loaded on demand
+        import difflib
+
+        doc = load(self.env['pkg_path']).document
+        path = doc.path
+        before = doc.tostring()
+        try:
+            changes = apply_fn(doc.getroot())
+        except PolicyError as err:
+            pkgmeta.invalidate(path)
+            raise ProcessorError('Unable to modify {}: {}'.format(path, err))
+
+        log = ProcessorLog(self)
+        for change in changes:
+            log.detail(change)
+        if not changes:
+            self.output('{} already up to date'.format(os.path.basename(path)))
+            return []
+        log.info('{} change(s) to {}', len(changes), os.path.basename(path))
+
+        doc.changed = True
+        diff = difflib.unified_diff(
+            before.decode(doc.encoding).splitlines(True), doc.tostring().decode(doc.encoding).splitlines(True),
+            path, path + ' (modified)')
+        if dry_run:
+            # The shared tree was modified but not written
+            pkgmeta.invalidate(path)
         else:
-            self.output('Setting Update isEnabled to 0')
-            update.set('isEnabled', '0')
-
-        aam_info = root.find('.//AAMInfo')
-
-        package_sets = root.find('.//AAMInfo/overrideXML/application/packageSets')
-        if package_sets is None:
-            self.output('Need to add overrides for ACC')
-            self._addOverrides(aam_info)
-
-        return root
+            doc.save()
+            pkgmeta.saved(path)
+            self.output('{} modified'.format(os.path.basename(path)))
+        return [line if line.endswith('\n') else line + '\n' for line in diff]
 
+    @profiled
     def main(self):
         if not os.path.exists(self.env['pkg_path']):
             raise ProcessorError('The specified package does not exist: {}'.format(self.env['pkg_path']))
 
-        option_xml_path = os.path.join(self.env['pkg_path'], 'Contents', 'Resources', 'optionXML.xml')
-        option_xml = ElementTree.parse(option_xml_path)
-        root = option_xml.getroot()
-
-        if self.env.get('suppress_ccda', False):
-            modified_root = self._suppressCcda(root)
-            modified_root = self._addPanelMasking(modified_root)
-
-            self._removeASUPackages()
-
-            with open(option_xml_path, 'wb') as fd:
-                fd.write(ElementTree.tostring(modified_root))
+        option_xml_path = pkgmeta.option_xml_path(self.env['pkg_path'])
+        asu_appinfo_path = pkgmeta.application_info_path(self.env['pkg_path'])
+        policy = self.build_policy()
+        dry_run = str(self.env.get('dry_run', False)).lower() == 'true'
+        self.env['build_modifier_diff'] = ''
+
+        # Skip parsing entirely if the files are exactly as we left them after the last run
+        state_path = os.path.join(self.env['RECIPE_CACHE_DIR'], '.ccp_buildmodifier_state.json')
+        fingerprint_paths = [option_xml_path, asu_appinfo_path]
+        if not dry_run and load_state(state_path).get('fingerprint') == stat_fingerprint(fingerprint_paths,
+                                                                                       policy.canonical()):
+            self.output('Package was already modified by a previous run, no changes required.')
+            return
+
+        diff = []
+        if policy.modifies_option_xml():
+            diff.extend(self.apply(pkgmeta.option_xml, policy.apply_option_xml, dry_run))
+
+        if policy.modifies_application_info():
+            if not os.path.exists(asu_appinfo_path):
+                raise ProcessorError('build_policy removes packages, but the package has no {}'.format(
+                    asu_appinfo_path))
+            diff.extend(self.apply(pkgmeta.application_info, policy.apply_application_info, dry_run))
+
+        self.env['build_modifier_diff'] = ''.join(diff)
+        if dry_run:
+            log = ProcessorLog(self)
+            self.output('Dry run, the package was not modified. Changes which would be made:')
+            if self.env['build_modifier_diff']:
+                log.dump('build-modifier-diff', self.env['build_modifier_diff'], level=0)
+                log.detail(self.env['build_modifier_diff'])
+            else:
+                self.output('(none)')
+            return
 
-            self.output('OptionXML modified')
+        save_state(state_path, {'fingerprint': stat_fingerprint(fingerprint_paths, policy.canonical())})
 
 
 if __name__ == "__main__":
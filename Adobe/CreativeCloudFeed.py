@@ -18,25 +18,21 @@ import sys
 import os.path
 import string
 import json
+import time
 import urllib2
-from tempfile import mkdtemp
-from urllib import urlencode
-from distutils.version import LooseVersion as LV
-from xml.etree import ElementTree
-
-# for debugging
-from pprint import pprint
 
 from autopkglib import Processor, ProcessorError
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ccplib import cachebudget, catalog, feedhistory, feedstore, urlcache  # pylint: disable=wrong-import-position
+from ccplib.catalog import CDN_SECURE_URL, FEED_URL, HEADERS, UPDATE_DESC_URL  # pylint: disable=wrong-import-position
+from ccplib.profiling import profiled  # pylint: disable=wrong-import-position
+
 __all__ = ["CreativeCloudFeed"]
 
 AAMEE_URL = 'https://prod-rel-ffc.oobesaas.adobe.com/adobe-ffc-external/aamee/v2/products/all'
-BASE_URL = 'https://prod-rel-ffc-ccm.oobesaas.adobe.com/adobe-ffc-external/core/v4/products/all'
-CDN_SECURE_URL = 'https://ccmdls.adobe.com'
-UPDATE_DESC_URL = 'https://prod-rel-ffc.oobesaas.adobe.com/adobe-ffc-external/core/v1/update/description'
+BASE_URL = FEED_URL
 UPDATE_FEED_URL_MAC = 'https://swupmf.adobe.com/webfeed/oobe/aam20/mac/updaterfeed.xml'
-HEADERS = {'User-Agent': 'Creative Cloud', 'x-adobe-app-id': 'AUSST_4_0'}
 
 
 class CreativeCloudFeed(Processor):
@@ -77,6 +73,44 @@ class CreativeCloudFeed(Processor):
             "required": False,
             "default": True,
             "description": "Write a product.json file to the cache directory from the selected product fragment"
+        },
+        "feed_ttl": {
+            "required": False,
+            "description": ("Seconds for which the parsed feed is reused by other recipes run in the same autopkg "
+                            "process (default 900). 0 always fetches the feed."),
+        },
+        "refresh_feed": {
+            "required": False,
+            "default": False,
+            "description": "Discard any feed already fetched by this autopkg process and fetch it again",
+        },
+        "url_cache_dir": {
+            "required": False,
+            "description": ("Where manifests, proxy XML, release notes and icons are cached, and where "
+                            "prefetch_ccp_catalog writes them (default CACHE_DIR/ccp-url-cache)"),
+        },
+        "url_cache_max_age": {
+            "required": False,
+            "description": "Seconds for which a cached manifest, proxy XML, release note or icon is used (default 86400)",
+        },
+        "feed_history": {
+            "required": False,
+            "default": False,
+            "description": ("Record every product version in the feed, and when it was first and last seen, in a "
+                            "SQLite database"),
+        },
+        "feed_history_path": {
+            "required": False,
+            "description": "Path of the feed history database (default CACHE_DIR/ccp-feed-history.sqlite)",
+        },
+        "ccp_profile": {
+            "required": False,
+            "description": ("Profile this processor with cProfile and an allocation tracer, writing reports to "
+                            "RECIPE_CACHE_DIR/profiles. Can also be enabled with the CCP_PROFILE environment variable."),
+        },
+        "ccp_profile_top": {
+            "required": False,
+            "description": "Number of hotspots to print when profiling (default 20).",
         }
     }
 
@@ -110,46 +144,53 @@ class CreativeCloudFeed(Processor):
         },
         "proxy_version": {
             "description": "The product version listed in the proxy file, which usually has more digits"
+        },
+        "version_first_seen": {
+            "description": ("When the version first appeared in the feed, as an ISO 8601 UTC time, if feed_history "
+                            "is enabled")
         }
     }
 
     def feed_url(self, channels, platforms):
         """Build the GET query parameters for the product feed."""
-        params = [
-            ('payload', 'true'),
-            ('productType', 'Desktop'),
-            ('_type', 'json')
-        ]
-        for ch in channels:
-            params.append(('channel', ch))
-
-        for pl in platforms:
-            params.append(('platform', pl))
-
-        return BASE_URL + '?' + urlencode(params)
+        return catalog.feed_url(BASE_URL, channels, platforms)
 
     def desc_url(self, sapcode, version, platform, language):
         """Build the query for fetching an update description"""
-        params = [
-            ('name', sapcode),
-            ('version', version),
-            ('platform', platform),
-            ('language', language)
-        ]
+        return catalog.desc_url(sapcode, version, platform, language)
+
+    def url_cache(self):
+        cache_dir = self.env.get('url_cache_dir') or urlcache.default_cache_dir(self.env.get('CACHE_DIR'))
+        max_age = self.env.get('url_cache_max_age')
+        return urlcache.URLCache(cache_dir, urlcache.DEFAULT_MAX_AGE if max_age is None else int(max_age))
 
-        return UPDATE_DESC_URL + '?' + urlencode(params)
+    def fetch_url(self, url):
+        """Fetch a release note through the URL cache."""
+        content, cached = self.url_cache().fetch(url, HEADERS)
+        if cached:
+            self.output('Using cached copy of {}'.format(url))
+        return content
+
+    def fetch_file(self, url, name):
+        """Fetch a manifest, proxy or icon through the URL cache into RECIPE_CACHE_DIR/name.
+
+        The document is streamed to disk and replaces the file atomically, so it is never held in memory and an
+        interrupted fetch does not leave a truncated file behind.
+
+        :returns The path of the file
+        """
+        path, cached = self.url_cache().fetch_file(url, HEADERS, os.path.join(self.env['RECIPE_CACHE_DIR'], name))
+        if cached:
+            self.output('Using cached copy of {}'.format(url))
+        return path
 
     def fetch_proxy_data(self, proxy_data_url):
         """Fetch the proxy data to get additional information about the product."""
         self.output('Fetching proxy data from {}'.format(proxy_data_url))
-        req = urllib2.Request(proxy_data_url, headers=HEADERS)
-        content = urllib2.urlopen(req).read()
-
-        # Write out the proxy for debugging purposes
-        with open('{}/proxy.xml'.format(self.env['RECIPE_CACHE_DIR']), 'w+') as fd:
-            fd.write(content)
+        path = self.fetch_file(proxy_data_url, 'proxy.xml')
 
-        proxy_data = ElementTree.fromstring(content)
+        from xml.etree import ElementTree
+        proxy_data = ElementTree.parse(path).getroot()
         return proxy_data
 
     def fetch_manifest(self, manifest_url):
@@ -159,14 +200,10 @@ class CreativeCloudFeed(Processor):
         :returns A tuple of (manifest, proxy) ElementTree objects
         """
         self.output('Fetching manifest.xml from {}'.format(manifest_url))
-        req = urllib2.Request(manifest_url, headers=HEADERS)
-        content = urllib2.urlopen(req).read()
-
-        # Write out the manifest for debugging purposes
-        with open('{}/manifest.xml'.format(self.env['RECIPE_CACHE_DIR']), 'w+') as fd:
-            fd.write(content)
+        path = self.fetch_file(manifest_url, 'manifest.xml')
 
-        manifest = ElementTree.fromstring(content)
+        from xml.etree import ElementTree
+        manifest = ElementTree.parse(path).getroot()
 
         proxy_data_url_el = manifest.find('asset_list/asset/proxy_data')
         if proxy_data_url_el is None:
@@ -190,53 +227,63 @@ class CreativeCloudFeed(Processor):
         """
         url = self.desc_url(sapcode, version, platform, language)
         self.output('Fetching release notes from: {}'.format(url))
-        req = urllib2.Request(url, headers=HEADERS)
-        raw_data = urllib2.urlopen(req).read()
+        raw_data = self.fetch_url(url)
 
         return raw_data
 
     def fetch(self, channels, platforms):
-        """Download the main feed"""
+        """Return the main feed, parsed once per autopkg process and feed_ttl window."""
         url = self.feed_url(channels, platforms)
-        self.output('Fetching from feed URL: {}'.format(url))
+        if str(self.env.get('refresh_feed', False)).lower() == 'true':
+            feedstore.invalidate(url)
 
-        req = urllib2.Request(url, headers=HEADERS)
-        data = json.loads(urllib2.urlopen(req).read())
+        ttl = self.env.get('feed_ttl')
+        return feedstore.get_feed(url, self.download_feed, feedstore.DEFAULT_TTL if ttl is None else int(ttl))
 
-        return data
+    def download_feed(self, url):
+        """Download the raw JSON of the main feed"""
+        self.output('Fetching from feed URL: {}'.format(url))
 
-    def filter_product(self, data, sap_code, base_version, version='latest'):
-        """Find product information from a feed dump given a single sap_code, base version and optional version."""
-        product = {'version': '0.0.1'}
+        req = urllib2.Request(url, headers=HEADERS)
+        return urllib2.urlopen(req).read()
+
+    def record_feed_history(self, feed, product):
+        """Ingest the feed into the history database, if feed_history is enabled, and output when the
+        selected product version first appeared."""
+        if str(self.env.get('feed_history', False)).lower() != 'true':
+            return
+
+        path = self.env.get('feed_history_path') or feedhistory.default_path(self.env.get('CACHE_DIR'))
+        history = feedhistory.FeedHistory(path)
+        try:
+            added = history.ingest(feed)
+            self.output('Recorded feed in history {}, {} new release(s)'.format(path, added))
+            first_seen = history.first_seen(product.id, product.version)
+        finally:
+            history.close()
+
+        if first_seen is None:
+            # Products without platforms are not recorded in the history
+            self.output('Version {} of {} is not in the feed history, version_first_seen is not set'.format(
+                product.version, product.id))
+            return
+
+        self.env['version_first_seen'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(first_seen))
+        self.output('Version {} first seen in the feed at {}'.format(product.version, self.env['version_first_seen']))
+
+    def record_cache_artifacts(self):
+        """Record the documents downloaded into RECIPE_CACHE_DIR in the CCP artifact index, so that they count
+        towards the cache_budget of CreativeCloudPackager."""
+        cache_dir = self.env.get('CACHE_DIR') or os.path.dirname(self.env['RECIPE_CACHE_DIR'])
+        index = cachebudget.ArtifactIndex(cache_dir)
+        for name in ('manifest.xml', 'proxy.xml', 'Icon.png'):
+            index.touch(os.path.join(self.env['RECIPE_CACHE_DIR'], name), self.env['RECIPE_CACHE_DIR'], refresh=True)
+        index.save()
+
+    def filter_product(self, feed, sap_code, base_version, version='latest'):
+        """Find the product record in a feed given a single sap_code, base version and optional version."""
         channels = string.split(self.env.get('channels'), ',')
-
-        #12 inputs to ccpinfo dict testing w BridgeCC
-        for channel in data['channel']:
-            if channel['name'] not in channels:
-                continue
-
-            for prod in channel['products']['product']:
-                if prod['id'] != sap_code:
-                    continue
-
-                if base_version and prod['platforms']['platform'][0]['languageSet'][0].get('baseVersion') != base_version:
-                    continue
-
-                if 'version' not in prod:
-                    self.output('product has no version: {}'.format(prod['displayName']))
-                    continue
-
-                if version == "latest":
-                    if LV(prod['version']) > LV(product['version']):
-                        product = prod
-                else:
-                    if prod['version'] == version:
-                        product = prod
-
-        if 'platforms' not in product:
-            return None
-
-        return product
+        return catalog.find_product(feed, channels, sap_code, base_version, version)
 
     def fetch_extended_product_info(self, product, platform, cdn):
         """Fetch extended information about a product such as: manifest,
@@ -245,37 +292,21 @@ class CreativeCloudFeed(Processor):
         channels = string.split(self.env.get('channels'), ',')
 
         # Fetch Icon
-        if 'productIcons' in product:
-            largest_width = 0
-            largest_icon_url = None
-            for icon in product['productIcons'].get('icon', []):
-                self.output('Considering icon: {}'.format(icon))
-                w, h = icon.get('size', '0x0').split('x', 2)
-                if int(w) > largest_width:
-                    largest_width = int(w)
-                    largest_icon_url = icon.get('value')
-
-            self.env['icon_url'] = largest_icon_url
-
-        if 'icon_url' in self.env and self.env.get('fetch_icon', 'false').lower() == 'true':
-            self.output('Fetching icon from {}'.format(self.env['icon_url']))
-            req = urllib2.Request(self.env['icon_url'], headers=HEADERS)
-            content = urllib2.urlopen(req).read()
-
-            with open('{}/Icon.png'.format(self.env['RECIPE_CACHE_DIR']), 'w+') as fd:
-                fd.write(content)
+        if product.icons:
+            self.env['icon_url'] = catalog.largest_icon_url(product)
+            self.output('Selected icon: {}'.format(self.env['icon_url']))
 
-            extended_info['icon_path'] = '{}/Icon.png'.format(self.env['RECIPE_CACHE_DIR'])
+        if self.env.get('icon_url') and self.env.get('fetch_icon', 'false').lower() == 'true':
+            self.output('Fetching icon from {}'.format(self.env['icon_url']))
+            extended_info['icon_path'] = self.fetch_file(self.env['icon_url'], 'Icon.png')
         else:
             self.output('An icon was not requested or the url did not exist.')
             extended_info['icon_path'] = ''
 
         # Fetch Manifest + Proxy
-        if 'urls' in platform['languageSet'][0] and 'manifestURL' in platform['languageSet'][0]['urls']:
-            extended_info['manifest_url'] = '{}{}'.format(
-                cdn[channels[0]]['secure'],
-                platform['languageSet'][0]['urls'].get('manifestURL')
-            )
+        manifest_url = catalog.manifest_url(platform, cdn.get(channels[0]))
+        if manifest_url is not None:
+            extended_info['manifest_url'] = manifest_url
 
             if self.env.get('parse_proxy_xml', False):
                 self.output('Processor will fetch manifest and proxy xml')
@@ -294,7 +325,8 @@ class CreativeCloudFeed(Processor):
         # Fetch Release Notes
         if self.env.get('fetch_release_notes', 'false').lower() == 'true':
             self.output('Processor will fetch update release notes')
-            desc = self.fetch_release_notes(product['id'], product['version'], 'osx10-64', 'en_US')
+            desc = self.fetch_release_notes(product.id, product.version, 'osx10-64', 'en_US')
+            from xml.etree import ElementTree
             rn_etree = ElementTree.fromstring(desc)
             release_notes_el = rn_etree.find('UpdateDescription')
 
@@ -322,7 +354,7 @@ class CreativeCloudFeed(Processor):
             with open(cache_json_path, 'r') as fd:
                 content = fd.read()
                 data = json.loads(content)
-                if data.get('version', '') == output_product.get('version'):
+                if data.get('version', '') == output_product.version:
                     self.output('The feed version matches the last fetched version, no download is required')
                     self.env['download_changed'] = False
                 else:
@@ -332,7 +364,7 @@ class CreativeCloudFeed(Processor):
         if self.env.get('write_product_json', True):
             self.output('Caching product information to {}'.format(cache_json_path))
             with open(cache_json_path, 'w+') as fd:
-                fd.write(json.dumps(output_product))
+                fd.write(json.dumps(output_product.fragment()))
 
     def validate_input(self):
         """Validate processor inputs"""
@@ -348,18 +380,19 @@ class CreativeCloudFeed(Processor):
                 raise ProcessorError('ccpinfo product did not contain a SAP Code')
 
 
+    @profiled
     def main(self):
         ccpinfo = self.env['ccpinfo']
         channels = string.split(self.env.get('channels'), ',')
         platforms = string.split(self.env.get('platforms'), ',')
 
-        data = self.fetch(channels, platforms)
+        feed = self.fetch(channels, platforms)
         self.validate_input()
 
         channel_cdn = {}
-        for channel in data['channel']:
-            if channel['name'] in channels:
-                channel_cdn[channel['name']] = channel.get('cdn')
+        for channel in feed.channels:
+            if channel.name in channels:
+                channel_cdn[channel.name] = channel.cdn
 
         # Resolve actual build versions from the feed
         products = []
@@ -368,17 +401,16 @@ class CreativeCloudFeed(Processor):
             baseversion = product_info.get('baseVersion', '')
             version = product_info.get('version', 'latest')
 
-            product = self.filter_product(data, sapcode, baseversion, version)
+            product = self.filter_product(feed, sapcode, baseversion, version)
             if product is None:
                 raise ProcessorError(
                     'No package matched the SAP code ({0}), base version ({1}), '
                     'and version ({2}) combination you specified.'.format(sapcode, baseversion, version)
                 )
 
-            self.output('Found matching product {}, version: {}'.format(product.get('displayName'),
-                                                                        product.get('version')))
+            self.output('Found matching product {}, version: {}'.format(product.display_name, product.version))
 
-            product_info['version'] = product['version']
+            product_info['version'] = product.version
             product_info['requestedVersion'] = version
             products.append(product)
             self.cache_product_info(product_info, product)
@@ -386,17 +418,21 @@ class CreativeCloudFeed(Processor):
         if len(products) == 1:  # Single product, will use normal version, notes, icon
             product = products[0]
 
-            first_platform = {}
-            for platform in product['platforms']['platform']:
-                if platform['id'] in platforms:
+            first_platform = None
+            for platform in product.platforms:
+                if platform.id in platforms:
                     first_platform = platform
                     break
 
-            if first_platform.get('packageType') == 'RIBS':
+            if first_platform is None:
+                raise ProcessorError('{} {} is not available for the platform(s): {}'.format(
+                    product.id, product.version, ', '.join(platforms)))
+
+            if first_platform.package_type == 'RIBS':
                 raise ProcessorError('This process does not support RIBS style packages.')
 
-            if len(first_platform['systemCompatibility']['operatingSystem']['range']) > 0:
-                compatibility_range = first_platform['systemCompatibility']['operatingSystem']['range'][0]
+            if len(first_platform.os_range) > 0:
+                compatibility_range = first_platform.os_range[0]
                 # systemCompatibility currently has values like:
                 # 10.x.0-
                 # 10.10- (no minor version specified)
@@ -407,13 +443,15 @@ class CreativeCloudFeed(Processor):
                 self.env['minimum_os_version'] = ''
 
             # output variable naming has been kept as close to pkginfo names as possible in order to feed munkiimport
-            self.env['product_info_url'] = product.get('productInfoPage')
-            self.env['version'] = product.get('version')
-            self.env['display_name'] = product.get('displayName')
+            self.env['product_info_url'] = product.product_info_page
+            self.env['version'] = product.version
+            self.env['display_name'] = product.display_name
+            self.record_feed_history(feed, product)
 
             extended_info = self.fetch_extended_product_info(product, first_platform, channel_cdn)
             for k, v in extended_info.items():
                 self.env[k] = v
+            self.record_cache_artifacts()
 
         else:  # more than one product: indeterminate version, concatenated notes, no icon
             raise ProcessorError('Multi product packages not yet supported')
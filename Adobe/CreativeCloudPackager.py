@@ -22,14 +22,18 @@
 import os
 import shutil
 import subprocess
-import uuid
-import FoundationPlist
+import sys
+import time
 
-from xml.etree import ElementTree
-from Foundation import CFPreferencesCopyAppValue, CFPreferencesSetAppValue
+# ElementTree is imported by the functions which use it, so that importing the processor doesn't load it.
 
 from autopkglib import Processor, ProcessorError
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ccplib import cachebudget, pdapplog, pkgmeta, plists  # pylint: disable=wrong-import-position
+from ccplib.logutil import ProcessorLog  # pylint: disable=wrong-import-position
+from ccplib.profiling import profiled  # pylint: disable=wrong-import-position
+
 __all__ = ["CreativeCloudPackager"]
 
 # https://helpx.adobe.com/creative-cloud/packager/ccp-automation.html
@@ -39,6 +43,9 @@ __all__ = ["CreativeCloudPackager"]
 CUSTOMER_TYPES = ["enterprise", "team"]
 CCP_PREFS_FILE = os.path.expanduser(
     "~/Library/Application Support/Adobe/CCP/CCPPreferences.xml")
+# PDApp.log has one-second timestamps, so a build logged this many seconds before PDApp was started may be ours
+PDAPP_LOG_SLACK = 2
+PDAPP_PATH = '/Applications/Utilities/Adobe Application Manager/core/Adobe Application Manager.app/Contents/MacOS/PDApp'
 
 CCP_ERROR_MSGS = {
     "CustomerTypeMismatchError": \
@@ -71,6 +78,33 @@ CCP_ERROR_MSGS = {
 # </error>
 # </TronResult>
 
+
+def _indent_xml(elem, level=0):
+    """Indent an element tree in place, two spaces per level like `xmllint --format`."""
+    indent = "\n" + level * "  "
+    if len(elem):
+        if not elem.text or not elem.text.strip():
+            elem.text = indent + "  "
+        for child in elem:
+            _indent_xml(child, level + 1)
+        # the last child closes the parent, so it dedents back to our level
+        if not child.tail or not child.tail.strip():
+            child.tail = indent
+    if level and (not elem.tail or not elem.tail.strip()):
+        elem.tail = indent
+
+
+def serialize_xml(root):
+    """Serialize an element tree as a pretty-printed UTF-8 document.
+
+    Works entirely in-process, so the same tree always produces the same bytes."""
+    from xml.etree import ElementTree
+
+    _indent_xml(root)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n' +
+            ElementTree.tostring(root, encoding='utf-8') + '\n')
+
+
 class CreativeCloudPackager(Processor):
     """Create and execute a CCP automation file. The package output will always be the autopkg cache directory"""
     description = "Runs the CCP packager."
@@ -83,6 +117,26 @@ class CreativeCloudPackager(Processor):
             "required": True,
             "description": "The output package name",
         },
+        "cache_budget": {
+            "required": False,
+            "description": ("Size budget for the builds and documents of every CCP recipe in CACHE_DIR, eg. '200G'. "
+                            "The least recently used builds of other recipes are removed to stay within it. "
+                            "Without a budget, nothing is removed."),
+        },
+        "pdapp_path": {
+            "required": False,
+            "default": PDAPP_PATH,
+            "description": "Path of the PDApp executable, eg. a stand-in which build farm tests run instead of CCP.",
+        },
+        "ccp_profile": {
+            "required": False,
+            "description": ("Profile this processor with cProfile and an allocation tracer, writing reports to "
+                            "RECIPE_CACHE_DIR/profiles. Can also be enabled with the CCP_PROFILE environment variable."),
+        },
+        "ccp_profile_top": {
+            "required": False,
+            "description": "Number of hotspots to print when profiling (default 20).",
+        }
     }
 
     output_variables = {
@@ -104,10 +158,15 @@ class CreativeCloudPackager(Processor):
         "creative_cloud_packager_summary_result": {
             "description": "Description of interesting results."
         },
+        "cache_reclaimed_bytes": {
+            "description": "Bytes freed by removing least recently used builds to stay within cache_budget."
+        },
     }
 
     def ccp_preferences(self):
         """Get information about the currently signed-in CCP user, if available."""
+        from xml.etree import ElementTree
+
         prefs_path = os.path.expanduser(CCP_PREFS_FILE)
         prefs_elem = ElementTree.parse(prefs_path).getroot()
 
@@ -118,9 +177,15 @@ class CreativeCloudPackager(Processor):
             prefs["customer_type"] = user_type_elem.text.lower().split('_')[0]
         return prefs
 
-    def automation_xml(self):
+    def automation_xml(self, packaging_job_id=None):
         """Returns the complete pretty-formatted XML string for a CCP automation
-        session."""
+        session.
+
+        The output is byte-stable for a given ccpinfo, package name, cache
+        directory and packaging_job_id. A new job id is generated if none is
+        given."""
+        from xml.etree import ElementTree
+
         # params = self.automation_manifest_from_ccpinfo()
         params = dict(self.env['ccpinfo'])
 
@@ -135,12 +200,17 @@ class CreativeCloudPackager(Processor):
             else:
                 params['IncludeUpdates'] = False
 
+        if packaging_job_id is None:
+            # uuid loads ctypes and libuuid on Python 2, so only import it when a new job id is needed
+            import uuid
+            packaging_job_id = str(uuid.uuid4())
+
         # add additional parameters for which there's no need for the user to
         # supply in the 'ccpinfo' input
         params.update({
             'packageName': self.env['package_name'],
             'outputLocation': self.env['RECIPE_CACHE_DIR'],
-            'packaging_job_id': str(uuid.uuid4()),
+            'packaging_job_id': packaging_job_id,
             'is64Bit': True,
         })
 
@@ -161,11 +231,14 @@ class CreativeCloudPackager(Processor):
         pkg_elem.append(lang)
         del params['Language']
 
-        # Input keys now match the target XML to avoid transforming
-        for param, value in params.iteritems():
+        # Input keys now match the target XML to avoid transforming. Keys are
+        # sorted so that the same ccpinfo always serializes to the same bytes.
+        for param in sorted(params):
             if param == 'Products':
                 continue
 
+            value = params[param]
+
             elem = ElementTree.Element(param)
             if isinstance(value, bool):
                 value = str(value).lower()
@@ -196,28 +269,77 @@ class CreativeCloudPackager(Processor):
         xml_root = ElementTree.Element('CCPPackage')
         xml_root.append(pkg_elem)
 
-        # run it through `xmllint --format` just to save it pretty :/
-        xml_string = ElementTree.tostring(xml_root, encoding='utf8', method='xml')
-        proc = subprocess.Popen(['/usr/bin/xmllint', '--format', '-'],
-                                stdin=subprocess.PIPE,
-                                stdout=subprocess.PIPE)
-        out, err = proc.communicate(xml_string)
-        if proc.returncode:
-            raise ProcessorError("Unexpected error from running XML output through "
-                                 "xmllint. Stderr output:\n%s" % err)
-        return out
+        return serialize_xml(xml_root)
+
+    def saved_ccpinfo(self, path):
+        """Return the ccpinfo saved with the previous build, or None if there is none."""
+        if not os.path.exists(path):
+            return None
+        try:
+            return plists.read_plist(path)
+        except (plists.PlistError, IOError, ValueError) as err:
+            self.output("Ignoring unreadable %s: %s" % (path, err))
+            return None
+
+    def pdapp_log(self):
+        """Return the PDApp.log analyzer, updated with whatever was logged since it was last used."""
+        analyzer = pdapplog.LogAnalyzer(state_path=pdapplog.default_state_path(self.env.get('CACHE_DIR')))
+        analyzer.update()
+        return analyzer
+
+    def pdapp_build(self, started):
+        """Return the last build in PDApp.log if it began after PDApp was started at started, or None."""
+        build = self.pdapp_log().last_build()
+        if build is None or build['start'] < started - PDAPP_LOG_SLACK:
+            return None
+        return build
+
+    def cache_budget(self):
+        """Return cache_budget in bytes, or None if no budget was given."""
+        budget = self.env.get('cache_budget')
+        if not budget:
+            return None
+        try:
+            return cachebudget.parse_size(budget)
+        except ValueError as err:
+            raise ProcessorError("Invalid cache_budget: %s" % err)
+
+    def manage_cache(self, build_dir, budget, refresh=False):
+        """Record that this recipe's build was used, then remove the least recently used builds of other
+        recipes until the CCP artifacts in CACHE_DIR fit within budget."""
+        cache_dir = self.env.get('CACHE_DIR') or os.path.dirname(self.env['RECIPE_CACHE_DIR'])
+        index = cachebudget.ArtifactIndex(cache_dir)
+        index.touch(build_dir, self.env['RECIPE_CACHE_DIR'], refresh)
+        index.touch(os.path.join(self.env['RECIPE_CACHE_DIR'], 'automation_xml'), self.env['RECIPE_CACHE_DIR'], refresh)
+
+        if budget is not None:
+            evicted = index.evict(budget, protect=self.env['RECIPE_CACHE_DIR'])
+            reclaimed = sum(size for _, size in evicted)
+            for path, size in evicted:
+                self.output("Removed %s (%s) to stay within cache_budget" % (path, cachebudget.format_size(size)))
+            if evicted:
+                self.output("Reclaimed %s, CCP artifacts now use %s of %s" % (
+                    cachebudget.format_size(reclaimed), cachebudget.format_size(index.total_size()),
+                    cachebudget.format_size(budget)))
+            self.env['cache_reclaimed_bytes'] = self.env.get('cache_reclaimed_bytes', 0) + reclaimed
+        index.save()
 
     def set_customer_type(self, ccpinfo):
-        # Set the customer type, using CCP's preferences if none provided
+        # Set the customer type, using CCP's preferences or the org details in PDApp.log if none provided
         if not ccpinfo.get("customerType"):
-            ccp_prefs = self.ccp_preferences()
+            ccp_prefs = self.ccp_preferences() if os.path.exists(CCP_PREFS_FILE) else {}
             self.env['customer_type'] = ccp_prefs.get("customer_type")
+            if self.env.get("customer_type"):
+                self.output("Using customer type '%s' found in CCPPreferences: %s'"
+                            % (self.env['customer_type'], CCP_PREFS_FILE))
+                return
+
+            self.env['customer_type'] = self.pdapp_log().customer_type(ccpinfo.get("organizationName"))
             if not self.env.get("customer_type"):
                 raise ProcessorError(
                     "No customer_type input provided and unable to read one "
-                    "from %s" % CCP_PREFS_FILE)
-            self.output("Using customer type '%s' found in CCPPreferences: %s'"
-                        % (self.env['customer_type'], CCP_PREFS_FILE))
+                    "from %s or %s" % (CCP_PREFS_FILE, pdapplog.LOG_PATH))
+            self.output("Using customer type '%s' found in %s" % (self.env['customer_type'], pdapplog.LOG_PATH))
 
     def is_ccp_running(self):
         """Determine whether CCP is already running. This would prevent us from actually running the automation XML."""
@@ -226,7 +348,7 @@ class CreativeCloudPackager(Processor):
 
     def check_and_disable_appnap_for_pdapp(self):
         """Log a warning if AppNap isn't disabled on the system."""
-        appnap_disabled = CFPreferencesCopyAppValue(
+        appnap_disabled = plists.copy_app_value(
             'NSAppSleepDisabled',
             'com.adobe.PDApp')
         if not appnap_disabled:
@@ -238,7 +360,7 @@ class CreativeCloudPackager(Processor):
                         "Adobe PDApp application. This can be undone using "
                         "this command: 'defaults delete com.adobe.PDApp "
                         "NSAppSleepDisabled")
-            CFPreferencesSetAppValue(
+            plists.set_app_value(
                 'NSAppSleepDisabled',
                 True,
                 'com.adobe.PDApp')
@@ -279,7 +401,13 @@ class CreativeCloudPackager(Processor):
                  "It can be uninstalled using the Uninstaller located at "
                  "'/Applications/Utilities/Adobe Creative Cloud'.") % ccda_path)
 
+    @profiled
     def main(self):
+        from xml.etree import ElementTree
+
+        log = ProcessorLog(self)
+        budget = self.cache_budget()
+        self.env['cache_reclaimed_bytes'] = 0
         if self.env.get("ALLOW_CCDA_INSTALLED", False):
             self.check_ccda_installed()
 
@@ -295,20 +423,29 @@ class CreativeCloudPackager(Processor):
                                                       '.autopkg_manifest.plist')
         self.set_customer_type(self.env['ccpinfo'])
 
-        # ccpinfo Needs pre-processing before comparison to old run
-        new_manifest = self.automation_xml()
-
         # Handle any pre-existing package at the expected location, and end early if it matches our
-        # input manifest
-        if os.path.exists(automation_manifest_plist_path):
-            existing_manifest = FoundationPlist.readPlist(automation_manifest_plist_path)
+        # input manifest. The automation XML is byte-stable, so rendering it again with the job id of
+        # the saved build gives us something we can compare directly.
+        if os.path.exists(saved_automation_xml_path):
+            with open(saved_automation_xml_path, 'r') as fd:
+                existing_manifest = fd.read()
+            existing_job_id = ElementTree.fromstring(existing_manifest).findtext('CreatePackage/packaging_job_id')
+            current_manifest = self.automation_xml(existing_job_id)
             self.output("Found existing CCP package build automation info, comparing")
-            self.output("existing build: %s" % existing_manifest)
-            self.output("current build: %s" % new_manifest)
-            if new_manifest == existing_manifest:
+            log.dump("automation-existing", existing_manifest)
+            log.dump("automation-current", current_manifest)
+            # The automation XML only names the base version of each product, so the product versions
+            # resolved from the feed are compared through the saved ccpinfo
+            if (current_manifest == existing_manifest
+                    and self.saved_ccpinfo(automation_manifest_plist_path) == self.env['ccpinfo']
+                    and os.path.exists(self.env["pkg_path"])):
                 self.output("Returning early because we have an existing package "
                             "with the same parameters.")
+                self.manage_cache(expected_output_root, budget)
                 return
+            self.output("Existing package does not match, or is incomplete, rebuilding")
+
+        new_manifest = self.automation_xml()
 
         # Going forward with building, set up or clear needed directories
         xml_workdir = os.path.join(self.env["RECIPE_CACHE_DIR"], 'automation_xml')
@@ -316,6 +453,8 @@ class CreativeCloudPackager(Processor):
             os.mkdir(xml_workdir)
         if os.path.isdir(expected_output_root):
             shutil.rmtree(expected_output_root)
+        # Make room for the new build
+        self.manage_cache(expected_output_root, budget)
 
         # using .xml as a suffix because CCP's automation mode creates a '<input>_results.xml' file with the assumption
         # that the input ends in '.xml'
@@ -332,18 +471,20 @@ class CreativeCloudPackager(Processor):
         self.check_and_disable_appnap_for_pdapp()
 
         cmd = [
-            '/Applications/Utilities/Adobe Application Manager/core/Adobe Application Manager.app/Contents/MacOS/PDApp',
+            self.env.get('pdapp_path') or PDAPP_PATH,
             '--appletID=CCP_UI',
             '--appletVersion=1.0',
             '--workflow=ccp',
             '--automationMode=ccp_automation',
             '--pkgConfigFile=%s' % xml_path]
         self.output("Executing CCP build command: %s" % " ".join(cmd))
+        started = time.time()
         proc = subprocess.Popen(cmd,
                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         out, _ = proc.communicate()
         if out:
-            self.output("CCP Output: %s" % out)
+            # PDApp's output can be very long, so keep it out of the console but always save it
+            log.dump("pdapp-output", out, level=0)
         exitcode = proc.returncode
         self.output("CCP Exited with status {}".format(exitcode))
 
@@ -358,20 +499,25 @@ class CreativeCloudPackager(Processor):
                 autopkg_error_msg += "Error type: '%s' - " % err_msg_type.text
             if err_msg_type.text in CCP_ERROR_MSGS:
                 autopkg_error_msg += CCP_ERROR_MSGS[err_msg_type.text] + "\n"
+            build = self.pdapp_build(started)
+            if build is not None and build['errors']:
+                autopkg_error_msg += "Errors logged by PDApp during the build: %s\n" % "; ".join(build['errors'])
             autopkg_error_msg += (
-                "Please inspect the PDApp log file at: %s. 'results' XML file "
-                "contents follow: \n%s" % (
-                    os.path.expanduser("~/Library/Logs/PDApp.log"),
-                    open(results_file, 'r').read()))
+                "Please inspect the PDApp log file at: %s, and the 'results' XML file at: %s" % (
+                    pdapplog.LOG_PATH, results_file))
+            log.detail("'results' XML file contents follow: \n{}", open(results_file, 'r').read())
 
             raise ProcessorError(autopkg_error_msg)
 
         if results_elem.find('success') is None:
-            raise ProcessorError(
-                "Unexpected result from CCP, 'results' XML file contents follow: \n{}".format(
-                    open(results_file, 'r').read()
-                )
-            )
+            log.detail("'results' XML file contents follow: \n{}", open(results_file, 'r').read())
+            raise ProcessorError("Unexpected result from CCP, see the 'results' XML file at: %s" % results_file)
+
+        build = self.pdapp_build(started)
+        if build is not None and build['end'] is not None:
+            self.output("CCP build took %d seconds" % (build['end'] - build['start']))
+            for phase, (first, last) in sorted(build['phases'].items(), key=lambda item: item[1][0]):
+                log.detail("{} phase took {} seconds", phase, int(last - first))
 
         # Sanity-check that we really do have our install package!
         if not os.path.exists(self.env["pkg_path"]):
@@ -383,10 +529,13 @@ class CreativeCloudPackager(Processor):
         # later comparison
         shutil.copy(xml_path, saved_automation_xml_path)
         # TODO: we aren't scrubbing the automation XML file at all
-        FoundationPlist.writePlist(
+        plists.write_plist(
             self.env['ccpinfo'],
             automation_manifest_plist_path)
 
+        # Measure the new build and make room for it within the budget
+        self.manage_cache(expected_output_root, budget, refresh=True)
+
         # Save PackageInfo.txt
         packageinfo = os.path.join(expected_output_root, "PackageInfo.txt")
         if os.path.exists(packageinfo):
@@ -396,17 +545,12 @@ class CreativeCloudPackager(Processor):
         if os.path.exists(ccp_path):
             self.env["ccp_path"] = ccp_path
 
-        option_xml_root = ElementTree.parse(os.path.join(
-            self.env["pkg_path"], 'Contents/Resources/optionXML.xml')).getroot()
-
-        # Save the CCP build version
-        self.env["ccp_version"] = ""
-        ccp_version = option_xml_root.find("prodVersion")
-        if ccp_version is None:
+        # Save the CCP build version. optionXML.xml is parsed once, and shared with the processors which follow.
+        self.env["ccp_version"] = pkgmeta.option_xml(self.env["pkg_path"]).prod_version or ""
+        if not self.env["ccp_version"]:
             self.output(
                 "WARNING: Didn't find expected 'prodVersion' key (CCP "
                 "version) in optionXML.xml")
-        self.env["ccp_version"] = ccp_version.text
 
         if len(self.env['ccpinfo']['Products']) == 1:
             built_products = self.env['ccpinfo']['Products'][0]['sapCode']
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=locally-disabled, import-error, invalid-name, no-member
+
+# for now
+# pylint: disable=line-too-long
+
+import json
+import os
+import sys
+
+from autopkglib import Processor, ProcessorError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ccplib import payloadhash  # pylint: disable=wrong-import-position
+from ccplib.fileutil import atomic_write, load_state  # pylint: disable=wrong-import-position
+from ccplib.profiling import profiled  # pylint: disable=wrong-import-position
+
+__all__ = ["CreativeCloudPayloadHasher"]
+
+# The manifest of the last build is kept here as well as next to the .ccp file, because
+# CreativeCloudPackager removes the whole build directory before it builds again.
+PREVIOUS_MANIFEST = ".ccp_payload_hashes.json"
+
+
+class CreativeCloudPayloadHasher(Processor):
+    """Writes a SHA-256 manifest of every payload under Contents/Resources/HD and Setup of the
+    built package, and lists the payloads which changed since the previous build so that later
+    steps can skip or delta-transfer unchanged content."""
+    description = __doc__
+    input_variables = {
+        "pkg_path": {
+            "required": True,
+            "description": "Path to the bundle-style CCP installer pkg.",
+        },
+        "hash_workers": {
+            "required": False,
+            "default": 4,
+            "description": "Maximum number of payloads to hash concurrently.",
+        },
+        "ccp_profile": {
+            "required": False,
+            "description": ("Profile this processor with cProfile and an allocation tracer, writing reports to "
+                            "RECIPE_CACHE_DIR/profiles. Can also be enabled with the CCP_PROFILE environment variable."),
+        },
+        "ccp_profile_top": {
+            "required": False,
+            "description": "Number of hotspots to print when profiling (default 20).",
+        }
+    }
+
+    output_variables = {
+        "payload_manifest_path": {
+            "description": "Path to the hash manifest, written next to the .ccp file in the Build directory.",
+        },
+        "changed_payloads": {
+            "description": ("Paths, relative to pkg_path, of the payloads which were added or changed since "
+                            "the previous build. Every payload is listed after the first build."),
+        },
+        "removed_payloads": {
+            "description": "Paths of the payloads of the previous build which are no longer in the package.",
+        },
+    }
+
+    @profiled
+    def main(self):
+        pkg_path = self.env["pkg_path"]
+        if not os.path.isdir(pkg_path):
+            raise ProcessorError("No bundle-style package found at %s" % pkg_path)
+
+        previous_path = os.path.join(self.env["RECIPE_CACHE_DIR"], PREVIOUS_MANIFEST)
+        previous = load_state(previous_path).get("payloads", {})
+
+        payloads = payloadhash.hash_payloads(pkg_path, previous, int(self.env.get("hash_workers", 4)))
+        diff = payloadhash.diff_manifests(previous, payloads)
+        self.output("%d payload(s): %d added, %d changed, %d removed since the previous build" % (
+            len(payloads), len(diff["added"]), len(diff["changed"]), len(diff["removed"])))
+
+        data = json.dumps({"algorithm": "sha256", "payloads": payloads}, indent=2, sort_keys=True).encode("utf-8")
+        package_name = os.path.basename(pkg_path)
+        if package_name.endswith("_Install.pkg"):
+            package_name = package_name[:-len("_Install.pkg")]
+        manifest_path = os.path.join(os.path.dirname(pkg_path), "%s.payloads.json" % package_name)
+        atomic_write(manifest_path, data)
+        atomic_write(previous_path, data)
+        self.output("Wrote payload hash manifest to %s" % manifest_path)
+
+        self.env["payload_manifest_path"] = manifest_path
+        self.env["changed_payloads"] = diff["added"] + diff["changed"]
+        self.env["removed_payloads"] = diff["removed"]
+
+
+if __name__ == "__main__":
+    processor = CreativeCloudPayloadHasher()
+    processor.execute_shell()
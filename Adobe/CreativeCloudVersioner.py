@@ -19,18 +19,28 @@
 # for now
 # pylint: disable=line-too-long
 
+import glob
+import hashlib
 import json
 import os
 import re
-import zipfile
+import sys
 
-from xml.etree import ElementTree
+# zipfile, ElementTree and multiprocessing are imported by the methods which use them, so that runs
+# answered from the versioner cache don't load them.
 
-import FoundationPlist
 from autopkglib import Processor, ProcessorError
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ccplib import fileutil, pkgmeta, plists  # pylint: disable=wrong-import-position
+from ccplib.logutil import ProcessorLog  # pylint: disable=wrong-import-position
+from ccplib.profiling import profiled  # pylint: disable=wrong-import-position
+
 __all__ = ["CreativeCloudVersioner"]
 
+# Outputs which are restored from the cache when the built package has not changed.
+CACHED_OUTPUTS = ["version", "jss_inventory_name", "additional_pkginfo", "hd_products"]
+
 
 class CreativeCloudVersioner(Processor):
     """Parses generated CCP installers for detailed application path and bundle
@@ -40,10 +50,33 @@ class CreativeCloudVersioner(Processor):
     criteria"""
     description = __doc__
     input_variables = {
-
+        "installs_checksums": {
+            "required": False,
+            "default": False,
+            "description": ("Also add 'file' installs items with the md5checksum of each application's "
+                            "main executable."),
+        },
+        "max_workers": {
+            "required": False,
+            "default": 4,
+            "description": "Maximum number of HD products to scan concurrently.",
+        },
+        "ccp_profile": {
+            "required": False,
+            "description": ("Profile this processor with cProfile and an allocation tracer, writing reports to "
+                            "RECIPE_CACHE_DIR/profiles. Can also be enabled with the CCP_PROFILE environment variable."),
+        },
+        "ccp_profile_top": {
+            "required": False,
+            "description": "Number of hotspots to print when profiling (default 20).",
+        }
     }
 
     output_variables = {
+        "hd_products": {
+            "description": ("Per-product sapCode, version and installs items for every HD product "
+                            "in the package."),
+        },
         "additional_pkginfo": {
             "description":
                 "Some pkginfo fields extracted from the Adobe metadata.",
@@ -62,6 +95,7 @@ class CreativeCloudVersioner(Processor):
         },
     }
 
+    @profiled
     def main(self):
         """
         Determine a pkginfo, version and jss inventory name from the created package.
@@ -88,6 +122,80 @@ class CreativeCloudVersioner(Processor):
         self.env["ccpVersion"] = self.env["prod"][0]["version"]
         self.output("ccpVersion: %s" % self.env["ccpVersion"])
         self.env["app_json"] = os.path.join(self.env["pkg_path"], "Contents/Resources/HD", self.env["sapCode"] + self.env["ccpVersion"], "Application.json")
+
+        cache_path = os.path.join(self.env["RECIPE_CACHE_DIR"], ".ccp_versioner_cache.json")
+        fingerprint = self.payload_fingerprint()
+        if self.load_cached_result(cache_path, fingerprint):
+            return
+
+        self.process_installer()
+        self.save_cached_result(cache_path, fingerprint)
+
+    def payload_fingerprint(self):
+        """Build a fingerprint of the files the version information is extracted from.
+
+        Only file metadata (path, size and mtime) is used, so that computing the fingerprint does not
+        require opening any payload. Environment values which end up in additional_pkginfo are
+        included as well.
+
+        Returns:
+            str: A hex digest identifying the current package contents.
+        """
+        hd_root = os.path.join(self.env["pkg_path"], "Contents/Resources/HD")
+        paths = [
+            self.env["app_json"],
+            os.path.join(self.env["pkg_path"], "Contents/Resources/optionXML.xml"),
+            os.path.join(self.env["pkg_path"], "Contents/Resources/Setup", self.env["sapCode"] + self.env["ccpVersion"], "proxy.xml"),
+        ]
+        paths.extend(sorted(glob.glob(os.path.join(hd_root, "*", "Application.json"))))
+        paths.extend(sorted(glob.glob(os.path.join(hd_root, "*", "*.zip"))))
+
+        return fileutil.stat_fingerprint(paths, extra={
+            "display_name": self.env.get("display_name"),
+            "minimum_os_version": self.env.get("minimum_os_version"),
+            "user_installs": "installs" in self.env.get("pkginfo", {}),
+            "installs_checksums": str(self.env.get("installs_checksums", False)).lower(),
+        })
+
+    def load_cached_result(self, cache_path, fingerprint):
+        """Restore the outputs of a previous run if the package fingerprint is unchanged.
+
+        Returns:
+            bool: True if the outputs were restored from the cache.
+        """
+        if not os.path.exists(cache_path):
+            return False
+
+        try:
+            with open(cache_path, "r") as fd:
+                cached = json.load(fd)
+        except ValueError:
+            self.output("Ignoring unreadable versioner cache at %s" % cache_path)
+            return False
+
+        if cached.get("fingerprint") != fingerprint:
+            self.output("Package has changed since the last run, re-reading version information")
+            return False
+
+        self.output("Package is unchanged since the last run, using cached version information")
+        for key in CACHED_OUTPUTS:
+            if cached["outputs"].get(key) is not None:
+                self.env[key] = cached["outputs"][key]
+        ProcessorLog(self).detail("additional_pkginfo: {}", self.env.get("additional_pkginfo"))
+        return True
+
+    def save_cached_result(self, cache_path, fingerprint):
+        """Save the outputs of this run for the given package fingerprint."""
+        cached = {
+            "fingerprint": fingerprint,
+            "outputs": dict((key, self.env.get(key)) for key in CACHED_OUTPUTS),
+        }
+        with open(cache_path, "w") as fd:
+            json.dump(cached, fd)
+
+    def process_installer(self):
+        """Extract version information from whichever installer type CCP produced."""
+        self.env["hd_products"] = []
         # If Application.json exists, we"re looking at a HD installer
         if os.path.exists(self.env["app_json"]):
             self.output("Installer is HyperDrive")
@@ -114,6 +222,7 @@ class CreativeCloudVersioner(Processor):
         """ Process APRO installer """
         self.output("Processing Acrobat installer")
         self.output("proxy_xml: %s" % self.env["proxy_xml"])
+        from xml.etree import ElementTree
         tree = ElementTree.parse(self.env["proxy_xml"])
         root = tree.getroot()
 
@@ -138,72 +247,279 @@ class CreativeCloudVersioner(Processor):
     def process_hd_installer(self):
         """Process HD installer
 
+        Every HD product in the package, including dependencies which CCP bundled alongside the
+        requested product, is scanned on a worker pool. The product matching the requested SAP code
+        provides the version and inventory name, and the installs items of all products are merged.
+
         Inputs:
               app_json: Path to the Application JSON that was extracted from the feed.
         """
+        from multiprocessing.pool import ThreadPool
+
         self.output("Processing HD installer")
-        with open(self.env["app_json"]) as json_file:
+        main_dir = os.path.dirname(self.env["app_json"])
+        hd_dirs = [main_dir] + [hd_dir for hd_dir in self.hd_product_dirs() if hd_dir != main_dir]
+
+        max_workers = max(1, min(int(self.env.get("max_workers", 4)), len(hd_dirs)))
+        self.output("Scanning %d HD product(s) with %d worker(s)" % (len(hd_dirs), max_workers))
+        pool = ThreadPool(max_workers)
+        try:
+            results = pool.map(self.scan_hd_product, hd_dirs)
+        finally:
+            pool.close()
+            pool.join()
+
+        main = results[0]
+        if "app_launch" not in main:  # Bridge CC is HD but does not have AppLaunch
+            self.output("No AppLaunch in %s, unable to determine the application version" % self.env["app_json"])
+            return
+
+        log = ProcessorLog(self)
+        for key in ("app_launch", "app_bundle", "app_path", "installed_path", "zip_file", "staging_folder",
+                    "staging_folder_path"):
+            log.detail("{}: {}", key, main[key])
+        self.output("app_version: %s" % main["version"])
+
+        installs = []
+        seen = set()
+        for result in results:
+            self.output("HD product %s: version %s, %d installs item(s)" % (
+                result["sapCode"], result.get("version", "unknown"), len(result["installs"])))
+            for item in result["installs"]:
+                if item["path"] not in seen:
+                    seen.add(item["path"])
+                    installs.append(item)
+
+        self.env["hd_products"] = [
+            dict((key, result[key]) for key in ("sapCode", "version", "installs") if key in result)
+            for result in results
+        ]
+
+        # Now we have the deets, let's use them
+        self.create_pkginfo(main["app_bundle"], main["version"], main["installed_path"], installs)
+
+    def hd_product_dirs(self):
+        """Return every HD product directory in the package, sorted by name."""
+        hd_root = os.path.join(self.env["pkg_path"], "Contents/Resources/HD")
+        return sorted(os.path.dirname(app_json) for app_json in glob.glob(os.path.join(hd_root, "*", "Application.json")))
+
+    def scan_hd_product(self, hd_dir):
+        """Extract the main application version and installs items from a single HD product.
+
+        This does not modify the processor environment, so it is safe to run on a worker pool.
+
+        Args:
+            hd_dir (str): The product directory containing Application.json and the payload zips
+        Returns:
+            dict: The sapCode and installs items of the product. If the product has an AppLaunch, it also
+                contains the version and location details of the main application.
+        """
+        import zipfile
+
+        with open(os.path.join(hd_dir, "Application.json")) as json_file:
             load_json = json.load(json_file)
 
-            # AppLaunch is not always in the same format, but is splittable
-            if 'AppLaunch' in load_json:  # Bridge CC is HD but does not have AppLaunch
-                app_launch = load_json["AppLaunch"]
-                self.output("app_launch: %s" % app_launch)
-                app_details = list(re.split("/", app_launch))
-                if app_details[2].endswith(".app"):
-                    app_bundle = app_details[2]
-                    app_path = app_details[1]
-                else:
-                    app_bundle = app_details[1]
-                    app_path = list(re.split("/", (load_json["InstallDir"]["value"])))[1]
-                self.output("app_bundle: %s" % app_bundle)
-                self.output("app_path: %s" % app_path)
-
-                installed_path = os.path.join("/Applications", app_path, app_bundle)
-                self.output("installed_path: %s" % installed_path)
-
-                zip_file = load_json["Packages"]["Package"][0]["PackageName"]
-                self.output("zip_file: %s" % zip_file)
-
-                zip_path = os.path.join(self.env["pkg_path"], "Contents/Resources/HD", self.env["sapCode"] + self.env["ccpVersion"], zip_file + ".zip")
-                self.output("zip_path: %s" % zip_path)
-                with zipfile.ZipFile(zip_path, mode="r") as myzip:
-                    with myzip.open(zip_file + ".pimx") as mytxt:
-                        txt = mytxt.read()
-                        tree = ElementTree.fromstring(txt)
-                        # Loop through .pmx's Assets, look for target=[INSTALLDIR], then grab Assets Source.
-                        # Break when found .app/Contents/Info.plist
-                        for elem in tree.findall("Assets"):
-                            for i in  elem.getchildren():
-                                if i.attrib["target"].upper().startswith("[INSTALLDIR]"):
-                                    bundle_location = i.attrib["source"]
-                                else:
-                                    continue
-                                if not bundle_location.startswith("[StagingFolder]"):
-                                    continue
-                                else:
-                                    bundle_location = bundle_location[16:]
-                                    if bundle_location.endswith(".app"):
-                                        zip_bundle = os.path.join("1", bundle_location, "Contents/Info.plist")
-                                    else:
-                                        zip_bundle = os.path.join("1", bundle_location, app_bundle, "Contents/Info.plist")
-                                    try:
-                                        with myzip.open(zip_bundle) as myplist:
-                                            plist = myplist.read()
-                                            data = FoundationPlist.readPlistFromString(plist)
-                                            app_version = data["CFBundleShortVersionString"]
-                                            #app_identifier = data["CFBundleIdentifier"]
-                                            self.output("staging_folder: %s" % bundle_location)
-                                            self.output("staging_folder_path: %s" % zip_bundle)
-                                            self.output("app_version: %s" % app_version)
-                                            self.output("app_bundle: %s" % app_bundle)
-                                            #self.output("app_identifier: %s" % app_identifier)
-                                            break
-                                    except:
-                                        continue
-
-                # Now we have the deets, let's use them
-                self.create_pkginfo(app_bundle, app_version, installed_path)
+        result = {"sapCode": load_json.get("SAPCode", os.path.basename(hd_dir)), "installs": []}
+        app_bundle = None
+        # AppLaunch is not always in the same format, but is splittable
+        if 'AppLaunch' in load_json:
+            app_launch = load_json["AppLaunch"]
+            app_details = list(re.split("/", app_launch))
+            if app_details[2].endswith(".app"):
+                app_bundle = app_details[2]
+                app_path = app_details[1]
+                install_dir = "/Applications"
+            else:
+                app_bundle = app_details[1]
+                app_path = list(re.split("/", (load_json["InstallDir"]["value"])))[1]
+                install_dir = os.path.join("/Applications", app_path)
+
+            result.update({
+                "app_launch": app_launch,
+                "app_bundle": app_bundle,
+                "app_path": app_path,
+                "installed_path": os.path.join("/Applications", app_path, app_bundle),
+            })
+        else:
+            install_dir = load_json.get("InstallDir", {}).get("value", "").replace("[AdobeProgramFiles]", "/Applications")
+
+        for package in load_json.get("Packages", {}).get("Package", []):
+            zip_file = package["PackageName"]
+            zip_path = os.path.join(hd_dir, zip_file + ".zip")
+            if not os.path.exists(zip_path):
+                continue
+
+            with zipfile.ZipFile(zip_path, mode="r") as myzip:
+                # Index the central directory once, so that candidate paths can be checked without
+                # probing the archive.
+                zip_names = set(myzip.namelist())
+                if zip_file + ".pimx" not in zip_names:
+                    continue
+                assets = list(self.installdir_assets(myzip, zip_file + ".pimx"))
+
+                zip_bundle = None
+                if app_bundle and "version" not in result:
+                    found = self.find_bundle_plist(assets, zip_names, app_bundle)
+                    if found is not None:
+                        bundle_location, zip_bundle = found
+                        with myzip.open(zip_bundle) as myplist:
+                            data = plists.read_plist(myplist)
+                        result.update({
+                            "version": data["CFBundleShortVersionString"],
+                            "zip_file": zip_file,
+                            "staging_folder": bundle_location,
+                            "staging_folder_path": zip_bundle,
+                        })
+
+                result["installs"].extend(self.collect_installs(myzip, assets, zip_names, install_dir, zip_bundle))
+
+        if app_bundle and "version" not in result:
+            if hd_dir == os.path.dirname(self.env["app_json"]):
+                raise ProcessorError("Could not find an application Info.plist for %s in %s" % (app_bundle, hd_dir))
+            # Dependencies are only scanned for their installs items
+            self.output("Could not find an application Info.plist for %s in dependency %s, using its installs "
+                        "items only" % (app_bundle, hd_dir))
+
+        return result
+
+    def installdir_assets(self, myzip, pimx_name):
+        """Yield the assets of a HD payload which are staged into [INSTALLDIR].
+
+        The .pimx is parsed incrementally, and each Asset element is discarded once read.
+
+        Args:
+            myzip (zipfile.ZipFile): The opened HD payload
+            pimx_name (str): Name of the .pimx member describing the payload assets
+        Yields:
+            tuple: (target, source) where target is relative to [INSTALLDIR] and source is relative to the
+                [StagingFolder], in document order.
+        """
+        from xml.etree import ElementTree
+
+        depth = 0
+        in_assets = False
+        with myzip.open(pimx_name) as mytxt:
+            for event, elem in ElementTree.iterparse(mytxt, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if depth == 2 and elem.tag == "Assets":
+                        in_assets = True
+                    continue
+
+                depth -= 1
+                if depth == 1:
+                    in_assets = False
+                    elem.clear()
+                if not in_assets or depth != 2:
+                    continue
+
+                # Look for target=[INSTALLDIR], then grab the Asset's source.
+                target = elem.get("target", "")
+                source = elem.get("source", "")
+                elem.clear()
+                if not target.upper().startswith("[INSTALLDIR]"):
+                    continue
+                if not source.startswith("[StagingFolder]"):
+                    continue
+
+                yield target[12:], source[16:]
+
+    def find_bundle_plist(self, assets, zip_names, app_bundle):
+        """Find the Info.plist of the main application bundle in a HD payload.
+
+        This is the first [INSTALLDIR] asset whose Info.plist exists in the archive.
+
+        Args:
+            assets (list): (target, source) tuples from installdir_assets()
+            zip_names (set): Every member name in the payload
+            app_bundle (str): The application bundle name, used when the asset is the bundle's parent
+        Returns:
+            tuple: (bundle_location, zip_bundle) for the Info.plist, or None if no candidate exists.
+        """
+        for _, bundle_location in assets:
+            if bundle_location.endswith(".app"):
+                zip_bundle = os.path.join("1", bundle_location, "Contents/Info.plist")
+            else:
+                zip_bundle = os.path.join("1", bundle_location, app_bundle, "Contents/Info.plist")
+            if zip_bundle in zip_names:
+                return bundle_location, zip_bundle
+
+        return None
+
+    def collect_installs(self, myzip, assets, zip_names, install_dir, main_plist):
+        """Build Munki installs items for every application bundle installed into [INSTALLDIR].
+
+        Bundles are found from the zip index, so only their Info.plist (and optionally their main
+        executable) members are read. Bundles nested inside other bundles are ignored.
+
+        Args:
+            myzip (zipfile.ZipFile): The opened HD payload
+            assets (list): (target, source) tuples from installdir_assets()
+            zip_names (set): Every member name in the payload
+            install_dir (str): The path that [INSTALLDIR] resolves to on the client
+            main_plist (str): The Info.plist member of the main application, which is listed first
+        Returns:
+            list: installs items
+        """
+        staged = {}
+        for target, source in assets:
+            staged[os.path.join("1", source)] = install_dir + target
+
+        with_checksums = str(self.env.get("installs_checksums", False)).lower() == "true"
+        installs = []
+        seen = set()
+        for zip_bundle in sorted(zip_names, key=lambda name: (name != main_plist, name)):
+            if not zip_bundle.endswith(".app/Contents/Info.plist"):
+                continue
+            bundle_dir = zip_bundle[:-len("/Contents/Info.plist")]
+            if ".app/" in bundle_dir:
+                continue
+
+            staged_dir = bundle_dir
+            while staged_dir and staged_dir not in staged:
+                staged_dir = os.path.dirname(staged_dir)
+            if not staged_dir:
+                continue
+
+            installed_path = staged[staged_dir] + bundle_dir[len(staged_dir):]
+            if installed_path in seen:
+                continue
+            seen.add(installed_path)
+
+            with myzip.open(zip_bundle) as myplist:
+                data = plists.read_plist(myplist)
+            if "CFBundleShortVersionString" not in data:
+                ProcessorLog(self).detail("Skipping {}, it has no CFBundleShortVersionString", installed_path)
+                continue
+
+            ProcessorLog(self).detail("Found application {}, version {}", installed_path, data["CFBundleShortVersionString"])
+            item = {
+                'CFBundleShortVersionString': data["CFBundleShortVersionString"],
+                'path': installed_path,
+                'type': 'application',
+                'version_comparison_key': 'CFBundleShortVersionString',
+            }
+            if "CFBundleIdentifier" in data:
+                item['CFBundleIdentifier'] = data["CFBundleIdentifier"]
+            installs.append(item)
+
+            executable = os.path.join(bundle_dir, "Contents/MacOS", data.get("CFBundleExecutable", ""))
+            if with_checksums and data.get("CFBundleExecutable") and executable in zip_names:
+                installs.append({
+                    'md5checksum': self.zip_member_md5(myzip, executable),
+                    'path': os.path.join(installed_path, "Contents/MacOS", data["CFBundleExecutable"]),
+                    'type': 'file',
+                })
+
+        return installs
+
+    def zip_member_md5(self, myzip, name):
+        """Return the md5 hex digest of a zip member, reading it in chunks."""
+        digest = hashlib.md5()
+        with myzip.open(name) as member:
+            for chunk in iter(lambda: member.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
 
     def process_ribs_installer(self, pkg_path, sap_code_hint=None):
         """Extract version number of RIBS based package.
@@ -212,32 +528,30 @@ class CreativeCloudVersioner(Processor):
             pkg_path (str): Path to the package that was produced
             sap_code_hint (str): hint the sap code of the "main" package, to extract the version from.
         """
-        option_xml_path = os.path.join(pkg_path, 'Contents', 'Resources', 'optionXML.xml')
         # ribs_root = os.path.join(pkg_path, 'Contents', 'Resources', 'Setup')
 
-        option_xml = ElementTree.parse(option_xml_path)
-        main_media = None
-        for media in option_xml.findall('.//Medias/Media'):  # Media refers to RIBS media only. HD is in HDMedia
-            if media.findtext('SAPCode') == sap_code_hint:
-                main_media = media
-                break
+        # Shared with the packager and build modifier, and indexed by SAP code.
+        # Media refers to RIBS media only. HD is in HDMedia
+        main_media = pkgmeta.option_xml(pkg_path).media(sap_code_hint)
 
         if main_media is None:
             raise ProcessorError('Could not find main RIBS package indicated by SAP Code {}'.format(sap_code_hint))
 
-        # media_path = os.path.join(ribs_root, main_media.findtext('TargetFolderName'))
+        # media_path = os.path.join(ribs_root, main_media.target_folder)
         # if not os.path.exists(media_path):
         #     raise ProcessorError('Could not find Media for RIBS package in path: {}'.format(media_path))
 
-        self.create_pkginfo('NOT_SUPPORTED', main_media.findtext('prodVersion'), '')
+        self.create_pkginfo('NOT_SUPPORTED', main_media.prod_version, '')
 
-    def create_pkginfo(self, app_bundle, app_version, installed_path):
+    def create_pkginfo(self, app_bundle, app_version, installed_path, installs=None):
         """Create pkginfo with found details
 
         Args:
               app_bundle (str): Bundle name
               app_version (str): Bundle version
               installed_path (str): The path where the installed item will be installed.
+              installs (list): installs items for every bundle in the package. If not given, a single
+                item is created for installed_path.
         """
         self.env["version"] = app_version
         self.env["jss_inventory_name"] = app_bundle
@@ -249,7 +563,7 @@ class CreativeCloudVersioner(Processor):
 
         # Allow the user to provide an installs array that prevents CreativeCloudVersioner from overriding it.
         if 'pkginfo' not in self.env or 'installs' not in self.env['pkginfo']:
-            pkginfo['installs'] = [{
+            pkginfo['installs'] = installs or [{
                 'CFBundleShortVersionString': self.env['version'],
                 'path': installed_path,
                 'type': 'application',
@@ -257,7 +571,7 @@ class CreativeCloudVersioner(Processor):
             }]
 
         self.env["additional_pkginfo"] = pkginfo
-        self.output("additional_pkginfo: %s" % self.env["additional_pkginfo"])
+        ProcessorLog(self).detail("additional_pkginfo: {}", self.env["additional_pkginfo"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,270 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content-addressed store of product assets listed in manifest.xml files.
+
+Layout of the store directory:
+
+    objects/<first two hex digits>/<sha256>   Asset contents
+    partial/<sha1 of url>                     Interrupted downloads, resumed with a Range request
+    index.json                                Asset URL to digest, and the size and last use of each object
+
+Assets are stored once by the SHA-256 of their content, so base versions
+and updates which ship the same asset share it. evict() removes the least
+recently used objects until the store fits in a size budget.
+
+The index is shared by the threads of one process, which fetch each URL
+one at a time. Separate processes may use the same store, but the last one
+to save the index wins.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .fileutil import atomic_write
+
+__all__ = ["AssetError", "AssetStore", "manifest_assets"]
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class AssetError(Exception):
+    """Raised when an asset cannot be downloaded or fails its integrity check."""
+    pass
+
+
+def manifest_assets(manifest_xml, manifest_url=None):
+    """Return the (url, size) of each asset in the asset_list of a manifest.xml.
+
+    Relative asset paths are resolved against manifest_url. size is None if
+    the manifest does not give one.
+    """
+    from xml.etree import ElementTree
+
+    assets = []
+    for asset in ElementTree.fromstring(manifest_xml).findall('asset_list/asset'):
+        url = (asset.findtext('asset_path') or '').strip()
+        if not url:
+            continue
+        if manifest_url:
+            url = _urljoin(manifest_url, url)
+        size = asset.findtext('asset_size')
+        assets.append((url, int(size) if size and size.strip().isdigit() else None))
+    return assets
+
+
+class AssetStore(object):
+    """Assets stored by content digest in a directory, with an index by URL."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, 'index.json')
+        self.lock = threading.Lock()
+        # One lock per URL, so that concurrent fetches never share a partial download
+        self.url_locks = {}
+        self.urls = {}
+        self.objects = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as fd:
+                index = json.load(fd)
+            self.urls = index.get('urls', {})
+            self.objects = index.get('objects', {})
+        # URL path to URL, for requests made to a stand-in for the CDN
+        self.paths = dict((_url_path(url), url) for url in self.urls)
+
+    def object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], digest)
+
+    def partial_path(self, url):
+        return os.path.join(self.path, 'partial', hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({'urls': self.urls, 'objects': self.objects}, sort_keys=True)
+        _makedirs(self.path)
+        atomic_write(self.index_path, data.encode('utf-8'))
+
+    def total_size(self):
+        with self.lock:
+            return sum(obj['size'] for obj in self.objects.values())
+
+    def lookup(self, url):
+        """Return the path of the stored asset for url, marking it as used, or None if it is not stored."""
+        with self.lock:
+            digest = self.urls.get(url)
+            if digest is None or digest not in self.objects:
+                return None
+            path = self.object_path(digest)
+            if not os.path.exists(path):
+                del self.objects[digest]
+                return None
+            self.objects[digest]['atime'] = time.time()
+            return path
+
+    def lookup_path(self, url_path):
+        """Return the stored asset whose URL has the path url_path, eg. for a request to a CDN stand-in."""
+        with self.lock:
+            url = self.paths.get(url_path)
+        return self.lookup(url) if url is not None else None
+
+    def fetch(self, url, size=None, headers=None, retries=3):
+        """Download url into the store unless it is already there.
+
+        Interrupted downloads resume from where they stopped. The content must
+        match size, if given.
+
+        Returns:
+            tuple: (path of the stored asset, True if it was already stored)
+        """
+        path = self.lookup(url)
+        if path is not None:
+            return path, True
+
+        with self.lock:
+            url_lock = self.url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            # Another thread may have stored the asset while this one waited
+            path = self.lookup(url)
+            if path is not None:
+                return path, True
+            return self._fetch(url, size, headers, retries)
+
+    def _fetch(self, url, size, headers, retries):
+        partial = self.partial_path(url)
+        _makedirs(os.path.dirname(partial))
+        for attempt in range(retries + 1):
+            try:
+                digest = self._download(url, partial, headers or {})
+            except (IOError, OSError) as err:  # urllib2.URLError is an IOError
+                error = err
+            else:
+                actual_size = os.path.getsize(partial)
+                if size is None or actual_size == size:
+                    break
+                error = '{} bytes, expected {}'.format(actual_size, size)
+                if actual_size > size:
+                    # The partial file does not belong to this asset, so start again
+                    os.unlink(partial)
+                # Otherwise the server closed the connection early, and the next attempt resumes
+            if attempt == retries:
+                raise AssetError('Unable to download {}: {}'.format(url, error))
+            time.sleep(min(2 ** attempt, 30))
+
+        path = self.object_path(digest)
+        _makedirs(os.path.dirname(path))
+        if os.path.exists(path):
+            os.unlink(partial)
+        else:
+            os.rename(partial, path)
+
+        with self.lock:
+            self.urls[url] = digest
+            self.paths[_url_path(url)] = url
+            self.objects[digest] = {'size': actual_size, 'atime': time.time()}
+        return path, False
+
+    def _download(self, url, partial, headers):
+        """Download or resume url into partial, returning the SHA-256 of its content."""
+        try:
+            from urllib2 import HTTPError, Request, urlopen
+        except ImportError:  # Python 3
+            from urllib.error import HTTPError
+            from urllib.request import Request, urlopen
+
+        digest = hashlib.sha256()
+        offset = 0
+        if os.path.exists(partial):
+            with open(partial, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    offset += len(chunk)
+
+        request_headers = dict(headers)
+        if offset:
+            request_headers['Range'] = 'bytes={}-'.format(offset)
+        try:
+            response = urlopen(Request(url, headers=request_headers))
+        except HTTPError as err:
+            if err.code != 416 or not offset:
+                raise
+            # The partial file is complete, or does not match the asset any more, so start again
+            os.unlink(partial)
+            return self._download(url, partial, headers)
+
+        try:
+            if offset and response.getcode() != 206:
+                # The server ignored the range, so the response is the whole asset
+                digest = hashlib.sha256()
+                mode = 'wb'
+            else:
+                mode = 'ab'
+            with open(partial, mode) as fd:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    fd.write(chunk)
+        finally:
+            response.close()
+        return digest.hexdigest()
+
+    def evict(self, max_bytes):
+        """Remove the least recently used assets until the store is no larger than max_bytes.
+
+        Returns:
+            list: The digests of the removed assets
+        """
+        removed = []
+        with self.lock:
+            total = sum(obj['size'] for obj in self.objects.values())
+            for digest in sorted(self.objects, key=lambda d: self.objects[d]['atime']):
+                if total <= max_bytes:
+                    break
+                path = self.object_path(digest)
+                if os.path.exists(path):
+                    os.unlink(path)
+                total -= self.objects.pop(digest)['size']
+                removed.append(digest)
+            removed_set = set(removed)
+            for url in [url for url, digest in self.urls.items() if digest in removed_set]:
+                del self.urls[url]
+                self.paths.pop(_url_path(url), None)
+        return removed
+
+
+def _url_path(url):
+    try:
+        from urlparse import urlparse
+    except ImportError:  # Python 3
+        from urllib.parse import urlparse
+    return urlparse(url).path
+
+
+def _urljoin(base, url):
+    try:
+        from urlparse import urljoin
+    except ImportError:  # Python 3
+        from urllib.parse import urljoin
+    return urljoin(base, url)
+
+
+def _makedirs(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Created by another thread
+            if not os.path.isdir(path):
+                raise
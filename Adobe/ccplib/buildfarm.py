@@ -0,0 +1,812 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Distribute CreativeCloudPackager builds across several build hosts.
+
+PDApp builds one package at a time, so a host builds its recipes one after
+another. A Coordinator queues build jobs and hands them to Workers, one per
+build host, which poll it over HTTP with JSON bodies:
+
+    POST /jobs                          submit a job, or a list of jobs
+    GET  /jobs, /jobs/<id>              job states, results and artifacts
+    GET  /metrics                       throughput, queue latency and worker counts
+    POST /workers                       register a worker, returns its id and heartbeat interval
+    POST /workers/<id>/heartbeat        keep a worker, and the job it is building, alive
+    POST /workers/<id>/lease            take the next job, or 204 if none is queued
+    PUT  /jobs/<id>/artifacts/<name>    upload an artifact of a leased job, with X-Worker-Id
+    POST /jobs/<id>/complete            report the output variables of a leased job
+    POST /jobs/<id>/fail                report a failed build
+
+Every request carries the shared token of the farm in an X-Build-Farm-Token
+header, and requests without it are refused. The protocol is plain HTTP, so
+the coordinator must only be reachable from a trusted network.
+
+A job is the input of CreativeCloudPackager, with the product versions which
+CreativeCloudFeed resolved:
+
+    {"recipe": "local.pkg.PhotoshopCC", "package_name": "PhotoshopCC",
+     "ccpinfo": {..., "Products": [{"sapCode": "PHSP", "baseVersion": "19.0", "version": "19.1.2"}]},
+     "env": {"version": "19.1.2", "display_name": "Photoshop CC"}}
+
+A failed build is queued again, for a different worker if there is one, up
+to max_attempts times. A worker which misses heartbeats for worker_timeout
+seconds is considered lost, and its job is queued again. Jobs are saved in
+state_dir, and those which were building when the coordinator stopped are
+queued again when it starts.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import hmac
+import json
+import os
+import re
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from .fileutil import CHUNK_SIZE, atomic_open, load_state, save_state
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import HTTPError, Request, urlopen
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+try:
+    STRING_TYPES = basestring
+except NameError:  # Python 3
+    STRING_TYPES = str
+
+__all__ = ["BuildError", "Coordinator", "CoordinatorClient", "FarmError", "Worker", "serve", "validate_job"]
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+JOB_STATES = (QUEUED, RUNNING, DONE, FAILED)
+
+STATE_NAME = 'buildfarm.json'
+TOKEN_HEADER = 'X-Build-Farm-Token'
+ARTIFACT_NAME_RE = re.compile(r'^[\w][\w.-]*$')
+# Recipe identifiers and package names name directories on the workers, so they may not contain separators
+JOB_NAME_RE = re.compile(r'^\w[\w .-]*$')
+
+# Seconds between worker heartbeats
+DEFAULT_HEARTBEAT = 10
+# Seconds without a heartbeat after which a worker is lost
+DEFAULT_WORKER_TIMEOUT = 60
+# Attempts a worker makes to report the outcome of a build while the coordinator is unreachable
+REPORT_ATTEMPTS = 5
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class FarmError(Exception):
+    """A request the coordinator refused, with the HTTP status it is answered with."""
+
+    def __init__(self, message, status=400):
+        super(FarmError, self).__init__(message)
+        self.status = status
+
+
+class BuildError(Exception):
+    """Raised by a worker's build function. The job is retried if retry is set and attempts remain."""
+
+    def __init__(self, message, retry=True):
+        super(BuildError, self).__init__(message)
+        self.retry = retry
+
+
+def validate_job(spec):
+    """Check a submitted job and return the fields the coordinator keeps.
+
+    Raises:
+        FarmError: If it is not a job with a package_name and ccpinfo products with resolved versions, or if
+            its recipe or package_name is not a plain file name
+    """
+    if not isinstance(spec, dict):
+        raise FarmError('Expected a job object, got {!r}'.format(spec))
+    package_name = spec.get('package_name')
+    if not isinstance(package_name, STRING_TYPES) or not JOB_NAME_RE.match(package_name):
+        raise FarmError('A job needs a package_name of letters, digits, spaces, dots, dashes and underscores')
+    recipe = spec.get('recipe') or package_name
+    if not isinstance(recipe, STRING_TYPES) or not JOB_NAME_RE.match(recipe):
+        raise FarmError('Job {}: invalid recipe identifier {!r}'.format(package_name, recipe))
+    if not isinstance(spec.get('env') or {}, dict):
+        raise FarmError('Job {}: env must be an object'.format(package_name))
+    ccpinfo = spec.get('ccpinfo')
+    if not isinstance(ccpinfo, dict) or not ccpinfo.get('Products'):
+        raise FarmError('Job {} has no ccpinfo Products'.format(package_name))
+    for product in ccpinfo['Products']:
+        if not product.get('sapCode') or product.get('version') in (None, '', 'latest'):
+            raise FarmError('Job {}: every product needs a sapCode and a version resolved from the feed'.format(
+                package_name))
+    return {
+        'recipe': recipe,
+        'package_name': package_name,
+        'ccpinfo': ccpinfo,
+        'env': dict(spec.get('env') or {}),
+    }
+
+
+def _percentile(ordered, fraction):
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def summarize(values):
+    """Return the count, mean, median, 95th percentile and maximum of values."""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / float(len(ordered)),
+        'p50': _percentile(ordered, 0.5),
+        'p95': _percentile(ordered, 0.95),
+        'max': ordered[-1],
+    }
+
+
+class Coordinator(object):
+    """The job queue and worker registry. Every method is thread safe."""
+
+    def __init__(self, state_dir, max_attempts=DEFAULT_MAX_ATTEMPTS, heartbeat_interval=DEFAULT_HEARTBEAT,
+                 worker_timeout=DEFAULT_WORKER_TIMEOUT, log=None, clock=time.time):
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, STATE_NAME)
+        self.artifact_dir = os.path.join(state_dir, 'artifacts')
+        self.max_attempts = max_attempts
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_timeout = worker_timeout
+        self.log = log or (lambda msg: None)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.queue = []
+        self.workers = {}
+        self.lost_workers = 0
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        self._load()
+
+    def _load(self):
+        state = load_state(self.path)
+        self.lost_workers = state.get('lost_workers', 0)
+        for job in state.get('jobs', []):
+            if job['state'] == RUNNING:
+                # The coordinator stopped while the job was building, and its worker is unknown now
+                job.update(state=QUEUED, worker=None, started=None, queued=self.clock())
+            self.jobs[job['id']] = job
+        self.queue = sorted((job['id'] for job in self.jobs.values() if job['state'] == QUEUED),
+                            key=lambda job_id: self.jobs[job_id]['submitted'])
+
+    def _save(self):
+        save_state(self.path, {
+            'jobs': sorted(self.jobs.values(), key=lambda job: job['submitted']),
+            'lost_workers': self.lost_workers,
+        })
+
+    def submit(self, specs):
+        """Queue jobs. A job for a package which is already queued or building is not queued twice.
+
+        Returns:
+            list: The id of each job
+        """
+        specs = [validate_job(spec) for spec in specs]
+        ids = []
+        with self.lock:
+            now = self.clock()
+            active = dict((job['package_name'], job['id']) for job in self.jobs.values()
+                          if job['state'] in (QUEUED, RUNNING))
+            for spec in specs:
+                if spec['package_name'] in active:
+                    ids.append(active[spec['package_name']])
+                    continue
+                job = dict(spec, id=uuid.uuid4().hex[:12], state=QUEUED, attempts=0, submitted=now, queued=now,
+                           started=None, finished=None, worker=None, worker_name=None, avoid=[], errors=[],
+                           waits=[], build_seconds=None, result=None, artifacts={})
+                self.jobs[job['id']] = job
+                self.queue.append(job['id'])
+                active[job['package_name']] = job['id']
+                ids.append(job['id'])
+                self.log('Queued {} ({})'.format(job['package_name'], job['id']))
+            self._save()
+        return ids
+
+    def register(self, name):
+        """Register a worker.
+
+        Returns:
+            dict: worker_id, and heartbeat_interval in seconds
+        """
+        with self.lock:
+            worker_id = uuid.uuid4().hex[:12]
+            self.workers[worker_id] = {
+                'id': worker_id, 'name': name, 'state': 'idle', 'job': None, 'registered': self.clock(),
+                'last_seen': self.clock(), 'completed': 0, 'failed': 0, 'busy_seconds': 0.0,
+            }
+        self.log('Worker {} registered as {}'.format(name, worker_id))
+        return {'worker_id': worker_id, 'heartbeat_interval': self.heartbeat_interval}
+
+    def _worker(self, worker_id, seen=True):
+        worker = self.workers.get(worker_id)
+        if worker is None or worker['state'] == 'lost':
+            raise FarmError('Unknown worker {}, register again'.format(worker_id), 404)
+        if seen:
+            worker['last_seen'] = self.clock()
+        return worker
+
+    def _leased(self, worker_id, job_id):
+        worker = self._worker(worker_id)
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise FarmError('Unknown job {}'.format(job_id), 404)
+        if job['state'] != RUNNING or job['worker'] != worker_id:
+            raise FarmError('Job {} is not leased to worker {}'.format(job_id, worker_id), 409)
+        return worker, job
+
+    def heartbeat(self, worker_id):
+        with self.lock:
+            self._worker(worker_id)
+
+    def lease(self, worker_id):
+        """Hand the oldest queued job to a worker.
+
+        Returns:
+            dict: The job, or None if nothing is queued for this worker
+        """
+        with self.lock:
+            self._reap()
+            # A worker which asks for a job is not building the one it holds, eg. because it could not
+            # report its outcome, so that job is queued again before the worker counts as seen
+            worker = self._worker(worker_id, seen=False)
+            if worker['job'] is not None:
+                self._release(worker, self.jobs[worker['job']],
+                              'Worker {} abandoned the job'.format(worker['name']), retry=True)
+                self._save()
+            worker['last_seen'] = self.clock()
+
+            live = set(other['name'] for other in self.workers.values() if other['state'] != 'lost')
+            for job_id in self.queue:
+                avoid = self.jobs[job_id]['avoid']
+                # Retry a failed job elsewhere, unless every live worker has failed it
+                if worker['name'] not in avoid or live.issubset(avoid):
+                    break
+            else:
+                return None
+
+            now = self.clock()
+            self.queue.remove(job_id)
+            job = self.jobs[job_id]
+            job['attempts'] += 1
+            job['waits'].append(now - job['queued'])
+            job.update(state=RUNNING, worker=worker_id, worker_name=worker['name'], started=now)
+            worker.update(state='busy', job=job_id)
+            self._save()
+        self.log('{} leased {} ({}), attempt {}'.format(worker['name'], job['package_name'], job_id, job['attempts']))
+        return dict((key, job[key]) for key in ('id', 'recipe', 'package_name', 'ccpinfo', 'env', 'attempts'))
+
+    def store_artifact(self, worker_id, job_id, name, stream, length, sha256=None):
+        """Save an artifact of a leased job from stream, which holds length bytes, checking its SHA-256."""
+        if not ARTIFACT_NAME_RE.match(name):
+            raise FarmError('Invalid artifact name {}'.format(name))
+        with self.lock:
+            self._leased(worker_id, job_id)
+
+        directory = os.path.join(self.artifact_dir, job_id)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by a concurrent upload
+                if not os.path.isdir(directory):
+                    raise
+        path = os.path.join(directory, name)
+        digest = hashlib.sha256()
+        with atomic_open(path) as fd:
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise FarmError('Upload of {} ended after {} of {} bytes'.format(name, length - remaining, length))
+                digest.update(chunk)
+                fd.write(chunk)
+                remaining -= len(chunk)
+            if sha256 and digest.hexdigest() != sha256:
+                raise FarmError('Upload of {} does not match its SHA-256'.format(name))
+
+        with self.lock:
+            _, job = self._leased(worker_id, job_id)
+            job['artifacts'][name] = {'path': path, 'size': length, 'sha256': digest.hexdigest()}
+            self._save()
+
+    def complete(self, worker_id, job_id, result):
+        """Record the output variables of a finished build."""
+        with self.lock:
+            worker, job = self._leased(worker_id, job_id)
+            now = self.clock()
+            job.update(state=DONE, worker=None, finished=now, build_seconds=now - job['started'], result=result)
+            worker.update(state='idle', job=None)
+            worker['completed'] += 1
+            worker['busy_seconds'] += now - job['started']
+            self._save()
+        self.log('{} built {} ({}) in {:.1f} seconds'.format(worker['name'], job['package_name'], job_id,
+                                                              job['build_seconds']))
+
+    def fail(self, worker_id, job_id, error, retry=True):
+        """Record a failed build, and queue it again if retry is set and attempts remain."""
+        with self.lock:
+            worker, job = self._leased(worker_id, job_id)
+            self._release(worker, job, error, retry)
+            self._save()
+
+    def _release(self, worker, job, error, retry):
+        now = self.clock()
+        worker.update(job=None, state='idle' if worker['state'] == 'busy' else worker['state'])
+        worker['failed'] += 1
+        worker['busy_seconds'] += now - job['started']
+        job['errors'].append({'worker': worker['name'], 'error': error, 'time': now})
+        if worker['name'] not in job['avoid']:
+            job['avoid'].append(worker['name'])
+
+        if retry and job['attempts'] < self.max_attempts:
+            job.update(state=QUEUED, worker=None, started=None, queued=now)
+            self.queue.append(job['id'])
+            self.log('{} failed on {}, queued again: {}'.format(job['package_name'], worker['name'], error))
+        else:
+            job.update(state=FAILED, worker=None, finished=now)
+            self.log('{} failed on {} after {} attempt(s): {}'.format(job['package_name'], worker['name'],
+                                                                      job['attempts'], error))
+
+    def _reap(self):
+        now = self.clock()
+        changed = False
+        for worker in self.workers.values():
+            if worker['state'] == 'lost' or now - worker['last_seen'] <= self.worker_timeout:
+                continue
+            worker['state'] = 'lost'
+            self.lost_workers += 1
+            changed = True
+            self.log('Worker {} ({}) lost'.format(worker['name'], worker['id']))
+            if worker['job'] is not None:
+                self._release(worker, self.jobs[worker['job']],
+                              'Worker {} stopped responding'.format(worker['name']), retry=True)
+        if changed:
+            self._save()
+
+    def reap(self):
+        """Mark workers which missed their heartbeats as lost, and queue their jobs again."""
+        with self.lock:
+            self._reap()
+
+    def job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                raise FarmError('Unknown job {}'.format(job_id), 404)
+            return dict(job)
+
+    def list_jobs(self):
+        """Return a summary of every job, oldest first."""
+        keys = ('id', 'recipe', 'package_name', 'state', 'attempts', 'worker_name', 'submitted', 'started',
+                'finished', 'build_seconds')
+        with self.lock:
+            return [dict((key, job[key]) for key in keys)
+                    for job in sorted(self.jobs.values(), key=lambda job: job['submitted'])]
+
+    def finished(self):
+        """Return True if no job is queued or building."""
+        with self.lock:
+            return all(job['state'] in (DONE, FAILED) for job in self.jobs.values())
+
+    def metrics(self):
+        """Return job counts, throughput, queue latency, build times and per-worker counters."""
+        with self.lock:
+            self._reap()
+            now = self.clock()
+            jobs = list(self.jobs.values())
+            counts = dict((state, 0) for state in JOB_STATES)
+            for job in jobs:
+                counts[job['state']] += 1
+
+            done = [job for job in jobs if job['state'] == DONE]
+            throughput = None
+            if done:
+                period = max(job['finished'] for job in done) - min(job['submitted'] for job in jobs)
+                if period > 0:
+                    throughput = len(done) * 3600.0 / period
+
+            workers = {}
+            for worker in self.workers.values():
+                # A worker which registers again after being lost is counted under the same name
+                totals = workers.setdefault(worker['name'], {'state': worker['state'], 'completed': 0, 'failed': 0,
+                                                             'busy_seconds': 0.0, 'registered': worker['registered']})
+                if worker['state'] != 'lost':
+                    totals['state'] = worker['state']
+                totals['registered'] = min(totals['registered'], worker['registered'])
+                totals['completed'] += worker['completed']
+                totals['failed'] += worker['failed']
+                totals['busy_seconds'] += worker['busy_seconds']
+                if worker['job'] is not None:
+                    totals['busy_seconds'] += now - self.jobs[worker['job']]['started']
+            for totals in workers.values():
+                lifetime = now - totals.pop('registered')
+                totals['utilization'] = totals['busy_seconds'] / lifetime if lifetime > 0 else 0.0
+
+            return {
+                'jobs': counts,
+                'retries': sum(max(0, job['attempts'] - 1) for job in jobs),
+                'throughput_per_hour': throughput,
+                'queue_latency_seconds': summarize([wait for job in jobs for wait in job['waits']]),
+                'queued_for_seconds': summarize([now - job['queued'] for job in jobs if job['state'] == QUEUED]),
+                'build_seconds': summarize([job['build_seconds'] for job in done]),
+                'workers': {
+                    'live': sum(1 for worker in self.workers.values() if worker['state'] != 'lost'),
+                    'busy': sum(1 for worker in self.workers.values() if worker['state'] == 'busy'),
+                    'lost': self.lost_workers,
+                },
+                'per_worker': workers,
+            }
+
+
+def _token_bytes(token):
+    return token if isinstance(token, bytes) else token.encode('utf-8')
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    """The HTTP protocol of a Coordinator, set as the coordinator class attribute, with the shared token."""
+    coordinator = None
+    token = None
+
+    ROUTES = [
+        ('GET', re.compile(r'^/jobs$'), 'get_jobs'),
+        ('GET', re.compile(r'^/jobs/(\w+)$'), 'get_job'),
+        ('GET', re.compile(r'^/metrics$'), 'get_metrics'),
+        ('POST', re.compile(r'^/jobs$'), 'post_jobs'),
+        ('POST', re.compile(r'^/workers$'), 'post_worker'),
+        ('POST', re.compile(r'^/workers/(\w+)/heartbeat$'), 'post_heartbeat'),
+        ('POST', re.compile(r'^/workers/(\w+)/lease$'), 'post_lease'),
+        ('POST', re.compile(r'^/jobs/(\w+)/complete$'), 'post_complete'),
+        ('POST', re.compile(r'^/jobs/(\w+)/fail$'), 'post_fail'),
+        ('PUT', re.compile(r'^/jobs/(\w+)/artifacts/([^/]+)$'), 'put_artifact'),
+    ]
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        # Workers poll and send heartbeats constantly, the coordinator logs job events instead
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def authorized(self):
+        token = self.headers.get(TOKEN_HEADER)
+        return bool(token) and hmac.compare_digest(_token_bytes(token), _token_bytes(self.token))
+
+    def dispatch(self, method):
+        path = self.path.split('?', 1)[0]
+        if not self.authorized():
+            self.send_json(401, {'error': 'Missing or invalid {} header'.format(TOKEN_HEADER)})
+            return
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(path)
+            if route_method != method or match is None:
+                continue
+            try:
+                status, body = getattr(self, name)(*match.groups())
+            except FarmError as err:
+                status, body = err.status, {'error': str(err)}
+            except ValueError as err:
+                status, body = 400, {'error': 'Invalid request: {}'.format(err)}
+            self.send_json(status, body)
+            return
+        self.send_json(404, {'error': 'No such endpoint: {} {}'.format(method, path)})
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def send_json(self, status, body):
+        data = b'' if body is None else json.dumps(body, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        if data:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def get_jobs(self):
+        return 200, self.coordinator.list_jobs()
+
+    def get_job(self, job_id):
+        return 200, self.coordinator.job(job_id)
+
+    def get_metrics(self):
+        return 200, self.coordinator.metrics()
+
+    def post_jobs(self):
+        body = self.read_json()
+        return 200, {'ids': self.coordinator.submit(body if isinstance(body, list) else [body])}
+
+    def post_worker(self):
+        return 200, self.coordinator.register(self.read_json().get('name') or self.client_address[0])
+
+    def post_heartbeat(self, worker_id):
+        self.coordinator.heartbeat(worker_id)
+        return 200, {}
+
+    def post_lease(self, worker_id):
+        job = self.coordinator.lease(worker_id)
+        return (200, job) if job is not None else (204, None)
+
+    def post_complete(self, job_id):
+        body = self.read_json()
+        self.coordinator.complete(body.get('worker_id'), job_id, body.get('result') or {})
+        return 200, {}
+
+    def post_fail(self, job_id):
+        body = self.read_json()
+        self.coordinator.fail(body.get('worker_id'), job_id, body.get('error') or 'unknown error',
+                              body.get('retry', True))
+        return 200, {}
+
+    def put_artifact(self, job_id, name):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.coordinator.store_artifact(self.headers.get('X-Worker-Id'), job_id, name, self.rfile, length,
+                                        self.headers.get('X-SHA256'))
+        return 200, {}
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(coordinator, token, bind='127.0.0.1', port=8700):
+    """Create an HTTP server for coordinator, and start a thread which reaps lost workers.
+
+    Args:
+        coordinator (Coordinator): The coordinator to serve
+        token (str): Shared token which every request must carry
+        bind (str): Address to listen on
+        port (int): Port to listen on, or 0 for any free port
+    Returns:
+        HTTPServer: Call serve_forever() on it, and shutdown() to stop it
+    """
+    if not token:
+        raise ValueError('The coordinator needs a token')
+
+    class Handler(CoordinatorHandler):
+        pass
+    Handler.coordinator = coordinator
+    Handler.token = token
+    server = _Server((bind, port), Handler)
+
+    def reap():
+        while True:
+            time.sleep(max(1, coordinator.heartbeat_interval))
+            coordinator.reap()
+
+    thread = threading.Thread(target=reap, name='reaper')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class CoordinatorClient(object):
+    """Calls the HTTP protocol of the coordinator at url, with its shared token."""
+
+    def __init__(self, url, token, timeout=60):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def call(self, method, path, body=None, data=None, headers=None):
+        """Make a request, with a JSON body or a file object as data.
+
+        Returns:
+            The decoded JSON response, or None for 204 No Content
+        Raises:
+            FarmError: If the coordinator refused the request
+        """
+        headers = dict(headers or {})
+        headers[TOKEN_HEADER] = self.token
+        if body is not None:
+            data = json.dumps(body, sort_keys=True).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif data is None and method != 'GET':
+            data = b''
+        request = Request(self.url + path, data, headers)
+        request.get_method = lambda: method
+        try:
+            response = urlopen(request, timeout=self.timeout)
+        except HTTPError as err:
+            try:
+                message = json.loads(err.read().decode('utf-8')).get('error')
+            except ValueError:
+                message = None
+            raise FarmError(message or str(err), err.code)
+        try:
+            if response.getcode() == 204:
+                return None
+            content = response.read()
+        finally:
+            response.close()
+        return json.loads(content.decode('utf-8')) if content else None
+
+    def submit(self, jobs):
+        return self.call('POST', '/jobs', jobs)['ids']
+
+    def jobs(self):
+        return self.call('GET', '/jobs')
+
+    def job(self, job_id):
+        return self.call('GET', '/jobs/{}'.format(job_id))
+
+    def metrics(self):
+        return self.call('GET', '/metrics')
+
+    def register(self, name):
+        return self.call('POST', '/workers', {'name': name})
+
+    def heartbeat(self, worker_id):
+        self.call('POST', '/workers/{}/heartbeat'.format(worker_id), {})
+
+    def lease(self, worker_id):
+        return self.call('POST', '/workers/{}/lease'.format(worker_id), {})
+
+    def upload(self, worker_id, job_id, name, path):
+        """Stream the file at path to the coordinator as an artifact of job_id."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        with open(path, 'rb') as fd:
+            self.call('PUT', '/jobs/{}/artifacts/{}'.format(job_id, name), data=fd, headers={
+                'Content-Length': str(os.path.getsize(path)),
+                'Content-Type': 'application/octet-stream',
+                'X-Worker-Id': worker_id,
+                'X-SHA256': digest.hexdigest(),
+            })
+
+    def complete(self, worker_id, job_id, result):
+        self.call('POST', '/jobs/{}/complete'.format(job_id), {'worker_id': worker_id, 'result': result})
+
+    def fail(self, worker_id, job_id, error, retry=True):
+        self.call('POST', '/jobs/{}/fail'.format(job_id), {'worker_id': worker_id, 'error': error, 'retry': retry})
+
+
+class Worker(object):
+    """Leases jobs from a coordinator and builds them one at a time.
+
+    build(job) builds a leased job and returns (result, artifacts), where result is a dict of
+    JSON-serializable output variables and artifacts maps an artifact name to a local file. It raises
+    BuildError for a failed build.
+    """
+
+    def __init__(self, client, build, name=None, log=None):
+        self.client = client
+        self.build = build
+        self.name = name or socket.gethostname()
+        self.log = log or (lambda msg: None)
+        self.worker_id = None
+        self.heartbeat_interval = DEFAULT_HEARTBEAT
+
+    def register(self):
+        registration = self.client.register(self.name)
+        self.worker_id = registration['worker_id']
+        self.heartbeat_interval = registration['heartbeat_interval']
+        self.log('Registered with {} as {}'.format(self.client.url, self.worker_id))
+
+    def run(self, poll_interval=10, exit_when_idle=False):
+        """Lease and build jobs until interrupted, or until the queue is empty if exit_when_idle is set."""
+        while True:
+            try:
+                if self.worker_id is None:
+                    self.register()
+                job = self.client.lease(self.worker_id)
+            except FarmError as err:
+                if err.status == 404:
+                    # The coordinator restarted, or lost us
+                    self.worker_id = None
+                    continue
+                self.log('Unable to lease a job: {}'.format(err))
+                job = None
+            except (IOError, OSError) as err:  # urllib2.URLError is an IOError
+                self.log('Unable to reach the coordinator: {}'.format(err))
+                job = None
+
+            if job is not None:
+                self.process(job)
+            elif exit_when_idle and self.worker_id is not None:
+                return
+            else:
+                time.sleep(poll_interval)
+
+    def _heartbeats(self, stop, worker_id):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                self.client.heartbeat(worker_id)
+            except (FarmError, IOError, OSError) as err:
+                self.log('Heartbeat failed: {}'.format(err))
+
+    def process(self, job):
+        """Build a leased job, keeping the lease alive with heartbeats, and report the outcome."""
+        self.log('Building {} ({}), attempt {}'.format(job['package_name'], job['id'], job['attempts']))
+        stop = threading.Event()
+        heartbeats = threading.Thread(target=self._heartbeats, args=(stop, self.worker_id), name='heartbeat')
+        heartbeats.daemon = True
+        heartbeats.start()
+        try:
+            try:
+                result, artifacts = self.build(job)
+            except BuildError as err:
+                self.log('Build of {} failed: {}'.format(job['package_name'], err))
+                self._report(job, self.client.fail, self.worker_id, job['id'], str(err), err.retry)
+                return
+            except Exception as err:  # pylint: disable=broad-except
+                # A bug in the build should fail the job, not stop the worker
+                self.log('Build of {} raised an exception:\n{}'.format(job['package_name'], traceback.format_exc()))
+                self._report(job, self.client.fail, self.worker_id, job['id'], '{}: {}'.format(type(err).__name__, err))
+                return
+
+            def succeeded():
+                for name, path in sorted(artifacts.items()):
+                    self.log('Uploading {} ({} bytes)'.format(name, os.path.getsize(path)))
+                    self.client.upload(self.worker_id, job['id'], name, path)
+                self.client.complete(self.worker_id, job['id'], result)
+
+            if self._report(job, succeeded):
+                self.log('Built {}'.format(job['package_name']))
+        finally:
+            stop.set()
+            heartbeats.join()
+
+    def _report(self, job, report, *args):
+        """Call report(*args) to send the outcome of job, retrying while the coordinator is unreachable.
+
+        Returns True if the coordinator accepted the outcome. If it cannot be reached, the job is failed
+        if possible, and otherwise the worker registers again, so that its old registration is reaped and
+        the job queued again.
+        """
+        for attempt in range(REPORT_ATTEMPTS):
+            try:
+                report(*args)
+                return True
+            except FarmError as err:
+                # eg. the job was handed to another worker after this one missed its heartbeats
+                self.log('Coordinator refused the outcome of {}: {}'.format(job['package_name'], err))
+                return False
+            except (IOError, OSError) as err:  # urllib2.URLError is an IOError
+                self.log('Unable to report the outcome of {}: {}'.format(job['package_name'], err))
+                if attempt + 1 < REPORT_ATTEMPTS:
+                    time.sleep(min(2 ** attempt, 30))
+
+        try:
+            self.client.fail(self.worker_id, job['id'], 'Worker {} was unable to report the outcome'.format(self.name))
+        except (FarmError, IOError, OSError) as err:
+            self.log('Unable to fail {}, registering again: {}'.format(job['package_name'], err))
+            self.worker_id = None
+        return False
@@ -0,0 +1,328 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Declarative modifications of a CCP package's optionXML.xml and ApplicationInfo.xml.
+
+A policy is a plain dict, usually supplied as a recipe input:
+
+    suppress                Dict of SuppressOptions element name to bool, eg. {"ACC": True, "Update": True}
+    remove_packages         Dict of ASU packageSet name to a list of package names to remove from it
+    package_set_overrides   Dict of packageSet name to a list of package names, added to
+                            AAMInfo/overrideXML if no overrides exist yet
+    panels                  Dict of ACC panel name to visibility, eg. {"AppsPanel": False}
+    features                Dict of ACC feature name to enabled state, eg. {"SelfServeInstalls": False}
+
+compile_policy() validates the dict once, and the resulting BuildPolicy
+applies it to each file in a single walk of the tree.
+"""
+from __future__ import absolute_import
+
+__all__ = ["PolicyError", "BuildPolicy", "compile_policy", "SUPPRESS_CCDA_POLICY"]
+
+# Package sets written to AAMInfo/overrideXML when suppressing the CCDA
+ACC_PACKAGE_SETS = {
+    'AAM': [
+        'UWA',
+        'PDApp',
+        'D6',
+        'DECore',
+        'DWA',
+        'P6',
+        'LWA',
+        'CCM',
+        'P7',
+        'AdobeGCClient',
+        'IPC'
+    ],
+    'ADC': [
+        'Runtime',
+        'Core',
+        'HEX',
+        'CEF',
+        'CoreExt',
+        'ElevationManager',
+        'TCC',
+        'Notifications',
+        'SignInApp'
+    ],
+    'ACC': [
+        'HDCore',
+        'AppsPanel'
+    ]
+}
+
+# Packages removed from the ACC package set of ASU/packages/ApplicationInfo.xml when suppressing the CCDA
+ACC_PACKAGES_TO_REMOVE = [
+    'ACCC',
+    'Utils',
+    'CoreSync',
+    'CoreSyncExtension',
+    'LiveType',
+    'ExchangePlugin',
+    'DesignLibraryPlugin',
+    'SynKit',
+    'CCSyncPlugin',
+    'CCLibrary',
+    'HomePanel',
+    'AssetsPanel',
+    'FilesPanel',
+    'FontsPanel',
+    'MarketPanel',
+    'BehancePanel',
+    'SPanel',
+    'CCXProcess'
+]
+
+# The policy applied by the `suppress_ccda` input
+SUPPRESS_CCDA_POLICY = {
+    'suppress': {'ACC': True, 'Update': True},
+    'remove_packages': {'ACC': ACC_PACKAGES_TO_REMOVE},
+    'package_set_overrides': ACC_PACKAGE_SETS,
+}
+
+POLICY_KEYS = ('suppress', 'remove_packages', 'package_set_overrides', 'panels', 'features')
+
+SUPPRESS_OPTIONS_PATH = ('Configurations', 'SuppressOptions')
+PANEL_MASKING_PATH = ('Configurations', 'ACCPanelMaskingConfig', 'config')
+OVERRIDES_PATH = ('AAMInfo', 'overrideXML', 'application', 'packageSets')
+
+try:
+    STRING_TYPES = basestring
+except NameError:  # Python 3
+    STRING_TYPES = str
+
+
+class PolicyError(ValueError):
+    """Raised for an invalid policy, or a package which the policy cannot be applied to."""
+    pass
+
+
+def _bool(value, key):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ('true', '1', 'yes'):
+        return True
+    if str(value).lower() in ('false', '0', 'no'):
+        return False
+    raise PolicyError('Expected a boolean for {}, got {!r}'.format(key, value))
+
+
+def _bool_map(policy, key):
+    return dict((str(name), _bool(value, '{}.{}'.format(key, name)))
+                for name, value in policy.get(key, {}).items())
+
+
+def _names_map(policy, key):
+    names = {}
+    for set_name, packages in policy.get(key, {}).items():
+        if isinstance(packages, STRING_TYPES):
+            raise PolicyError('Expected a list of package names for {}.{}'.format(key, set_name))
+        names[str(set_name)] = tuple(str(name) for name in packages)
+    return names
+
+
+def compile_policy(policy):
+    """Validate a policy dict and compile it into a BuildPolicy."""
+    unknown = set(policy) - set(POLICY_KEYS)
+    if unknown:
+        raise PolicyError('Unknown policy key(s): {}. Expected some of: {}'.format(
+            ', '.join(sorted(unknown)), ', '.join(POLICY_KEYS)))
+
+    return BuildPolicy(
+        suppress=_bool_map(policy, 'suppress'),
+        remove_packages=dict((name, frozenset(packages))
+                             for name, packages in _names_map(policy, 'remove_packages').items()),
+        package_set_overrides=_names_map(policy, 'package_set_overrides'),
+        panels=_bool_map(policy, 'panels'),
+        features=_bool_map(policy, 'features'),
+    )
+
+
+def _walk(root):
+    """Yield (path, element) for every element below root, where path is a tuple of tag names."""
+    stack = [((), root)]
+    while stack:
+        path, elem = stack.pop()
+        for child in reversed(list(elem)):
+            child_path = path + (child.tag,)
+            yield child_path, child
+            stack.append((child_path, child))
+
+
+def _sub_element(parent, tag, text=None):
+    from xml.etree import ElementTree
+    elem = ElementTree.SubElement(parent, tag)
+    if text is not None:
+        elem.text = text
+    return elem
+
+
+def _ensure_path(root, path):
+    """Return the element at path below root, creating any missing elements."""
+    elem = root
+    for tag in path:
+        child = elem.find(tag)
+        if child is None:
+            child = _sub_element(elem, tag)
+        elem = child
+    return elem
+
+
+class BuildPolicy(object):
+    """A compiled policy. Use compile_policy() to create one."""
+
+    def __init__(self, suppress, remove_packages, package_set_overrides, panels, features):
+        self.suppress = suppress
+        self.remove_packages = remove_packages
+        self.package_set_overrides = package_set_overrides
+        self.panels = panels
+        self.features = features
+
+    def __bool__(self):
+        return any([self.suppress, self.remove_packages, self.package_set_overrides, self.panels, self.features])
+
+    __nonzero__ = __bool__
+
+    def canonical(self):
+        """Return a JSON-serializable form of the policy, stable across runs."""
+        return {
+            'suppress': self.suppress,
+            'remove_packages': dict((name, sorted(packages)) for name, packages in self.remove_packages.items()),
+            'package_set_overrides': dict((name, list(packages))
+                                          for name, packages in self.package_set_overrides.items()),
+            'panels': self.panels,
+            'features': self.features,
+        }
+
+    def modifies_option_xml(self):
+        return bool(self.suppress or self.package_set_overrides or self.panels or self.features)
+
+    def modifies_application_info(self):
+        return bool(self.remove_packages)
+
+    def apply_option_xml(self, root):
+        """Apply the suppress flags, package set overrides, panel masking and feature toggles to optionXML.xml.
+
+        Returns:
+            list: A description of each change made. Empty if the tree was already compliant.
+        """
+        changes = []
+        seen_suppress = set()
+        seen_panels = set()
+        seen_features = set()
+        has_overrides = False
+
+        for path, elem in _walk(root):
+            if path[-3:-1] == SUPPRESS_OPTIONS_PATH and elem.tag in self.suppress:
+                seen_suppress.add(elem.tag)
+                self._apply_suppress(elem, changes)
+            elif path[-4:-1] == PANEL_MASKING_PATH and elem.tag == 'panel':
+                name = elem.findtext('name')
+                if name in self.panels:
+                    seen_panels.add(name)
+                    self._set_child_text(elem, 'visible', self.panels[name], 'Panel ' + name, changes)
+            elif path[-4:-1] == PANEL_MASKING_PATH and elem.tag == 'feature':
+                name = elem.findtext('name')
+                if name in self.features:
+                    seen_features.add(name)
+                    self._set_child_text(elem, 'enabled', self.features[name], 'Feature ' + name, changes)
+            elif path[-4:] == OVERRIDES_PATH:
+                has_overrides = True
+
+        missing = set(self.suppress) - seen_suppress
+        if missing:
+            raise PolicyError('Expected to find element(s) .//{}/{}'.format(
+                '/'.join(SUPPRESS_OPTIONS_PATH), ', '.join(sorted(missing))))
+
+        if self.package_set_overrides and not has_overrides:
+            aam_info = root.find('.//AAMInfo')
+            if aam_info is None:
+                raise PolicyError('Expected to find element .//AAMInfo')
+            package_sets = _ensure_path(aam_info, OVERRIDES_PATH[1:])
+            for set_name in sorted(self.package_set_overrides):
+                pkg_set = _sub_element(package_sets, 'packageSet')
+                _sub_element(pkg_set, 'name', set_name)
+                pkgs = _sub_element(pkg_set, 'packages')
+                for pkg_name in self.package_set_overrides[set_name]:
+                    _sub_element(_sub_element(pkgs, 'package'), 'name', pkg_name)
+            changes.append('Added overrides for package sets {}'.format(', '.join(sorted(self.package_set_overrides))))
+
+        new_panels = sorted(set(self.panels) - seen_panels)
+        new_features = sorted(set(self.features) - seen_features)
+        if new_panels or new_features:
+            configurations = root.find('.//Configurations')
+            if configurations is None:
+                configurations = _sub_element(root, 'Configurations')
+            config = _ensure_path(configurations, PANEL_MASKING_PATH[1:])
+            for name in new_panels:
+                panel = _sub_element(config, 'panel')
+                _sub_element(panel, 'name', name)
+                _sub_element(panel, 'visible', str(self.panels[name]).lower())
+                changes.append('Added panel {} (visible: {})'.format(name, str(self.panels[name]).lower()))
+            for name in new_features:
+                feature = _sub_element(config, 'feature')
+                _sub_element(feature, 'name', name)
+                _sub_element(feature, 'enabled', str(self.features[name]).lower())
+                changes.append('Added feature {} (enabled: {})'.format(name, str(self.features[name]).lower()))
+
+        return changes
+
+    def apply_application_info(self, root):
+        """Remove packages from the package sets of ASU/packages/ApplicationInfo.xml.
+
+        Returns:
+            list: A description of each change made. Empty if the tree was already compliant.
+        """
+        changes = []
+        seen_sets = set()
+        for _, elem in _walk(root):
+            if elem.tag != 'packageSet':
+                continue
+            set_name = elem.findtext('name')
+            to_remove = self.remove_packages.get(set_name)
+            packages = elem.find('packages')
+            if to_remove is None or packages is None:
+                continue
+
+            seen_sets.add(set_name)
+            for package in list(packages):
+                name = package.findtext('name')
+                if package.tag == 'package' and name in to_remove:
+                    packages.remove(package)
+                    changes.append('Removed package {} from package set {}'.format(name, set_name))
+
+        missing = set(self.remove_packages) - seen_sets
+        if missing:
+            raise PolicyError('Tried to remove packages, but no packageSet element was found for: {}'.format(
+                ', '.join(sorted(missing))))
+        return changes
+
+    def _apply_suppress(self, elem, changes):
+        # Update is the only SuppressOptions element which uses isEnabled instead of a suppress attribute
+        if elem.tag == 'Update':
+            attr, value = 'isEnabled', '0' if self.suppress[elem.tag] else '1'
+        else:
+            attr, value = 'suppress', str(self.suppress[elem.tag]).lower()
+
+        if elem.get(attr) != value:
+            elem.set(attr, value)
+            changes.append('Set {} {} to {}'.format(elem.tag, attr, value))
+
+    def _set_child_text(self, elem, tag, enabled, label, changes):
+        value = str(enabled).lower()
+        child = elem.find(tag)
+        if child is None:
+            child = _sub_element(elem, tag)
+        if child.text != value:
+            child.text = value
+            changes.append('Set {} {} to {}'.format(label, tag, value))
@@ -0,0 +1,148 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Size-budgeted, least-recently-used eviction of build artifacts in the AutoPkg cache.
+
+Every recipe run leaves a build tree and downloaded documents in its
+RECIPE_CACHE_DIR. The processors record each artifact, with its size and
+when it was last used, in CACHE_DIR/ccp-artifacts.json:
+
+    index = ArtifactIndex(cache_dir)
+    index.touch(build_dir, recipe_cache_dir, refresh=True)
+    evicted = index.evict(budget, protect=recipe_cache_dir)
+    index.save()
+
+evict() removes the least recently used artifacts of other recipes until
+the recorded total fits the budget. Nothing under the protected directory,
+which holds the build of the current run, is removed.
+
+Separate autopkg processes may share the index, but the last one to save
+it wins.
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import time
+
+from .fileutil import load_state, save_state
+
+__all__ = ["ArtifactIndex", "format_size", "parse_size", "tree_size"]
+
+INDEX_NAME = 'ccp-artifacts.json'
+SIZE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?$', re.IGNORECASE)
+
+
+def parse_size(value):
+    """Parse a size such as 500M or 40G into bytes. A plain number is bytes.
+
+    Raises:
+        ValueError: If value is not a size
+    """
+    match = SIZE_RE.match(str(value).strip())
+    if not match:
+        raise ValueError('Expected a size such as 500M or 40G, got {}'.format(value))
+    return int(float(match.group(1)) * 1024 ** ' KMGT'.index(match.group(2).upper() or ' '))
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f} TiB'.format(size)
+
+
+def tree_size(path):
+    """Return the total size of a file, or of every file below a directory. Symlinks are not followed."""
+    if not os.path.isdir(path) or os.path.islink(path):
+        try:
+            return os.lstat(path).st_size
+        except OSError:
+            return 0
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _inside(path, directory):
+    directory = os.path.join(os.path.abspath(directory), '')
+    return os.path.join(os.path.abspath(path), '').startswith(directory)
+
+
+class ArtifactIndex(object):
+    """Artifacts recorded by path, with their size, last use and recipe cache directory."""
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, INDEX_NAME)
+        self.artifacts = load_state(self.path).get('artifacts', {})
+
+    def save(self):
+        if not os.path.isdir(os.path.dirname(self.path) or '.'):
+            os.makedirs(os.path.dirname(self.path))
+        save_state(self.path, {'artifacts': self.artifacts})
+
+    def total_size(self):
+        return sum(entry['size'] for entry in self.artifacts.values())
+
+    def touch(self, path, recipe_cache_dir, refresh=False):
+        """Record that path was used now. Its size is measured if it is new, or if refresh is set."""
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            self.artifacts.pop(path, None)
+            return
+        entry = self.artifacts.get(path)
+        if entry is None or refresh:
+            entry = self.artifacts[path] = {'size': tree_size(path), 'recipe': os.path.abspath(recipe_cache_dir)}
+        entry['last_used'] = time.time()
+
+    def evict(self, budget, protect=None):
+        """Remove least recently used artifacts until the total recorded size is no more than budget.
+
+        Args:
+            budget (int): Size budget in bytes
+            protect (str): Directory whose artifacts are never removed, eg. the RECIPE_CACHE_DIR of this run
+        Returns:
+            list: (path, size) of each removed artifact
+        """
+        import shutil
+
+        # Forget artifacts which were removed by other means, eg. a rebuild
+        for path in [path for path in self.artifacts if not os.path.exists(path)]:
+            del self.artifacts[path]
+
+        evicted = []
+        total = self.total_size()
+        for path in sorted(self.artifacts, key=lambda p: self.artifacts[p].get('last_used', 0)):
+            if total <= budget:
+                break
+            if protect and _inside(path, protect):
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            if os.path.exists(path):
+                continue
+            size = self.artifacts.pop(path)['size']
+            total -= size
+            evicted.append((path, size))
+        return evicted
@@ -0,0 +1,123 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Product selection and the URLs of the documents a feed product refers to.
+
+Shared by CreativeCloudFeed and the catalog prefetcher, so that both agree
+on which product a recipe resolves to and which URLs it fetches.
+"""
+from __future__ import absolute_import
+
+try:
+    from urllib import urlencode
+except ImportError:  # Python 3
+    from urllib.parse import urlencode
+
+__all__ = [
+    "FEED_URL",
+    "CDN_SECURE_URL",
+    "UPDATE_DESC_URL",
+    "HEADERS",
+    "feed_url",
+    "find_product",
+    "desc_url",
+    "largest_icon_url",
+    "manifest_url",
+]
+
+FEED_URL = 'https://prod-rel-ffc-ccm.oobesaas.adobe.com/adobe-ffc-external/core/v4/products/all'
+CDN_SECURE_URL = 'https://ccmdls.adobe.com'
+UPDATE_DESC_URL = 'https://prod-rel-ffc.oobesaas.adobe.com/adobe-ffc-external/core/v1/update/description'
+HEADERS = {'User-Agent': 'Creative Cloud', 'x-adobe-app-id': 'AUSST_4_0'}
+
+
+def feed_url(base_url, channels, platforms):
+    """Build the GET query for the product feed at base_url."""
+    params = [
+        ('payload', 'true'),
+        ('productType', 'Desktop'),
+        ('_type', 'json')
+    ]
+    for ch in channels:
+        params.append(('channel', ch))
+
+    for pl in platforms:
+        params.append(('platform', pl))
+
+    return base_url + '?' + urlencode(params)
+
+
+def find_product(feed, channels, sap_code, base_version, version='latest'):
+    """Find a product in a feed.
+
+    Args:
+        feed (ccplib.feedrecords.Feed): The feed
+        channels (list): Names of the channels to search
+        sap_code (str): SAP code of the product
+        base_version (str): Base version of the product, or an empty string for any
+        version (str): The exact version, or 'latest' for the highest version
+    Returns:
+        ccplib.feedrecords.ProductRecord: The product, or None if nothing matched
+    """
+    product = None
+    for prod in feed.find(sap_code, channels):
+        if not prod.platforms or prod.version is None:
+            continue
+
+        if base_version and prod.base_version != base_version:
+            continue
+
+        if version == "latest":
+            if product is None or prod.version_key > product.version_key:
+                product = prod
+        else:
+            if prod.version == version:
+                product = prod
+
+    return product
+
+
+def desc_url(sapcode, version, platform, language):
+    """Build the query for fetching an update description"""
+    params = [
+        ('name', sapcode),
+        ('version', version),
+        ('platform', platform),
+        ('language', language)
+    ]
+
+    return UPDATE_DESC_URL + '?' + urlencode(params)
+
+
+def largest_icon_url(product):
+    """Return the URL of the widest icon of a product record, or None if it has no icons."""
+    largest_width = 0
+    largest_icon_url = None
+    for size, url in product.icons:
+        width = int(size.split('x', 2)[0])
+        if width > largest_width:
+            largest_width = width
+            largest_icon_url = url
+    return largest_icon_url
+
+
+def manifest_url(platform, cdn):
+    """Return the secure URL of a platform's manifest.xml, or None if it has none.
+
+    Args:
+        platform (ccplib.feedrecords.PlatformRecord): A platform of a product
+        cdn (dict): The 'cdn' of the first requested channel, may be None
+    """
+    if not platform.manifest_path:
+        return None
+    return '{}{}'.format((cdn or {}).get('secure', CDN_SECURE_URL), platform.manifest_path)
@@ -0,0 +1,154 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""SQLite history of every product version seen in the feed.
+
+Each fetched feed is ingested in one transaction. There is a row per
+(channel, sapCode, baseVersion, version, platform), with the manifest URL,
+OS range and when the row was first and last seen:
+
+    history = FeedHistory(path)
+    history.ingest(feed)
+    history.first_seen('PHSP', '19.1.2')
+
+Rows are indexed by sap_code and base_version, so looking up the versions
+of a product does not read the feed again.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import time
+
+from .catalog import manifest_url
+
+__all__ = ["FeedHistory", "default_path"]
+
+HISTORY_NAME = 'ccp-feed-history.sqlite'
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS releases ('
+    '  channel TEXT NOT NULL,'
+    '  sap_code TEXT NOT NULL,'
+    '  base_version TEXT NOT NULL,'
+    '  version TEXT NOT NULL,'
+    '  platform TEXT NOT NULL,'
+    '  manifest_url TEXT,'
+    '  os_range TEXT,'
+    '  first_seen REAL NOT NULL,'
+    '  last_seen REAL NOT NULL,'
+    '  PRIMARY KEY (channel, sap_code, base_version, version, platform))',
+    'CREATE INDEX IF NOT EXISTS releases_sap_code ON releases (sap_code)',
+    'CREATE INDEX IF NOT EXISTS releases_base_version ON releases (base_version)',
+]
+
+INSERT = ('INSERT OR IGNORE INTO releases (channel, sap_code, base_version, version, platform, manifest_url, '
+          'os_range, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+TOUCH = ('UPDATE releases SET last_seen = ?, manifest_url = ?, os_range = ? '
+         'WHERE channel = ? AND sap_code = ? AND base_version = ? AND version = ? AND platform = ?')
+
+
+def default_path(autopkg_cache_dir=None):
+    """Return the history database path inside the AutoPkg cache directory."""
+    return os.path.join(autopkg_cache_dir or os.path.expanduser('~/Library/AutoPkg/Cache'), HISTORY_NAME)
+
+
+class FeedHistory(object):
+    """Product versions seen in the feed, stored in a SQLite database at path."""
+
+    def __init__(self, path):
+        import sqlite3
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Separate autopkg runs may share the database, so wait for their transactions
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def ingest(self, feed, seen=None):
+        """Record every product platform of a feed, in a single transaction.
+
+        Args:
+            feed (ccplib.feedrecords.Feed): The feed
+            seen (float): When the feed was fetched, as a Unix timestamp. Defaults to now.
+        Returns:
+            int: The number of rows which had not been seen before
+        """
+        seen = time.time() if seen is None else seen
+        rows = []
+        for product in feed.products:
+            if product.version is None:
+                continue
+            for platform in product.platforms:
+                rows.append((
+                    product.channel.name or '', product.id, platform.base_version or '', product.version,
+                    platform.id or '', manifest_url(platform, product.cdn), json.dumps(list(platform.os_range)),
+                ))
+
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(INSERT, [row + (seen, seen) for row in rows])
+            added = self.connection.total_changes - before
+            self.connection.executemany(TOUCH, [(seen, row[5], row[6]) + row[:5] for row in rows])
+        return added
+
+    def releases(self, sap_code, base_version=None, channels=None):
+        """Return the rows of a product, oldest first.
+
+        Args:
+            sap_code (str): SAP code of the product
+            base_version (str): Only rows with this base version, if given
+            channels (list): Only rows in these channels, if given
+        Returns:
+            list: sqlite3.Row objects, which can be indexed by column name
+        """
+        query = 'SELECT * FROM releases WHERE sap_code = ?'
+        params = [sap_code]
+        if base_version:
+            query += ' AND base_version = ?'
+            params.append(base_version)
+        if channels:
+            query += ' AND channel IN ({})'.format(', '.join('?' * len(channels)))
+            params.extend(channels)
+        query += ' ORDER BY first_seen, version'
+        return self.connection.execute(query, params).fetchall()
+
+    def find_release(self, sap_code, base_version, version='latest', channels=None):
+        """Resolve a product the way catalog.find_product does, from the history.
+
+        Returns:
+            sqlite3.Row: The first row of the matching version, or None if nothing matched
+        """
+        from distutils.version import LooseVersion
+
+        match = None
+        for row in self.releases(sap_code, base_version, channels):
+            if version == 'latest':
+                if match is None or LooseVersion(row['version']) > LooseVersion(match['version']):
+                    match = row
+            elif row['version'] == version and match is None:
+                match = row
+        return match
+
+    def first_seen(self, sap_code, version):
+        """Return when a version of a product first appeared in any channel, or None if it never has."""
+        row = self.connection.execute('SELECT MIN(first_seen) FROM releases WHERE sap_code = ? AND version = ?',
+                                      (sap_code, version)).fetchone()
+        return row[0]
@@ -0,0 +1,228 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compact records of the products in a feed.
+
+The feed is a deeply nested document:
+
+    channel -> products -> product -> platforms -> platform -> languageSet -> urls
+
+Feed.from_json() reads it one product at a time, keeping only the fields
+the processors use in __slots__ records, so the whole document is never
+held as dicts. The raw JSON text is kept, and each record remembers where
+its fragment starts and ends, so ProductRecord.fragment() can return the
+original product dict when it is needed, eg. to write product.json.
+"""
+from __future__ import absolute_import
+
+import json
+import re
+
+__all__ = ["Feed", "ChannelRecord", "ProductRecord", "PlatformRecord"]
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+
+def _share(shared, value):
+    """Return the first equal value seen while reading the feed, so that repeated values are stored once."""
+    return shared.setdefault(value, value)
+
+
+class ChannelRecord(object):
+    """A feed channel. Every product in the channel shares this record."""
+    __slots__ = ('name', 'cdn')
+
+    def __init__(self, name=None, cdn=None):
+        self.name = name
+        self.cdn = cdn
+
+
+class PlatformRecord(object):
+    """A platform of a product, with the fields of its first language set."""
+    __slots__ = ('id', 'package_type', 'os_range', 'base_version', 'manifest_path')
+
+    def __init__(self, platform, shared):
+        self.id = _share(shared, platform.get('id'))
+        self.package_type = _share(shared, platform.get('packageType'))
+        self.os_range = _share(shared, tuple(
+            platform.get('systemCompatibility', {}).get('operatingSystem', {}).get('range', [])))
+        language_sets = platform.get('languageSet') or [{}]
+        self.base_version = _share(shared, language_sets[0].get('baseVersion'))
+        self.manifest_path = language_sets[0].get('urls', {}).get('manifestURL')
+
+
+class ProductRecord(object):
+    """A product of the feed."""
+    __slots__ = ('id', 'version', 'display_name', 'product_info_page', 'icons', 'platforms', 'channel',
+                 '_feed', '_start', '_end', '_version_key')
+
+    def __init__(self, product, channel, feed, start, end, shared):
+        self.id = _share(shared, product.get('id'))
+        self.version = product.get('version')
+        self.display_name = _share(shared, product.get('displayName'))
+        self.product_info_page = _share(shared, product.get('productInfoPage'))
+        self.icons = tuple((_share(shared, icon.get('size', '0x0')), icon.get('value'))
+                           for icon in product.get('productIcons', {}).get('icon', []))
+        self.platforms = tuple(PlatformRecord(platform, shared)
+                               for platform in product.get('platforms', {}).get('platform', []))
+        self.channel = channel
+        self._feed = feed
+        self._start = start
+        self._end = end
+        self._version_key = None
+
+    @property
+    def base_version(self):
+        """The base version of the first platform, which is what products are matched on."""
+        return self.platforms[0].base_version if self.platforms else None
+
+    @property
+    def cdn(self):
+        return self.channel.cdn
+
+    @property
+    def version_key(self):
+        """The version as a LooseVersion, for comparisons. Created on first use."""
+        if self._version_key is None:
+            from distutils.version import LooseVersion
+            self._version_key = LooseVersion(self.version)
+        return self._version_key
+
+    def fragment(self):
+        """Parse and return the product's original dict from the feed."""
+        return self._feed.fragment(self._start, self._end)
+
+
+class _Scanner(object):
+    """Walks a JSON document, decoding only the values which the caller asks for."""
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def peek(self):
+        self.pos = WHITESPACE_RE.match(self.text, self.pos).end()
+        if self.pos >= len(self.text):
+            raise ValueError('Unexpected end of feed')
+        return self.text[self.pos]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {!r} at offset {} of feed'.format(char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        """Decode the next value. Returns (value, start offset, end offset)."""
+        self.peek()
+        start = self.pos
+        value, self.pos = self.decoder.raw_decode(self.text, start)
+        return value, start, self.pos
+
+    def _separated(self, close):
+        """After an item has been consumed, return True if another item follows."""
+        char = self.peek()
+        self.pos += 1
+        if char == ',':
+            return True
+        if char == close:
+            return False
+        raise ValueError('Expected {!r} or {!r} at offset {} of feed'.format(',', close, self.pos - 1))
+
+    def members(self):
+        """Yield the keys of the next object. The caller must consume each key's value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()[0]
+            self.expect(':')
+            yield key
+            if not self._separated('}'):
+                return
+
+    def items(self):
+        """Yield once per item of the next array. The caller must consume each item."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if not self._separated(']'):
+                return
+
+
+class Feed(object):
+    """Product records of a feed, and the raw JSON text they were read from."""
+
+    def __init__(self, text):
+        self.text = text
+        self.channels = []
+        self.products = []
+        self._by_id = {}
+
+    @classmethod
+    def from_json(cls, text):
+        """Read the records of a feed from its JSON text."""
+        if isinstance(text, bytes) and bytes is not str:  # Python 3
+            text = text.decode('utf-8')
+
+        feed = cls(text)
+        shared = {}
+        scanner = _Scanner(text)
+        for key in scanner.members():
+            if key != 'channel':
+                scanner.value()
+                continue
+            for _ in scanner.items():
+                channel = ChannelRecord()
+                feed.channels.append(channel)
+                feed._read_channel(scanner, channel, shared)
+
+        for product in feed.products:
+            feed._by_id.setdefault(product.id, []).append(product)
+        return feed
+
+    def _read_channel(self, scanner, channel, shared):
+        for key in scanner.members():
+            if key == 'name':
+                channel.name = scanner.value()[0]
+            elif key == 'cdn':
+                channel.cdn = scanner.value()[0]
+            elif key == 'products':
+                for products_key in scanner.members():
+                    if products_key != 'product':
+                        scanner.value()
+                        continue
+                    for _ in scanner.items():
+                        product, start, end = scanner.value()
+                        self.products.append(ProductRecord(product, channel, self, start, end, shared))
+            else:
+                scanner.value()
+
+    def cdn(self, channel_name):
+        """Return the cdn of the named channel, or None."""
+        for channel in self.channels:
+            if channel.name == channel_name:
+                return channel.cdn
+        return None
+
+    def find(self, sap_code, channels=None):
+        """Return the products with sap_code, in feed order, optionally only those in the named channels."""
+        return [product for product in self._by_id.get(sap_code, [])
+                if channels is None or product.channel.name in channels]
+
+    def fragment(self, start, end):
+        return json.loads(self.text[start:end])
@@ -0,0 +1,81 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process store of parsed product feeds.
+
+`autopkg run a b c` runs every recipe in one process, and each recipe's
+CreativeCloudFeed would otherwise download and parse the same feed. Feeds
+are kept here by URL, which encodes the channel and platform query, and
+are read into a ccplib.feedrecords.Feed at most once per TTL window:
+
+    feed = feedstore.get_feed(url, download)
+
+where download(url) returns the raw JSON. The returned feed is shared by
+every caller in the process, so it must be treated as read-only.
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+
+from .feedrecords import Feed
+
+__all__ = ["DEFAULT_TTL", "get_feed", "invalidate"]
+
+# Seconds for which a parsed feed is reused
+DEFAULT_TTL = 15 * 60
+
+_lock = threading.Lock()
+_feeds = {}
+
+
+class _Entry(object):
+    __slots__ = ("lock", "data", "fetched")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+        self.fetched = 0
+
+
+def get_feed(url, download, ttl=DEFAULT_TTL):
+    """Return the feed at url, downloading it only if there is no unexpired copy.
+
+    Concurrent callers for the same url wait for a single download.
+
+    Args:
+        url (str): The feed URL, including its query
+        download (callable): Called with url, returns the raw feed JSON
+        ttl (int): Seconds for which a previously read feed is reused. 0 always downloads.
+    Returns:
+        ccplib.feedrecords.Feed: The feed
+    """
+    with _lock:
+        entry = _feeds.get(url)
+        if entry is None:
+            entry = _feeds[url] = _Entry()
+
+    with entry.lock:
+        if entry.data is None or time.time() - entry.fetched >= ttl:
+            entry.data = Feed.from_json(download(url))
+            entry.fetched = time.time()
+        return entry.data
+
+
+def invalidate(url=None):
+    """Forget the parsed feed at url, or every feed if url is None."""
+    with _lock:
+        if url is None:
+            _feeds.clear()
+        else:
+            _feeds.pop(url, None)
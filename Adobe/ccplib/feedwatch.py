@@ -0,0 +1,221 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Poll the product feed and emit an event for each product version which appears or disappears.
+
+Polls use conditional requests (If-None-Match and If-Modified-Since), so an
+unchanged feed costs a 304 response and is not parsed again. The previous
+snapshot is kept in memory and compared with each new one:
+
+    watcher = FeedWatcher(url, headers, [StdoutSink()])
+    watcher.run(interval=300)
+
+An event is a dict:
+
+    {"event": "added", "sapCode": "PHSP", "version": "19.1.2", "baseVersion": "19.0",
+     "displayName": "Photoshop CC", "channels": ["ccp_hd_2"], "time": "2018-04-01T12:00:00Z"}
+
+The first poll only records the snapshot, unless emit_initial is set.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from .feedrecords import Feed
+from .fileutil import atomic_write
+
+__all__ = ["FeedWatcher", "StdoutSink", "SpoolSink", "WebhookSink", "snapshot", "diff_snapshots", "parse_sink"]
+
+
+def snapshot(feed):
+    """Summarize a feed as {(sapCode, version): product info}, merging the channels a version appears in."""
+    products = {}
+    for product in feed.products:
+        if product.version is None:
+            continue
+        key = (product.id, product.version)
+        entry = products.get(key)
+        if entry is None:
+            entry = products[key] = {
+                'sapCode': product.id,
+                'version': product.version,
+                'baseVersion': product.base_version,
+                'displayName': product.display_name,
+                'channels': [],
+            }
+        if product.channel.name not in entry['channels']:
+            entry['channels'].append(product.channel.name)
+    return products
+
+
+def diff_snapshots(old, new):
+    """Return the 'added' and 'removed' events between two snapshots, sorted by SAP code and version."""
+    events = []
+    for key in sorted(set(new) - set(old)):
+        events.append(dict(new[key], event='added'))
+    for key in sorted(set(old) - set(new)):
+        events.append(dict(old[key], event='removed'))
+    return events
+
+
+class StdoutSink(object):
+    """Write each event to stdout as a line of JSON."""
+
+    def emit(self, event):
+        sys.stdout.write(json.dumps(event, sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+
+class SpoolSink(object):
+    """Write each event as a JSON file in a spool directory, for another process to pick up and delete."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def emit(self, event):
+        self.count += 1
+        name = '{}-{:06d}-{}-{}.json'.format(time.strftime('%Y%m%d%H%M%S'), self.count, event['sapCode'],
+                                              event['event'])
+        atomic_write(os.path.join(self.path, name), json.dumps(event, sort_keys=True).encode('utf-8'))
+
+
+class WebhookSink(object):
+    """POST each event as JSON to a URL."""
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    def emit(self, event):
+        try:
+            from urllib2 import Request, urlopen
+        except ImportError:  # Python 3
+            from urllib.request import Request, urlopen
+
+        request = Request(self.url, json.dumps(event, sort_keys=True).encode('utf-8'),
+                          {'Content-Type': 'application/json'})
+        urlopen(request, timeout=self.timeout).close()
+
+
+def parse_sink(value):
+    """Create a sink from 'stdout', 'spool:DIR' or 'webhook:URL'."""
+    kind, _, arg = value.partition(':')
+    if kind == 'stdout' and not arg:
+        return StdoutSink()
+    if kind == 'spool' and arg:
+        return SpoolSink(arg)
+    if kind == 'webhook' and arg:
+        return WebhookSink(arg)
+    raise ValueError('Expected stdout, spool:DIR or webhook:URL, got {}'.format(value))
+
+
+class FeedWatcher(object):
+    """Polls the feed at url and emits change events to sinks."""
+
+    def __init__(self, url, headers, sinks, emit_initial=False, log=None):
+        self.url = url
+        self.headers = headers
+        self.sinks = sinks
+        self.emit_initial = emit_initial
+        self.log = log or (lambda msg: sys.stderr.write(msg + '\n'))
+        self.previous = None
+        self.etag = None
+        self.last_modified = None
+        self.digest = None
+
+    def fetch(self):
+        """Download the feed if it changed since the last poll.
+
+        Returns:
+            bytes: The feed JSON, or None if it is unchanged
+        """
+        try:
+            from urllib2 import HTTPError, Request, urlopen
+        except ImportError:  # Python 3
+            from urllib.error import HTTPError
+            from urllib.request import Request, urlopen
+
+        headers = dict(self.headers)
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        try:
+            response = urlopen(Request(self.url, headers=headers))
+        except HTTPError as err:
+            if err.code == 304:
+                return None
+            raise
+        try:
+            data = response.read()
+            self.etag = response.info().get('ETag')
+            self.last_modified = response.info().get('Last-Modified')
+        finally:
+            response.close()
+
+        # Not every server honours conditional requests, so also skip parsing identical bodies
+        digest = hashlib.sha1(data).hexdigest()
+        if digest == self.digest:
+            return None
+        self.digest = digest
+        return data
+
+    def poll(self):
+        """Poll once and emit the events of any change.
+
+        Returns:
+            list: The events emitted
+        """
+        data = self.fetch()
+        if data is None:
+            return []
+
+        current = snapshot(Feed.from_json(data))
+        if self.previous is None and not self.emit_initial:
+            self.previous = current
+            self.log('Recorded initial snapshot of {} product version(s)'.format(len(current)))
+            return []
+
+        events = diff_snapshots(self.previous or {}, current)
+        self.previous = current
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        for event in events:
+            event['time'] = stamp
+            for sink in self.sinks:
+                try:
+                    sink.emit(event)
+                except (IOError, OSError) as err:
+                    self.log('Unable to emit event to {}: {}'.format(type(sink).__name__, err))
+        return events
+
+    def run(self, interval, iterations=None):
+        """Poll every interval seconds, iterations times or forever. Failed polls are logged and retried."""
+        count = 0
+        while iterations is None or count < iterations:
+            started = time.time()
+            try:
+                events = self.poll()
+                if events:
+                    self.log('{} change(s) in the feed'.format(len(events)))
+            except (IOError, OSError, ValueError) as err:  # urllib2.URLError is an IOError
+                self.log('Unable to poll the feed: {}'.format(err))
+            count += 1
+            if iterations is None or count < iterations:
+                time.sleep(max(0, interval - (time.time() - started)))
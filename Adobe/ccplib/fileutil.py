@@ -0,0 +1,108 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""File helpers: atomic replacement, chunked copies and cheap change detection."""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+
+__all__ = ["atomic_open", "atomic_write", "copy_stream", "stat_fingerprint", "load_state", "save_state"]
+
+# Bytes read and written at a time by copy_stream()
+CHUNK_SIZE = 64 * 1024
+
+
+@contextmanager
+def atomic_open(path):
+    """Open a temporary file, in binary mode, which replaces the file at path when the block succeeds.
+
+    The temporary file is in the same directory and is renamed over path, so
+    readers never see a partially written file. If the block raises, it is
+    removed and path is left as it was. The permissions of an existing file
+    are kept.
+    """
+    import shutil
+    import tempfile
+
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=".{}.".format(name), dir=directory or ".")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            yield tmp
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def atomic_write(path, data):
+    """Replace the file at path with data, see atomic_open()."""
+    with atomic_open(path) as fd:
+        fd.write(data)
+
+
+def copy_stream(src, dst, chunk_size=CHUNK_SIZE):
+    """Copy the file object src to dst in chunks of chunk_size bytes.
+
+    Returns:
+        int: The number of bytes copied
+    """
+    copied = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            return copied
+        dst.write(chunk)
+        copied += len(chunk)
+
+
+def stat_fingerprint(paths, extra=None):
+    """Return a hex digest of the path, size and mtime of each file in paths.
+
+    No file contents are read. Missing files are part of the fingerprint too.
+    Any JSON-serializable extra value is mixed in, for settings which affect
+    the result derived from the files.
+    """
+    stats = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            stats.append([path, None, None])
+            continue
+        stats.append([path, st.st_size, st.st_mtime])
+
+    key = json.dumps({"files": stats, "extra": extra}, sort_keys=True)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def load_state(path):
+    """Load a JSON state file, returning an empty dict if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as fd:
+            return json.load(fd)
+    except ValueError:
+        return {}
+
+
+def save_state(path, state):
+    """Atomically save a JSON state file."""
+    atomic_write(path, json.dumps(state, sort_keys=True).encode("utf-8"))
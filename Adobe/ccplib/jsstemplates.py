@@ -0,0 +1,260 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Render the JSSImporter smart group and policy templates of many recipes at once.
+
+JSSImporter renders SmartGroupTemplate.xml, PolicyTemplate.xml and the
+uninstall templates during each recipe run, replacing %KEY% tokens with its
+arguments and the recipe environment. This module does the same for every
+recipe without building anything:
+
+    recipes = RecipeIndex(['Adobe', '~/Library/AutoPkg/RecipeOverrides'])
+    renderer = Renderer(recipes)
+    for identifier in recipes.jss_recipes():
+        env = recipes.environment(identifier)
+        env.update(versioner_outputs(cache_dir, identifier))
+        documents = renderer.render(identifier, env)
+
+Each template file is parsed once and reused for every recipe which names
+it. Values are XML-escaped as they are inserted.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import re
+
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from . import plists
+
+__all__ = ["Document", "RecipeIndex", "Renderer", "Template", "TemplateError", "substitute", "versioner_outputs"]
+
+TOKEN_RE = re.compile(r'%(\w+)%')
+VERSIONER_CACHE = '.ccp_versioner_cache.json'
+# Levels of %key% references within values which are resolved
+MAX_DEPTH = 5
+
+
+class TemplateError(Exception):
+    """Raised when a template is missing or is not well-formed XML."""
+    pass
+
+
+def substitute(value, env):
+    """Replace %key% in the strings of value, recursively, as AutoPkg does for processor arguments."""
+    if isinstance(value, dict):
+        return dict((key, substitute(item, env)) for key, item in value.items())
+    if isinstance(value, list):
+        return [substitute(item, env) for item in value]
+    if isinstance(value, plists.STRING_TYPES):
+        # Inputs may refer to other inputs, eg. GROUP_NAME is %NAME%-update-smart
+        for _ in range(MAX_DEPTH):
+            replaced = TOKEN_RE.sub(lambda match: _text(env.get(match.group(1), match.group(0))), value)
+            if replaced == value:
+                break
+            value = replaced
+    return value
+
+
+def _text(value):
+    return value if isinstance(value, plists.STRING_TYPES) else str(value)
+
+
+def versioner_outputs(cache_dir, identifier):
+    """Return the outputs CreativeCloudVersioner cached in the recipe cache directory, or {} if there are none."""
+    path = os.path.join(cache_dir, identifier, VERSIONER_CACHE)
+    try:
+        with open(path, 'r') as fd:
+            outputs = json.load(fd).get('outputs', {})
+    except (IOError, OSError, ValueError):
+        return {}
+    return dict((key, value) for key, value in outputs.items() if value is not None)
+
+
+class Template(object):
+    """A template file, split once into literal text and %KEY% tokens."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'rb') as fd:
+                text = fd.read().decode('utf-8')
+        except (IOError, OSError) as err:
+            raise TemplateError('Unable to read template {}: {}'.format(path, err))
+        try:
+            ElementTree.fromstring(text.encode('utf-8'))
+        except ElementTree.ParseError as err:
+            raise TemplateError('Template {} is not well-formed XML: {}'.format(path, err))
+
+        # Even indexes are literal text, odd indexes are token names
+        self.parts = TOKEN_RE.split(text)
+        self.tokens = frozenset(self.parts[1::2])
+
+    def render(self, values):
+        """Return the rendered text and the set of tokens which had no value."""
+        out = []
+        missing = set()
+        for index, part in enumerate(self.parts):
+            if index % 2 == 0:
+                out.append(part)
+            elif part in values:
+                value = _text(values[part])
+                # A recipe argument whose own %key% had no value
+                missing.update(TOKEN_RE.findall(value))
+                out.append(escape(value))
+            else:
+                missing.add(part)
+                out.append('%{}%'.format(part))
+        return ''.join(out), missing
+
+
+class Document(object):
+    """A rendered smart group or policy."""
+
+    def __init__(self, identifier, kind, name, template, text, missing):
+        self.identifier = identifier
+        self.kind = kind
+        self.name = name
+        self.template = template
+        self.text = text
+        self.missing = sorted(missing)
+
+
+class RecipeIndex(object):
+    """The recipes below a list of directories, by identifier."""
+
+    def __init__(self, directories):
+        self.recipes = {}
+        self.dirs = {}
+        self.errors = []
+        for directory in directories:
+            for root, _, files in os.walk(os.path.abspath(os.path.expanduser(directory))):
+                for name in sorted(files):
+                    if name.endswith('.recipe'):
+                        self._add(os.path.join(root, name))
+
+    def _add(self, path):
+        try:
+            recipe = plists.read_plist(path)
+        except (plists.PlistError, IOError, ValueError) as err:
+            self.errors.append((path, err))
+            return
+        identifier = recipe.get('Identifier')
+        if identifier and identifier not in self.recipes:
+            self.recipes[identifier] = recipe
+            self.dirs[identifier] = os.path.dirname(path)
+
+    def chain(self, identifier):
+        """Return the identifiers of a recipe and its parents, the recipe first."""
+        chain = []
+        while identifier in self.recipes and identifier not in chain:
+            chain.append(identifier)
+            identifier = self.recipes[identifier].get('ParentRecipe')
+        return chain
+
+    def environment(self, identifier):
+        """Return the Input of a recipe merged over those of its parents."""
+        env = {}
+        for ancestor in reversed(self.chain(identifier)):
+            env.update(self.recipes[ancestor].get('Input', {}))
+        return env
+
+    def steps(self, identifier, processor):
+        """Return the arguments of each step of a recipe and its parents which runs processor, in the order they run."""
+        steps = []
+        for ancestor in reversed(self.chain(identifier)):
+            for step in self.recipes[ancestor].get('Process', []):
+                if step.get('Processor', '').split('/')[-1] == processor:
+                    steps.append(step.get('Arguments', {}))
+        return steps
+
+    def jss_steps(self, identifier):
+        """Return the JSSImporter arguments of a recipe and its parents, in the order they run."""
+        return self.steps(identifier, 'JSSImporter')
+
+    def jss_recipes(self):
+        """Return the identifiers of the recipes which build a CCP package and import it with JSSImporter."""
+        return sorted(identifier for identifier in self.recipes
+                      if self.environment(identifier).get('ccpinfo') and self.jss_steps(identifier))
+
+    def find_template(self, identifier, name):
+        """Find a template as JSSImporter does: an absolute path, or relative to the recipe or a parent."""
+        if os.path.isabs(name):
+            return name
+        for ancestor in self.chain(identifier):
+            path = os.path.join(self.dirs[ancestor], name)
+            if os.path.exists(path):
+                return path
+        return None
+
+
+class Renderer(object):
+    """Renders the templates of recipes in a RecipeIndex, parsing each template file once."""
+
+    def __init__(self, recipes):
+        self.recipes = recipes
+        self.templates = {}
+
+    def template(self, identifier, name):
+        path = self.recipes.find_template(identifier, name)
+        if path is None:
+            raise TemplateError('Template {} not found for {}'.format(name, identifier))
+        path = os.path.abspath(path)
+        if path not in self.templates:
+            self.templates[path] = Template(path)
+        return self.templates[path]
+
+    def render(self, identifier, env):
+        """Render the smart groups and policies of every JSSImporter step of a recipe.
+
+        Args:
+            identifier (str): Recipe identifier
+            env (dict): Recipe environment, eg. its Input with the version and jss_inventory_name of the product
+        Returns:
+            list: Document for each group and policy
+        """
+        documents = []
+        for arguments in self.recipes.jss_steps(identifier):
+            arguments = substitute(arguments, env)
+            # The replacements JSSImporter makes, over the whole recipe environment
+            values = dict(env)
+            values.update({
+                'VERSION': env.get('version', ''),
+                'PROD_NAME': arguments.get('prod_name', env.get('NAME', '')),
+                'JSS_INVENTORY_NAME': arguments.get('jss_inventory_name', ''),
+                'POLICY_CATEGORY': arguments.get('policy_category', ''),
+                'CATEGORY': arguments.get('category', ''),
+                'SELF_SERVICE_DESCRIPTION': arguments.get('self_service_description', ''),
+                'SELF_SERVICE_ICON': arguments.get('self_service_icon', ''),
+            })
+
+            for group in arguments.get('groups', []):
+                if not group.get('template_path'):
+                    continue
+                template = self.template(identifier, group['template_path'])
+                values['group_name'] = group.get('name', '')
+                text, missing = template.render(values)
+                documents.append(Document(identifier, 'group', group.get('name', ''), template.path, text, missing))
+
+            if arguments.get('policy_template'):
+                template = self.template(identifier, arguments['policy_template'])
+                text, missing = template.render(values)
+                try:
+                    name = ElementTree.fromstring(text.encode('utf-8')).findtext('general/name')
+                except ElementTree.ParseError:
+                    name = None
+                documents.append(Document(identifier, 'policy', name or values['PROD_NAME'], template.path, text,
+                                          missing))
+        return documents
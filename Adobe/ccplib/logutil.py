@@ -0,0 +1,107 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Verbosity-gated processor output with deferred formatting.
+
+Processor.output() only decides whether to print after the caller has
+built the message. ProcessorLog checks the autopkg verbosity first, and
+formats the message with str.format() only if it will be shown:
+
+    log = ProcessorLog(self)
+    log.detail('additional_pkginfo: {}', self.env['additional_pkginfo'])
+
+Levels follow `autopkg run -v`: info is shown at -v, detail at -vv and
+debug at -vvv.
+
+Large documents, such as PDApp's output, go to gzip files in
+RECIPE_CACHE_DIR/logs instead of the console, and only their path is
+printed. The newest DUMP_KEEP dumps of each name are kept.
+"""
+from __future__ import absolute_import
+
+import glob
+import os
+import time
+
+__all__ = ["INFO", "DETAIL", "DEBUG", "ProcessorLog"]
+
+INFO = 1
+DETAIL = 2
+DEBUG = 3
+
+DUMP_KEEP = 10
+
+
+class ProcessorLog(object):
+    """Output for one processor, gated by its 'verbose' env value."""
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def enabled(self, level):
+        try:
+            return int(self.processor.env.get('verbose', 0)) >= level
+        except (TypeError, ValueError):
+            return False
+
+    def log(self, level, msg, *args, **kwargs):
+        """Output msg.format(*args, **kwargs) if the verbosity is at least level."""
+        if not self.enabled(level):
+            return
+        self.processor.output(msg.format(*args, **kwargs) if args or kwargs else msg, verbose_level=level)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(INFO, msg, *args, **kwargs)
+
+    def detail(self, msg, *args, **kwargs):
+        self.log(DETAIL, msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(DEBUG, msg, *args, **kwargs)
+
+    def dump(self, name, data, level=DETAIL):
+        """Write data to RECIPE_CACHE_DIR/logs/<name>-<timestamp>.gz if the verbosity is at least level.
+
+        Args:
+            name (str): Name of the dump, eg. 'pdapp-output'
+            data: bytes or text, or a callable returning either, which is only called if the dump is written
+            level (int): Minimum verbosity. 0 always writes the dump.
+        Returns:
+            str: Path of the dump, or None if it was not written
+        """
+        if not self.enabled(level):
+            return None
+        import gzip
+
+        if callable(data):
+            data = data()
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        logs_dir = os.path.join(self.processor.env.get('RECIPE_CACHE_DIR', '.'), 'logs')
+        if not os.path.isdir(logs_dir):
+            os.makedirs(logs_dir)
+        path = os.path.join(logs_dir, '{}-{}.gz'.format(name, time.strftime('%Y%m%d-%H%M%S')))
+        gz = gzip.open(path, 'wb')
+        try:
+            gz.write(data)
+        finally:
+            gz.close()
+
+        # Timestamps sort by name, so everything before the newest DUMP_KEEP is older
+        for old in sorted(glob.glob(os.path.join(logs_dir, '{}-*.gz'.format(name))))[:-DUMP_KEEP]:
+            os.unlink(old)
+
+        self.processor.output('Wrote {} ({} bytes) to {}'.format(name, len(data), path),
+                              verbose_level=min(level, INFO))
+        return path
@@ -0,0 +1,104 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Hash manifests of the payloads in a built CCP package.
+
+A manifest maps the path of each file under Contents/Resources/HD and
+Contents/Resources/Setup, relative to the package, to its size, mtime and
+SHA-256:
+
+    {"algorithm": "sha256", "payloads": {"Contents/Resources/HD/PHSP19.0/Core.zip": {...}}}
+
+Files are read in chunks on a thread pool. hashlib releases the GIL while
+it digests each chunk, so large payloads are hashed in parallel.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import os
+
+__all__ = ["PAYLOAD_DIRS", "payload_files", "hash_file", "hash_payloads", "diff_manifests"]
+
+PAYLOAD_DIRS = ["Contents/Resources/HD", "Contents/Resources/Setup"]
+CHUNK_SIZE = 1024 * 1024
+
+
+def payload_files(pkg_path):
+    """Return the paths, relative to pkg_path, of every file in the payload directories, sorted."""
+    files = []
+    for payload_dir in PAYLOAD_DIRS:
+        for root, _, names in os.walk(os.path.join(pkg_path, payload_dir)):
+            for name in names:
+                files.append(os.path.relpath(os.path.join(root, name), pkg_path))
+    return sorted(files)
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a file, read chunk_size bytes at a time."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_payloads(pkg_path, previous=None, workers=4):
+    """Hash every payload file of a package.
+
+    Args:
+        pkg_path (str): Path to the bundle-style package
+        previous (dict): The payloads of an earlier manifest. Files whose size and mtime are unchanged
+            keep their earlier digest instead of being read again.
+        workers (int): Number of files to hash concurrently
+    Returns:
+        dict: Relative path to {'size', 'mtime', 'sha256'}
+    """
+    from multiprocessing.pool import ThreadPool
+
+    previous = previous or {}
+    payloads = {}
+    pending = []
+    for name in payload_files(pkg_path):
+        st = os.stat(os.path.join(pkg_path, name))
+        entry = {'size': st.st_size, 'mtime': st.st_mtime}
+        earlier = previous.get(name, {})
+        if earlier.get('size') == entry['size'] and earlier.get('mtime') == entry['mtime'] and earlier.get('sha256'):
+            entry['sha256'] = earlier['sha256']
+        else:
+            pending.append(name)
+        payloads[name] = entry
+
+    if pending:
+        pool = ThreadPool(max(1, min(workers, len(pending))))
+        try:
+            digests = pool.map(lambda name: hash_file(os.path.join(pkg_path, name)), pending)
+        finally:
+            pool.close()
+            pool.join()
+        for name, digest in zip(pending, digests):
+            payloads[name]['sha256'] = digest
+    return payloads
+
+
+def diff_manifests(old, new):
+    """Compare the payloads of two manifests by digest.
+
+    Returns:
+        dict: Sorted lists of 'added', 'changed' and 'removed' relative paths
+    """
+    return {
+        'added': sorted(name for name in new if name not in old),
+        'changed': sorted(name for name in new
+                          if name in old and old[name].get('sha256') != new[name]['sha256']),
+        'removed': sorted(name for name in old if name not in new),
+    }
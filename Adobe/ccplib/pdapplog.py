@@ -0,0 +1,244 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incremental analysis of ~/Library/Logs/PDApp.log.
+
+PDApp appends to one log for the life of a build host, so it can grow to
+hundreds of megabytes. LogAnalyzer never rescans it. The byte offset it has
+read up to, and everything it extracted, are saved in a JSON checkpoint:
+
+    analyzer = LogAnalyzer()
+    analyzer.update()        # reads only what was appended since the last update
+    analyzer.org_details()   # the orgs of the last OrgDetails response
+    analyzer.builds()        # start, end, phases and errors of each CCP automation build
+
+Without a checkpoint, or after the log was rotated, the log is first read
+backwards from the end, as far as the start of the last build and the last
+OrgDetails line, and then forwards from there.
+
+Lines look like:
+
+    04/05/18 10:22:13:123 | [INFO] |  | OOBE | DE |  |  | 12345 | <message>
+
+Builds, phases and errors are recognised by the message patterns below.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import re
+import time
+
+from .fileutil import load_state, save_state
+
+__all__ = ["LOG_PATH", "LogAnalyzer", "default_state_path", "parse_line", "read_backwards"]
+
+LOG_PATH = os.path.expanduser('~/Library/Logs/PDApp.log')
+STATE_NAME = 'ccp-pdapp-log.json'
+
+LINE_RE = re.compile(r'^(\d\d/\d\d/\d\d \d\d:\d\d:\d\d)(?::\d+)?\s*\|\s*\[(\w+)\]\s*\|(?:[^|]*\|){6}\s*(.*)$')
+ORG_DETAILS_RE = re.compile(r'OrgDetails return status is \(0\) server-response \(([^)]*)\)')
+BUILD_START_RE = re.compile(r'automationMode|pkgConfigFile')
+BUILD_END_RE = re.compile(r'TronResult|_result\.xml')
+PHASE_RES = [
+    ('download', re.compile(r'\bdownload', re.IGNORECASE)),
+    ('packaging', re.compile(r'pkgbuild|productbuild|(creat|build)ing (the )?package', re.IGNORECASE)),
+]
+ERROR_RES = [
+    re.compile(r'<errorMessage>([^<]+)</errorMessage>'),
+    re.compile(r'\berror ?code\W{0,3}(-?\d+)', re.IGNORECASE),
+]
+
+# Bytes to read backwards, at most, when there is no checkpoint
+MAX_BACKSCAN = 64 * 1024 * 1024
+# Builds kept in the checkpoint
+MAX_BUILDS = 50
+# Errors kept per build
+MAX_ERRORS = 20
+BLOCK_SIZE = 64 * 1024
+
+
+def default_state_path(autopkg_cache_dir=None):
+    """Return the checkpoint path inside the AutoPkg cache directory."""
+    return os.path.join(autopkg_cache_dir or os.path.expanduser('~/Library/AutoPkg/Cache'), STATE_NAME)
+
+
+def parse_line(line):
+    """Split a log line into (Unix time, level, message), or return None if it is not a log line."""
+    match = LINE_RE.match(line)
+    if match is None:
+        return None
+    try:
+        timestamp = time.mktime(time.strptime(match.group(1), '%m/%d/%y %H:%M:%S'))
+    except ValueError:
+        return None
+    return timestamp, match.group(2), match.group(3)
+
+
+def read_backwards(fd, end, limit=MAX_BACKSCAN):
+    """Yield (offset, line) for the complete lines before byte offset end, last line first.
+
+    At most limit bytes are read.
+    """
+    position = end
+    remainder = b''
+    while position > 0 and end - position < limit:
+        size = min(BLOCK_SIZE, position)
+        position -= size
+        fd.seek(position)
+        block = fd.read(size) + remainder
+        lines = block.split(b'\n')
+        # The first piece may be the end of a line which starts in the previous block
+        remainder = lines.pop(0)
+        offset = position + len(block)
+        for line in reversed(lines):
+            offset -= len(line) + 1
+            yield offset + 1, line
+    if position == 0 and remainder:
+        yield 0, remainder
+
+
+class LogAnalyzer(object):
+    """Org details, builds and errors extracted from PDApp.log, checkpointed in state_path."""
+
+    def __init__(self, log_path=LOG_PATH, state_path=None):
+        self.log_path = log_path
+        self.state_path = state_path or default_state_path()
+        self.state = load_state(self.state_path)
+
+    def org_details(self):
+        """Return the orgs from the last successful OrgDetails response, or None if there was none."""
+        return self.state.get('org_details')
+
+    def customer_type(self, org_name=None):
+        """Return 'enterprise' or 'team' for the named org, or the first org, if the log records it."""
+        for org in self.org_details() or []:
+            if org_name and org.get('orgName') != org_name:
+                continue
+            for key in ('customerType', 'userType', 'orgType'):
+                if org.get(key):
+                    # convert 'FOO_CUSTOMER_TYPE' into 'foo', as in CCPPreferences.xml
+                    return org[key].lower().split('_')[0]
+        return None
+
+    def builds(self):
+        """Return the builds found in the log, oldest first.
+
+        Each build is a dict with 'start' and 'end' Unix times ('end' is None while a build is running),
+        'phases' mapping a phase name to its [first, last] time, and 'errors', a list of error messages or codes.
+        """
+        return self.state.get('builds', [])
+
+    def last_build(self):
+        builds = self.builds()
+        return builds[-1] if builds else None
+
+    def update(self):
+        """Read what was appended to the log since the last update, and save the checkpoint.
+
+        Returns:
+            int: The number of bytes read
+        """
+        try:
+            st = os.stat(self.log_path)
+        except OSError:
+            return 0
+
+        offset = self.state.get('offset', 0)
+        if self.state.get('inode') != st.st_ino or st.st_size < offset:
+            # First run, or the log was rotated or truncated
+            self.state = {'inode': st.st_ino, 'offset': 0, 'builds': [], 'org_details': None}
+            offset = None
+
+        with open(self.log_path, 'rb') as fd:
+            if offset is None:
+                offset = self._backscan(fd, st.st_size)
+            read = self._scan(fd, offset, st.st_size)
+
+        if not os.path.isdir(os.path.dirname(self.state_path) or '.'):
+            os.makedirs(os.path.dirname(self.state_path))
+        save_state(self.state_path, self.state)
+        return read
+
+    def _backscan(self, fd, size):
+        """Find where to start reading a log without a checkpoint, recording the last OrgDetails on the way.
+
+        Returns:
+            int: Offset of the earlier of the last build start and the last OrgDetails line, or of the
+                earliest line read backwards if either was not found
+        """
+        start = size
+        build_seen = False
+        for offset, line in read_backwards(fd, size):
+            start = offset
+            text = line.decode('utf-8', 'replace')
+            if self.state['org_details'] is None:
+                self._org_details(text)
+            build_seen = build_seen or BUILD_START_RE.search(text) is not None
+            if build_seen and self.state['org_details'] is not None:
+                break
+        return start
+
+    def _scan(self, fd, offset, size):
+        fd.seek(offset)
+        position = offset
+        for line in fd:
+            if not line.endswith(b'\n'):
+                # Still being written, read it again next time
+                break
+            position += len(line)
+            self._line(line.decode('utf-8', 'replace').rstrip('\r\n'))
+            if position >= size:
+                break
+        self.state['offset'] = position
+        return position - offset
+
+    def _org_details(self, text):
+        match = ORG_DETAILS_RE.search(text)
+        if match is None:
+            return
+        try:
+            orgs = json.loads(match.group(1))
+        except ValueError:
+            return
+        self.state['org_details'] = orgs if isinstance(orgs, list) else [orgs]
+
+    def _line(self, text):
+        parsed = parse_line(text)
+        if parsed is None:
+            return
+        timestamp, level, message = parsed
+
+        self._org_details(message)
+        builds = self.state['builds']
+        if BUILD_START_RE.search(message):
+            if not builds or builds[-1]['end'] is not None or builds[-1]['phases']:
+                builds.append({'start': timestamp, 'end': None, 'phases': {}, 'errors': []})
+                del builds[:-MAX_BUILDS]
+            return
+
+        if not builds or builds[-1]['end'] is not None:
+            return
+        build = builds[-1]
+        for phase, pattern in PHASE_RES:
+            if pattern.search(message):
+                build['phases'].setdefault(phase, [timestamp, timestamp])[1] = timestamp
+        for pattern in ERROR_RES:
+            match = pattern.search(message)
+            if match and len(build['errors']) < MAX_ERRORS and match.group(1) not in build['errors']:
+                build['errors'].append(match.group(1))
+        if level == 'ERROR' and not any(pattern.search(message) for pattern in ERROR_RES):
+            if len(build['errors']) < MAX_ERRORS:
+                build['errors'].append(message.strip())
+        if BUILD_END_RE.search(message):
+            build['end'] = timestamp
@@ -0,0 +1,210 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process store of the parsed metadata files of built CCP packages.
+
+CreativeCloudPackager, CreativeCloudBuildModifier and CreativeCloudVersioner
+run in one process and read the same optionXML.xml and ApplicationInfo.xml.
+Each file is parsed here once and shared:
+
+    option_xml = pkgmeta.option_xml(pkg_path)
+    option_xml.prod_version
+    option_xml.media('SPGD').prod_version    # Medias/Media, by SAP code
+    option_xml.hd_media('PHSP')              # HDMedias/HDMedia, by SAP code
+
+A file is parsed again if its inode, size or mtime changed. A processor
+which modifies a document in memory must call saved(path) after writing
+it, so that the modified tree is kept for the next reader, or invalidate(path)
+if it was not written, eg. in a dry run.
+"""
+from __future__ import absolute_import
+
+import os
+import threading
+
+__all__ = ["ApplicationInfo", "Media", "OptionXML", "application_info", "invalidate", "option_xml",
+           "option_xml_path", "application_info_path", "saved"]
+
+_lock = threading.Lock()
+_documents = {}
+
+
+def option_xml_path(pkg_path):
+    return os.path.join(pkg_path, 'Contents', 'Resources', 'optionXML.xml')
+
+
+def application_info_path(pkg_path):
+    return os.path.join(pkg_path, 'Contents', 'Resources', 'ASU', 'packages', 'ApplicationInfo.xml')
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return st.st_ino, st.st_size, st.st_mtime
+
+
+class Media(object):
+    """A Media or HDMedia element of optionXML.xml."""
+    __slots__ = ('element',)
+
+    def __init__(self, element):
+        self.element = element
+
+    @property
+    def sap_code(self):
+        return self.element.findtext('SAPCode')
+
+    @property
+    def prod_version(self):
+        """The version of the media. HDMedia calls it productVersion."""
+        return self.element.findtext('prodVersion') or self.element.findtext('productVersion')
+
+    @property
+    def base_version(self):
+        return self.element.findtext('baseVersion')
+
+    @property
+    def target_folder(self):
+        return self.element.findtext('TargetFolderName')
+
+    def findtext(self, path, default=None):
+        return self.element.findtext(path, default)
+
+
+class _Metadata(object):
+    """A parsed file, and indexes derived from it which are built on first use."""
+
+    def __init__(self, document):
+        self.document = document
+        self._indexes = {}
+
+    @property
+    def path(self):
+        return self.document.path
+
+    def getroot(self):
+        return self.document.getroot()
+
+    def _index(self, name, build):
+        index = self._indexes.get(name)
+        if index is None:
+            index = self._indexes[name] = build()
+        return index
+
+    def reset(self):
+        """Forget derived indexes, after the tree was modified."""
+        self._indexes = {}
+
+
+class OptionXML(_Metadata):
+    """optionXML.xml of a built package."""
+
+    @property
+    def prod_version(self):
+        """The CCP version which built the package, or None."""
+        return self.getroot().findtext('prodVersion')
+
+    def _media_index(self, path):
+        index = {}
+        for element in self.getroot().iterfind(path):
+            media = Media(element)
+            # The first media of a SAP code is the one a linear search would find
+            index.setdefault(media.sap_code, media)
+        return index
+
+    def medias(self):
+        """Return {SAP code: Media} for the RIBS media."""
+        return self._index('medias', lambda: self._media_index('.//Medias/Media'))
+
+    def hd_medias(self):
+        """Return {SAP code: Media} for the HD media."""
+        return self._index('hd_medias', lambda: self._media_index('.//HDMedias/HDMedia'))
+
+    def media(self, sap_code):
+        """Return the RIBS Media with sap_code, or None."""
+        return self.medias().get(sap_code)
+
+    def hd_media(self, sap_code):
+        """Return the HDMedia with sap_code, or None."""
+        return self.hd_medias().get(sap_code)
+
+
+class ApplicationInfo(_Metadata):
+    """ASU/packages/ApplicationInfo.xml of a built package."""
+    pass
+
+
+class _Entry(object):
+    __slots__ = ("lock", "key", "metadata")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key = None
+        self.metadata = None
+
+
+def _get(path, cls):
+    # Imported here, since xmldoc loads ElementTree, which runs answered from the versioner cache don't need
+    from .xmldoc import XMLDocument
+
+    path = os.path.abspath(path)
+    with _lock:
+        entry = _documents.get(path)
+        if entry is None:
+            entry = _documents[path] = _Entry()
+
+    with entry.lock:
+        key = _stat_key(path)
+        if entry.metadata is None or entry.key != key or not isinstance(entry.metadata, cls):
+            entry.metadata = cls(XMLDocument(path))
+            entry.key = key
+        return entry.metadata
+
+
+def option_xml(pkg_path):
+    """Return the parsed optionXML.xml of the package at pkg_path.
+
+    Raises:
+        OSError: If the file does not exist
+    """
+    return _get(option_xml_path(pkg_path), OptionXML)
+
+
+def application_info(pkg_path):
+    """Return the parsed ASU/packages/ApplicationInfo.xml of the package at pkg_path.
+
+    Raises:
+        OSError: If the file does not exist
+    """
+    return _get(application_info_path(pkg_path), ApplicationInfo)
+
+
+def saved(path):
+    """Keep the in-memory tree of path, which was just written, for later readers."""
+    path = os.path.abspath(path)
+    with _lock:
+        entry = _documents.get(path)
+    if entry is None:
+        return
+    with entry.lock:
+        if entry.metadata is not None:
+            entry.metadata.reset()
+            entry.key = _stat_key(path)
+
+
+def invalidate(path=None):
+    """Forget the parsed file at path, or every file if path is None."""
+    with _lock:
+        if path is None:
+            _documents.clear()
+        else:
+            _documents.pop(os.path.abspath(path), None)
@@ -0,0 +1,274 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Portable property list and preferences access.
+
+Reading and writing plists is done in pure Python, so that metadata
+extraction also works on machines without PyObjC. XML plists are parsed
+straight from the file object they are given, which may be a zip member.
+Binary plists need random access, so they are read into memory first.
+
+When the PyObjC Foundation bridge has already been imported by something
+else in the process (AutoPkg itself does), it is used as a fast path. Preferences
+always go through CFPreferences when it is available, because cfprefsd
+caches preference files and may overwrite direct edits.
+"""
+from __future__ import absolute_import
+
+import datetime
+import os
+import plistlib
+import struct
+import sys
+
+__all__ = [
+    "PlistError",
+    "read_plist",
+    "read_plist_from_string",
+    "write_plist",
+    "copy_app_value",
+    "set_app_value",
+]
+
+BINARY_MAGIC = b"bplist00"
+
+# Reference date for binary plist dates, in seconds since 2001-01-01 UTC
+CF_EPOCH = datetime.datetime(2001, 1, 1)
+
+try:
+    STRING_TYPES = basestring
+except NameError:  # Python 3
+    STRING_TYPES = str
+
+
+class PlistError(Exception):
+    """Raised when a property list cannot be parsed."""
+    pass
+
+
+def _foundation():
+    """Return the Foundation module if PyObjC is already loaded, otherwise None.
+
+    PyObjC is never imported here just to parse a plist, since the import
+    costs more than the parse.
+    """
+    if os.environ.get("CCP_PLIST_BACKEND") == "python":
+        return None
+    return sys.modules.get("Foundation")
+
+
+def read_plist_from_string(data):
+    """Parse a plist (XML or binary) from a byte string."""
+    foundation = _foundation()
+    if foundation is not None:
+        return _read_with_foundation(foundation, data)
+
+    if data[:8] == BINARY_MAGIC:
+        return _BinaryPlistReader(data).parse()
+
+    if hasattr(plistlib, "loads"):
+        return plistlib.loads(data)
+    return plistlib.readPlistFromString(data)
+
+
+def read_plist(path_or_file):
+    """Parse a plist (XML or binary) from a path or a readable file object.
+
+    XML plists are parsed incrementally from the file object.
+    """
+    if isinstance(path_or_file, STRING_TYPES):
+        with open(path_or_file, "rb") as fd:
+            return read_plist(fd)
+
+    magic = path_or_file.read(8)
+    if magic == BINARY_MAGIC or _foundation() is not None:
+        return read_plist_from_string(magic + path_or_file.read())
+
+    if hasattr(plistlib, "loads"):  # Python 3 plistlib needs a seekable file, so parse from memory
+        return plistlib.loads(magic + path_or_file.read())
+    return plistlib.readPlist(_PrefixedReader(magic, path_or_file))
+
+
+def write_plist(value, path):
+    """Write value to path as an XML plist.
+
+    Values handed to processors by AutoPkg may be Foundation collections,
+    which plistlib does not accept, so these are written with Foundation.
+    """
+    foundation = _foundation()
+    if foundation is not None:
+        _write_with_foundation(foundation, value, path)
+        return
+
+    with open(path, "wb") as fd:
+        if hasattr(plistlib, "dump"):
+            plistlib.dump(value, fd)
+        else:
+            plistlib.writePlist(value, fd)
+
+
+def _preferences_path(domain):
+    return os.path.expanduser("~/Library/Preferences/{}.plist".format(domain))
+
+
+def copy_app_value(key, domain):
+    """Return the preference value of key in domain for the current user, or None."""
+    try:
+        from Foundation import CFPreferencesCopyAppValue
+    except ImportError:
+        pass
+    else:
+        return CFPreferencesCopyAppValue(key, domain)
+
+    path = _preferences_path(domain)
+    if not os.path.exists(path):
+        return None
+    return read_plist(path).get(key)
+
+
+def set_app_value(key, value, domain):
+    """Set the preference value of key in domain for the current user."""
+    try:
+        from Foundation import CFPreferencesSetAppValue, CFPreferencesAppSynchronize
+    except ImportError:
+        pass
+    else:
+        CFPreferencesSetAppValue(key, value, domain)
+        CFPreferencesAppSynchronize(domain)
+        return
+
+    path = _preferences_path(domain)
+    prefs = read_plist(path) if os.path.exists(path) else {}
+    prefs[key] = value
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    write_plist(prefs, path)
+
+
+def _read_with_foundation(foundation, data):
+    """Parse a plist with NSPropertyListSerialization."""
+    buf = foundation.NSData.dataWithBytes_length_(data, len(data))
+    value, _, error = foundation.NSPropertyListSerialization.propertyListWithData_options_format_error_(
+        buf, foundation.NSPropertyListMutableContainers, None, None)
+    if error:
+        raise PlistError(str(error))
+    return value
+
+
+def _write_with_foundation(foundation, value, path):
+    """Write an XML plist with NSPropertyListSerialization."""
+    data, error = foundation.NSPropertyListSerialization.dataWithPropertyList_format_options_error_(
+        value, foundation.NSPropertyListXMLFormat_v1_0, 0, None)
+    if error:
+        raise PlistError(str(error))
+    if not data.writeToFile_atomically_(path, True):
+        raise PlistError("Failed to write plist to {}".format(path))
+
+
+class _PrefixedReader(object):
+    """File-like object which replays bytes that were already read for sniffing."""
+
+    def __init__(self, prefix, fileobj):
+        self._prefix = prefix
+        self._fileobj = fileobj
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._fileobj.read(size)
+        if size is None or size < 0:
+            data, self._prefix = self._prefix + self._fileobj.read(), b""
+            return data
+        data, self._prefix = self._prefix[:size], self._prefix[size:]
+        if len(data) < size:
+            data += self._fileobj.read(size - len(data))
+        return data
+
+
+class _BinaryPlistReader(object):
+    """Parser for the bplist00 format."""
+
+    def __init__(self, data):
+        self._data = data
+        self._bytes = bytearray(data)
+        self._offsets = []
+        self._ref_size = 0
+
+    def parse(self):
+        if len(self._data) < 40:
+            raise PlistError("Binary plist is truncated")
+        offset_size, self._ref_size, num_objects, top_object, table_offset = struct.unpack(
+            ">6xBBQQQ", self._data[-32:])
+        self._offsets = [
+            self._read_uint(table_offset + i * offset_size, offset_size) for i in range(num_objects)
+        ]
+        return self._read_object(top_object)
+
+    def _read_uint(self, offset, size):
+        value = 0
+        for byte in self._bytes[offset:offset + size]:
+            value = (value << 8) | byte
+        return value
+
+    def _read_length(self, offset, info):
+        """Return (length, data offset) for an object with the given marker info nibble."""
+        if info != 0x0F:
+            return info, offset + 1
+        int_marker = self._bytes[offset + 1]
+        int_size = 1 << (int_marker & 0x0F)
+        return self._read_uint(offset + 2, int_size), offset + 2 + int_size
+
+    def _read_refs(self, offset, count):
+        size = self._ref_size
+        return [self._read_uint(offset + i * size, size) for i in range(count)]
+
+    def _read_object(self, ref):
+        offset = self._offsets[ref]
+        marker = self._bytes[offset]
+        kind, info = marker >> 4, marker & 0x0F
+
+        if marker == 0x00:
+            return None
+        if marker == 0x08:
+            return False
+        if marker == 0x09:
+            return True
+        if kind == 0x1:
+            size = 1 << info
+            value = self._read_uint(offset + 1, size)
+            if size == 8 and value & (1 << 63):
+                value -= 1 << 64
+            return value
+        if kind == 0x2:
+            fmt = ">f" if info == 2 else ">d"
+            return struct.unpack(fmt, self._data[offset + 1:offset + 1 + (1 << info)])[0]
+        if marker == 0x33:
+            seconds = struct.unpack(">d", self._data[offset + 1:offset + 9])[0]
+            return CF_EPOCH + datetime.timedelta(seconds=seconds)
+
+        length, start = self._read_length(offset, info)
+        if kind == 0x4:
+            return self._data[start:start + length]
+        if kind == 0x5:
+            return self._data[start:start + length].decode("ascii")
+        if kind == 0x6:
+            return self._data[start:start + length * 2].decode("utf-16-be")
+        if kind == 0x8:
+            return self._read_uint(offset + 1, info + 1)
+        if kind == 0xA:
+            return [self._read_object(item) for item in self._read_refs(start, length)]
+        if kind == 0xD:
+            keys = self._read_refs(start, length)
+            values = self._read_refs(start + length * self._ref_size, length)
+            return dict((self._read_object(k), self._read_object(v)) for k, v in zip(keys, values))
+
+        raise PlistError("Unsupported binary plist object marker 0x{:02x}".format(marker))
@@ -0,0 +1,182 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Opt-in CPU and memory profiling of a processor's main().
+
+Profiling is enabled by the `ccp_profile` recipe input, or by setting the
+CCP_PROFILE environment variable, eg. `CCP_PROFILE=1 autopkg run ...`.
+For each profiled processor, these files are written to
+RECIPE_CACHE_DIR/profiles:
+
+    <Processor>-<timestamp>.prof        cProfile data, for pstats or snakeviz
+    <Processor>-<timestamp>-alloc.txt   Allocation report
+
+and the top hotspots are printed when the processor finishes. The number
+of hotspots is set by `ccp_profile_top` or CCP_PROFILE_TOP (default 20).
+
+Allocations are traced with tracemalloc where available. Python 2 has no
+tracemalloc, so the report contains the growth in maximum RSS and in live
+objects by type instead.
+
+When profiling is disabled, the only cost is checking the two settings.
+"""
+from __future__ import absolute_import
+
+import functools
+import os
+import sys
+
+__all__ = ["profiled", "profiling_enabled"]
+
+DEFAULT_TOP = 20
+TRUE_VALUES = ('1', 'true', 'yes')
+
+
+def _setting(env, key, env_var):
+    value = env.get(key)
+    if value is None:
+        value = os.environ.get(env_var)
+    return value
+
+
+def profiling_enabled(env):
+    """Return True if profiling was requested by the processor env or the environment."""
+    value = _setting(env, 'ccp_profile', 'CCP_PROFILE')
+    if isinstance(value, bool):
+        return value
+    return value is not None and str(value).lower() in TRUE_VALUES
+
+
+def profiled(main):
+    """Decorate Processor.main() so that it is profiled when profiling is enabled."""
+    @functools.wraps(main)
+    def wrapper(self):
+        if not profiling_enabled(self.env):
+            return main(self)
+        return _run_profiled(self, main)
+    return wrapper
+
+
+class _AllocationTracer(object):
+    """Traces allocations with tracemalloc, or samples RSS and live objects on Python 2."""
+
+    def __init__(self, top):
+        self.top = top
+        try:
+            import tracemalloc
+        except ImportError:
+            tracemalloc = None
+        self.tracemalloc = tracemalloc
+        self.rss_before = self.counts_before = None
+        self.report = []
+
+    def start(self):
+        if self.tracemalloc is not None:
+            self.tracemalloc.start(25)
+        else:
+            self.rss_before = _max_rss()
+            self.counts_before = _object_counts()
+
+    def stop(self):
+        if self.tracemalloc is not None:
+            snapshot = self.tracemalloc.take_snapshot()
+            current, peak = self.tracemalloc.get_traced_memory()
+            self.tracemalloc.stop()
+            snapshot = snapshot.filter_traces([
+                self.tracemalloc.Filter(False, self.tracemalloc.__file__),
+                self.tracemalloc.Filter(False, __file__),
+            ])
+            self.report.append('Peak traced memory: {} KiB, still allocated: {} KiB'.format(
+                peak // 1024, current // 1024))
+            self.report.append('')
+            self.report.append('Top {} allocation sites:'.format(self.top))
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                self.report.append(str(stat))
+        else:
+            counts = _object_counts()
+            self.report.append('Maximum RSS growth: {} KiB'.format((_max_rss() - self.rss_before) // 1024))
+            self.report.append('')
+            self.report.append('Top {} object types by growth in live instances:'.format(self.top))
+            growth = [(counts[name] - self.counts_before.get(name, 0), name) for name in counts]
+            for delta, name in sorted(growth, reverse=True)[:self.top]:
+                if delta <= 0:
+                    break
+                self.report.append('{:>10} {}'.format('+{}'.format(delta), name))
+        return self.report
+
+
+def _max_rss():
+    """Return the maximum RSS of this process in bytes, or 0 where unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _object_counts():
+    """Count the objects tracked by the garbage collector by type name."""
+    import gc
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def _report_prefix(processor):
+    import tempfile
+    import time
+    cache_dir = processor.env.get('RECIPE_CACHE_DIR') or tempfile.gettempdir()
+    profile_dir = os.path.join(cache_dir, 'profiles')
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+    name = '{}-{}'.format(type(processor).__name__, time.strftime('%Y%m%d-%H%M%S'))
+    return os.path.join(profile_dir, name)
+
+
+def _run_profiled(processor, main):
+    """Run main() under cProfile and the allocation tracer, then write and summarize the reports."""
+    import cProfile
+    import pstats
+    try:
+        from StringIO import StringIO
+    except ImportError:  # Python 3
+        from io import StringIO
+
+    top = int(_setting(processor.env, 'ccp_profile_top', 'CCP_PROFILE_TOP') or DEFAULT_TOP)
+    tracer = _AllocationTracer(top)
+    profile = cProfile.Profile()
+
+    tracer.start()
+    profile.enable()
+    try:
+        return main(processor)
+    finally:
+        profile.disable()
+        allocations = tracer.stop()
+
+        prefix = _report_prefix(processor)
+        profile.dump_stats(prefix + '.prof')
+        with open(prefix + '-alloc.txt', 'w') as fd:
+            fd.write('\n'.join(allocations) + '\n')
+
+        summary = StringIO()
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(top)
+        processor.output('Profile written to {}.prof, allocations to {}-alloc.txt'.format(prefix, prefix),
+                         verbose_level=0)
+        processor.output('Top {} hotspots by cumulative time:\n{}'.format(top, summary.getvalue().strip('\n')),
+                         verbose_level=0)
+        processor.output('Allocations:\n{}'.format('\n'.join(allocations[:top + 3])), verbose_level=0)
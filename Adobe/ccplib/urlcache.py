@@ -0,0 +1,156 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""On-disk cache of small documents fetched by URL.
+
+CreativeCloudFeed reads manifests, proxy XML, update descriptions and icons
+through this cache, and the prefetch_ccp_catalog tool fills it ahead of a
+recipe run. Each response body is stored under the SHA-1 of its URL:
+
+    <cache_dir>/<first two hex digits>/<sha1 of url>
+
+and is fresh for max_age seconds after it was written. Responses are
+streamed to disk in chunks, so documents of any size are fetched in
+constant memory, and fetch_file() copies them to a destination the same
+way. An interrupted download never leaves a truncated file behind.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import os
+import time
+
+from .fileutil import CHUNK_SIZE, atomic_open, atomic_write, copy_stream
+
+__all__ = ["DEFAULT_MAX_AGE", "URLCache", "default_cache_dir", "download", "download_to"]
+
+# Seconds for which a cached response is used without fetching it again
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+CACHE_NAME = 'ccp-url-cache'
+
+
+def default_cache_dir(autopkg_cache_dir=None):
+    """Return the URL cache directory inside the AutoPkg cache directory."""
+    return os.path.join(autopkg_cache_dir or os.path.expanduser('~/Library/AutoPkg/Cache'), CACHE_NAME)
+
+
+def download(url, headers):
+    """Download url and return the response body."""
+    try:
+        from urllib2 import Request, urlopen
+    except ImportError:  # Python 3
+        from urllib.request import Request, urlopen
+
+    response = urlopen(Request(url, headers=headers))
+    try:
+        return response.read()
+    finally:
+        response.close()
+
+
+def download_to(url, headers, path, chunk_size=CHUNK_SIZE):
+    """Stream the response body of url into the file at path, replacing it atomically.
+
+    Raises:
+        IOError: If the response was shorter than its Content-Length
+    """
+    try:
+        from urllib2 import Request, urlopen
+    except ImportError:  # Python 3
+        from urllib.request import Request, urlopen
+
+    response = urlopen(Request(url, headers=headers))
+    try:
+        length = response.info().get('Content-Length')
+        with atomic_open(path) as fd:
+            copied = copy_stream(response, fd, chunk_size)
+            if length is not None and copied != int(length):
+                raise IOError('Incomplete download of {}: {} of {} bytes'.format(url, copied, length))
+    finally:
+        response.close()
+
+
+class URLCache(object):
+    """Response bodies stored by URL in cache_dir."""
+
+    def __init__(self, cache_dir, max_age=DEFAULT_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+
+    def path(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def is_fresh(self, url):
+        try:
+            return time.time() - os.path.getmtime(self.path(url)) < self.max_age
+        except OSError:
+            return False
+
+    def get(self, url):
+        """Return the cached body of url, or None if it is missing or older than max_age."""
+        if not self.is_fresh(url):
+            return None
+        try:
+            with open(self.path(url), 'rb') as fd:
+                return fd.read()
+        except (IOError, OSError):
+            return None
+
+    def _make_dir(self, path):
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # Created by a concurrent writer
+                if not os.path.isdir(os.path.dirname(path)):
+                    raise
+
+    def put(self, url, data):
+        path = self.path(url)
+        self._make_dir(path)
+        atomic_write(path, data)
+
+    def fetch_file(self, url, headers, dest=None):
+        """Stream url into the cache if it is not fresh, and copy it to dest in chunks, replacing dest atomically.
+
+        Returns:
+            tuple: (path of dest, or of the cached file if dest is None, True if it came from the cache)
+        """
+        path = self.path(url)
+        cached = self.is_fresh(url)
+        if not cached:
+            self._make_dir(path)
+            download_to(url, headers, path)
+        if dest is None:
+            return path, cached
+
+        with open(path, 'rb') as src:
+            with atomic_open(dest) as fd:
+                copy_stream(src, fd)
+        return dest, cached
+
+    def fetch(self, url, headers):
+        """Return the body of url from the cache, downloading and storing it if it is not fresh.
+
+        Returns:
+            tuple: (body, True if it came from the cache)
+        """
+        data = self.get(url)
+        if data is not None:
+            return data, True
+
+        data = download(url, headers)
+        self.put(url, data)
+        return data, False
@@ -0,0 +1,68 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""XML files which are modified in place inside a built CCP package."""
+from __future__ import absolute_import
+
+import io
+import re
+
+from xml.etree import ElementTree
+
+from .fileutil import atomic_write
+
+__all__ = ["XMLDocument"]
+
+DECLARATION_RE = re.compile(br"^\s*<\?xml[^>]*\?>\s*")
+ENCODING_RE = re.compile(br"encoding=[\"']([A-Za-z0-9._-]+)[\"']")
+
+
+class XMLDocument(object):
+    """An XML file parsed with ElementTree, which remembers its XML declaration.
+
+    Callers set `changed` when they modify the tree. save() only writes the
+    file if something changed, and writes it back with the original
+    declaration and encoding.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fd:
+            head = fd.read(512)
+        match = DECLARATION_RE.match(head)
+        self.declaration = match.group(0) if match else b""
+        encoding = ENCODING_RE.search(self.declaration)
+        self.encoding = encoding.group(1).decode("ascii") if encoding else "utf-8"
+        self.tree = ElementTree.parse(path)
+        self.changed = False
+
+    def getroot(self):
+        return self.tree.getroot()
+
+    def tostring(self):
+        """Serialize the document with its original declaration."""
+        buf = io.BytesIO()
+        self.tree.write(buf, encoding=self.encoding, xml_declaration=False)
+        return self.declaration + buf.getvalue()
+
+    def save(self):
+        """Atomically write the document if it was changed.
+
+        Returns:
+            bool: True if the file was written.
+        """
+        if not self.changed:
+            return False
+        atomic_write(self.path, self.tostring())
+        self.changed = False
+        return True
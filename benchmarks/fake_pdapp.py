@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A stand-in for PDApp's CCP automation mode, for testing builds without CCP.
+
+Usage:
+    fake_pdapp.py --pkgConfigFile=AUTOMATION_XML [other PDApp arguments]
+
+Reads packageName and outputLocation from the automation XML, waits
+FAKE_PDAPP_SECONDS (default 1), and writes a small package tree where CCP
+would, with Build/<name>_Install.pkg, Build/<name>_Uninstall.pkg,
+Build/<name>.ccp and PackageInfo.txt, then the <input>_result.xml file
+CreativeCloudPackager reads. Point its pdapp_path input at this script.
+
+If FAKE_PDAPP_FAIL is set, a build fails with that value as its
+errorMessage, eg. CustomerTypeMismatchError. FAKE_PDAPP_FAIL_RATE sets the
+fraction of builds which fail that way instead of every build.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from xml.etree import ElementTree
+
+CCP_VERSION = '1.14.0.99'
+
+
+def write(path, text):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fd:
+        fd.write(text)
+
+
+def option_xml(package, products):
+    root = ElementTree.Element('InstallInfo')
+    ElementTree.SubElement(root, 'prodVersion').text = CCP_VERSION
+    ElementTree.SubElement(root, 'PackageName').text = package
+    medias = ElementTree.SubElement(root, 'Medias')
+    for product in products:
+        media = ElementTree.SubElement(medias, 'Media')
+        ElementTree.SubElement(media, 'SAPCode').text = product.findtext('sapCode')
+        ElementTree.SubElement(media, 'baseVersion').text = product.findtext('version')
+        ElementTree.SubElement(media, 'prodVersion').text = product.findtext('version')
+    return ElementTree.tostring(root).decode('utf-8')
+
+
+def build(config):
+    """Write the package tree CCP builds for the automation XML config."""
+    package = config.findtext('CreatePackage/packageName')
+    output = config.findtext('CreatePackage/outputLocation')
+    products = config.findall('CreatePackage/Products/Product')
+    root = os.path.join(output, package)
+    for kind in ('Install', 'Uninstall'):
+        resources = os.path.join(root, 'Build', '{}_{}.pkg'.format(package, kind), 'Contents', 'Resources')
+        write(os.path.join(resources, 'optionXML.xml'), option_xml(package, products))
+        write(os.path.join(resources, 'Setup'), '#!/bin/sh\n')
+    write(os.path.join(root, 'Build', '{}.ccp'.format(package)), '<CCPPackage/>\n')
+    write(os.path.join(root, 'PackageInfo.txt'), 'Package {} built by fake_pdapp\n'.format(package))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pkgConfigFile', required=True)
+    args, _ = parser.parse_known_args()
+
+    config = ElementTree.parse(args.pkgConfigFile).getroot()
+    time.sleep(float(os.environ.get('FAKE_PDAPP_SECONDS', '1')))
+
+    result = ElementTree.Element('CCPPackageResult')
+    error = os.environ.get('FAKE_PDAPP_FAIL')
+    if error and random.random() >= float(os.environ.get('FAKE_PDAPP_FAIL_RATE', '1')):
+        error = None
+    if error:
+        ElementTree.SubElement(ElementTree.SubElement(result, 'error'), 'errorMessage').text = error
+    else:
+        build(config)
+        ElementTree.SubElement(result, 'success')
+    write(os.path.splitext(args.pkgConfigFile)[0] + '_result.xml', ElementTree.tostring(result).decode('utf-8'))
+    print('fake_pdapp: {} {}'.format(config.findtext('CreatePackage/packageName'), 'failed' if error else 'built'))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure the cold-start import time of the processors in a full recipe chain.
+
+Usage:
+    import_time.py [--repeat 10] [--against REV]
+
+AutoPkg imports every processor of a recipe before running any of them.
+This imports the whole chain in a fresh interpreter, --repeat times, and
+reports the fastest import along with the modules it loaded. autopkglib is
+imported first and is not counted, since every recipe pays for it anyway.
+
+With --against, the processors at a git revision are measured too, so
+that the cold-start difference between the two can be compared.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# The processors of a .pkg recipe, in the order they run
+CHAIN = ['CreativeCloudFeed', 'CreativeCloudPackager', 'CreativeCloudBuildModifier', 'CreativeCloudVersioner',
+         'CreativeCloudPayloadHasher']
+
+# Modules which are expensive to import and which most runs don't need
+HEAVY_MODULES = [
+    'Foundation',
+    'FoundationPlist',
+    'ctypes',
+    'difflib',
+    'multiprocessing',
+    'pprint',
+    'uuid',
+    'xml.etree.ElementTree',
+    'zipfile',
+]
+
+CHILD = '''
+import json, sys, timeit
+sys.path[:0] = {paths!r}
+import autopkglib
+before = set(sys.modules)
+start = timeit.default_timer()
+for name in {chain!r}:
+    __import__(name)
+elapsed = timeit.default_timer() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(set(sys.modules) - before)}}))
+'''
+
+
+def measure(adobe_dir, autopkg_path, repeat):
+    """Import the chain from adobe_dir in repeat fresh interpreters.
+
+    Returns:
+        dict: The fastest import time in seconds, and the modules loaded by the import.
+    """
+    # Older revisions may not have every processor of the chain
+    chain = [name for name in CHAIN if os.path.exists(os.path.join(adobe_dir, name + '.py'))]
+    code = CHILD.format(paths=[adobe_dir, autopkg_path], chain=chain)
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            return {'error': err.decode('utf-8', 'replace').strip().splitlines()[-1]}
+        result = json.loads(out.decode('utf-8'))
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def export_revision(rev, dest):
+    """Extract the Adobe directory of a git revision into dest, returning its path."""
+    archive = subprocess.check_output(['git', '-C', REPO_DIR, 'archive', '--format=tar', rev, 'Adobe'])
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(dest)
+    return os.path.join(dest, 'Adobe')
+
+
+def report(label, result):
+    if 'error' in result:
+        print('{:<12} ERROR {}'.format(label, result['error']))
+        return
+    heavy = [name for name in HEAVY_MODULES if name in result['modules']]
+    print('{:<12} {:>8.1f} ms  {:>4} modules  heavy: {}'.format(
+        label, result['seconds'] * 1000, len(result['modules']), ', '.join(heavy) or 'none'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=10, help='Fresh interpreters per measurement')
+    parser.add_argument('--against', metavar='REV', help='Also measure the processors at this git revision')
+    parser.add_argument('--autopkg-path', default='/Library/AutoPkg', help='Directory containing autopkglib')
+    args = parser.parse_args()
+
+    print('Importing {}'.format(', '.join(CHAIN)))
+    current = measure(os.path.join(REPO_DIR, 'Adobe'), args.autopkg_path, args.repeat)
+    report('working tree', current)
+
+    if args.against:
+        workdir = tempfile.mkdtemp(prefix='ccp-import-time-')
+        try:
+            previous = measure(export_revision(args.against, workdir), args.autopkg_path, args.repeat)
+        except subprocess.CalledProcessError:
+            parser.error('Unable to export the Adobe directory at revision {}'.format(args.against))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        report(args.against[:12], previous)
+        if 'seconds' in current and 'seconds' in previous:
+            print('Difference: {:+.1f} ms ({:+.0%})'.format(
+                (current['seconds'] - previous['seconds']) * 1000,
+                current['seconds'] / previous['seconds'] - 1))
+
+    return 1 if 'error' in current else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
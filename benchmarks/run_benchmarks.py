@@ -0,0 +1,396 @@
+#!/usr/bin/python
+
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the hot paths of the CCP processors against synthetic data.
+
+Usage:
+    run_benchmarks.py [--sizes 10,1000,50000] [--payload-mb 64] [--repeat 3]
+                      [--only NAME] [--save-baseline] [--tolerance 0.25]
+
+Each benchmark runs in its own child process, so that its peak memory can be
+measured in isolation. Peak memory comes from tracemalloc where available,
+and from the growth of the child's maximum RSS otherwise.
+
+Results are compared against benchmarks/baseline.json, if present, and the
+script exits with status 1 if any benchmark is slower or larger than its
+baseline by more than the tolerance. Use --save-baseline to record the
+current results as the new baseline.
+
+The processors import autopkglib, which is looked for in --autopkg-path.
+Benchmarks which need it are skipped if it cannot be imported. Feed and
+manifest fetches are served from a local HTTP server, never from Adobe.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import imp
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+ADOBE_DIR = os.path.join(REPO_DIR, 'Adobe')
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+sys.path.insert(0, BENCH_DIR)
+import synthetic  # pylint: disable=wrong-import-position
+
+# Benchmarks and fixture generators are closures, so children must be forked rather than spawned
+if hasattr(multiprocessing, 'get_context'):
+    multiprocessing = multiprocessing.get_context('fork')
+
+BENCHMARKS = []
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark's setup when it cannot run in this environment."""
+    pass
+
+
+def benchmark(name, sized=False):
+    """Register a benchmark setup function.
+
+    The setup function is called in the child process with the run context
+    (and the feed size, if sized is True). It returns a function to time, or a
+    (prepare, run) tuple where prepare is called untimed before each run.
+    """
+    def decorator(setup):
+        BENCHMARKS.append((name, sized, setup))
+        return setup
+    return decorator
+
+
+def import_processor(ctx, name):
+    """Import a processor module from the Adobe directory."""
+    for path in (ctx['autopkg_path'], ADOBE_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    try:
+        return __import__(name)
+    except ImportError as err:
+        raise SkipBenchmark('cannot import {}: {}'.format(name, err))
+
+
+def processor_env(ctx, **kwargs):
+    env = {
+        'verbose': 0,
+        'RECIPE_CACHE_DIR': tempfile.mkdtemp(dir=ctx['workdir']),
+        'url_cache_dir': os.path.join(ctx['workdir'], 'url-cache'),
+    }
+    env.update(kwargs)
+    return env
+
+
+def load_feed(ctx, size):
+    """Return the feed records of the synthetic feed with size products, and queries which match it."""
+    if ADOBE_DIR not in sys.path:
+        sys.path.insert(0, ADOBE_DIR)
+    from ccplib.feedrecords import Feed
+
+    with open(ctx['feeds'][size], 'rb') as fd:
+        text = fd.read()
+    return Feed.from_json(text), synthetic.feed_queries(json.loads(text))
+
+
+@benchmark('CreativeCloudFeed.fetch', sized=True)
+def bench_feed_fetch(ctx, size):
+    module = import_processor(ctx, 'CreativeCloudFeed')
+    module.BASE_URL = '{}/feed/{}'.format(ctx['server_url'], size)
+    processor = module.CreativeCloudFeed(processor_env(ctx))
+    # Time the download and parse, not a hit in the in-process feed store
+    return module.feedstore.invalidate, lambda: processor.fetch(synthetic.CHANNELS, synthetic.PLATFORMS)
+
+
+@benchmark('CreativeCloudFeed.filter_product', sized=True)
+def bench_filter_product(ctx, size):
+    module = import_processor(ctx, 'CreativeCloudFeed')
+    processor = module.CreativeCloudFeed(processor_env(ctx, channels=','.join(synthetic.CHANNELS)))
+    feed, queries = load_feed(ctx, size)
+
+    def run():
+        for sap, base_version, version in queries:
+            processor.filter_product(feed, sap, base_version, version)
+    return run
+
+
+@benchmark('CreativeCloudFeed.cache_product_info', sized=True)
+def bench_cache_product_info(ctx, size):
+    module = import_processor(ctx, 'CreativeCloudFeed')
+    processor = module.CreativeCloudFeed(processor_env(ctx, channels=','.join(synthetic.CHANNELS)))
+    feed, queries = load_feed(ctx, size)
+    products = [(dict(sapCode=sap, baseVersion=base_version, version=version),
+                 processor.filter_product(feed, sap, base_version, version))
+                for sap, base_version, version in queries]
+
+    def run():
+        for input_product, output_product in products:
+            processor.cache_product_info(input_product, output_product)
+    return run
+
+
+@benchmark('CreativeCloudFeed.fetch_manifest')
+def bench_fetch_manifest(ctx):
+    module = import_processor(ctx, 'CreativeCloudFeed')
+    # Time the downloads, not a hit in the URL cache
+    processor = module.CreativeCloudFeed(processor_env(ctx, url_cache_max_age=0))
+    url = '{}/manifest.xml'.format(ctx['server_url'])
+    return lambda: processor.fetch_manifest(url)
+
+
+@benchmark('list_ccp_feed.group_products', sized=True)
+def bench_group_products(ctx, size):
+    list_ccp_feed = imp.load_source('list_ccp_feed', os.path.join(REPO_DIR, 'list_ccp_feed'))
+    feed = load_feed(ctx, size)[0]
+    return lambda: list_ccp_feed.group_products(feed)
+
+
+@benchmark('CreativeCloudBuildModifier.main')
+def bench_build_modifier(ctx):
+    module = import_processor(ctx, 'CreativeCloudBuildModifier')
+    pkg_path = os.path.join(ctx['workdir'], 'modify.pkg')
+    env = processor_env(ctx, pkg_path=pkg_path, suppress_ccda=True)
+    state = {}
+
+    def prepare():
+        if os.path.exists(pkg_path):
+            shutil.rmtree(pkg_path)
+        shutil.copytree(ctx['modifiable_pkg'], pkg_path)
+        for name in os.listdir(env['RECIPE_CACHE_DIR']):
+            os.unlink(os.path.join(env['RECIPE_CACHE_DIR'], name))
+        state['processor'] = module.CreativeCloudBuildModifier(dict(env))
+
+    return prepare, lambda: state['processor'].main()
+
+
+@benchmark('CreativeCloudVersioner.scan_hd_product')
+def bench_versioner_scan(ctx):
+    module = import_processor(ctx, 'CreativeCloudVersioner')
+    processor = module.CreativeCloudVersioner(processor_env(ctx))
+    hd_dir = os.path.dirname(ctx['hd_app_json'])
+    return lambda: processor.scan_hd_product(hd_dir)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serve generated fixtures by path, ignoring any query string."""
+    routes = {}
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        path = self.routes.get(self.path.split('?', 1)[0])
+        if path is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as fd:
+            shutil.copyfileobj(fd, self.wfile)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def start_server(routes):
+    FixtureHandler.routes = routes
+    server = HTTPServer(('127.0.0.1', 0), FixtureHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def _current_rss():
+    """Return the maximum resident set size of this process in bytes."""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _child(conn, fn, args, repeat):
+    """Run a benchmark in a child process, sending its results through conn."""
+    try:
+        result = fn(*args)
+        prepare, run = result if isinstance(result, tuple) else (None, result)
+        times = []
+        rss_before = _current_rss()
+        if tracemalloc is not None:
+            tracemalloc.start()
+        for _ in range(repeat):
+            if prepare is not None:
+                prepare()
+            start = timeit.default_timer()
+            run()
+            times.append(timeit.default_timer() - start)
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            peak = _current_rss() - rss_before
+        conn.send({'seconds': min(times), 'mean_seconds': sum(times) / len(times), 'peak_bytes': peak})
+    except SkipBenchmark as err:
+        conn.send({'skipped': str(err)})
+    except Exception as err:  # pylint: disable=broad-except
+        conn.send({'error': '{}: {}'.format(type(err).__name__, err)})
+    finally:
+        conn.close()
+
+
+def run_in_child(fn, args=(), repeat=1):
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=_child, args=(child_conn, fn, args, repeat))
+    proc.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {'error': 'benchmark process exited with status {}'.format(proc.exitcode)}
+    proc.join()
+    return result
+
+
+def generate_fixtures(workdir, sizes, payload_mb):
+    """Write all fixtures to workdir, each in a child process to keep this process small."""
+    ctx = {'workdir': workdir, 'feeds': {}}
+    for size in sizes:
+        ctx['feeds'][size] = os.path.join(workdir, 'feed-{}.json'.format(size))
+        run_in_child(lambda path=ctx['feeds'][size], n=size: synthetic.write_feed(path, synthetic.make_feed(n)))
+
+    ctx['proxy'] = os.path.join(workdir, 'proxy.xml')
+    ctx['manifest'] = os.path.join(workdir, 'manifest.xml')
+    with open(ctx['proxy'], 'w') as fd:
+        fd.write(synthetic.make_proxy_xml())
+
+    ctx['modifiable_pkg'] = os.path.join(workdir, 'modifiable.pkg')
+    synthetic.make_modifiable_package(ctx['modifiable_pkg'])
+
+    ctx['hd_app_json'] = synthetic.make_hd_package(os.path.join(workdir, 'hd.pkg'), payload_mb=payload_mb)
+    return ctx
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of (name, metric, baseline value, current value) regressions."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not base or 'seconds' not in result or 'seconds' not in base:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if base[metric] and result[metric] > base[metric] * (1 + tolerance):
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def format_result(name, result, base):
+    if 'skipped' in result:
+        return '{:<55} skipped ({})'.format(name, result['skipped'])
+    if 'error' in result:
+        return '{:<55} ERROR {}'.format(name, result['error'])
+    line = '{:<55} {:>10.4f}s {:>10.1f} KiB'.format(name, result['seconds'], result['peak_bytes'] / 1024.0)
+    if base and 'seconds' in base:
+        line += '   (baseline {:.4f}s, {:.1f} KiB)'.format(base['seconds'], base['peak_bytes'] / 1024.0)
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='10,1000,50000',
+                        help='Comma separated number of products in the synthetic feeds')
+    parser.add_argument('--payload-mb', type=int, default=64, help='Size of the synthetic HD payload')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark, the fastest is reported')
+    parser.add_argument('--only', help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed fractional increase over the baseline before reporting a regression')
+    parser.add_argument('--output', help='Also write the results as JSON to this path')
+    parser.add_argument('--autopkg-path', default='/Library/AutoPkg', help='Directory containing autopkglib')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    workdir = tempfile.mkdtemp(prefix='ccp-benchmarks-')
+    server = None
+    try:
+        print('Generating fixtures in {}'.format(workdir))
+        ctx = generate_fixtures(workdir, sizes, args.payload_mb)
+        ctx['autopkg_path'] = args.autopkg_path
+
+        routes = dict(('/feed/{}'.format(size), path) for size, path in ctx['feeds'].items())
+        routes['/proxy.xml'] = ctx['proxy']
+        routes['/manifest.xml'] = ctx['manifest']
+        server, ctx['server_url'] = start_server(routes)
+        with open(ctx['manifest'], 'w') as fd:
+            fd.write(synthetic.make_manifest_xml('{}/proxy.xml'.format(ctx['server_url'])))
+
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r') as fd:
+                baseline = json.load(fd)
+
+        results = {}
+        for name, sized, setup in BENCHMARKS:
+            for size in (sizes if sized else [None]):
+                full_name = name if size is None else '{}[{}]'.format(name, size)
+                if args.only and args.only not in full_name:
+                    continue
+                setup_args = (ctx, size) if sized else (ctx,)
+                results[full_name] = run_in_child(setup, setup_args, args.repeat)
+                print(format_result(full_name, results[full_name], baseline.get(full_name)))
+                sys.stdout.flush()
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        measured = dict((name, result) for name, result in results.items() if 'seconds' in result)
+        baseline.update(measured)
+        with open(args.baseline, 'w') as fd:
+            json.dump(baseline, fd, indent=2, sort_keys=True)
+        print('Saved {} result(s) to {}'.format(len(measured), args.baseline))
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, base, current in regressions:
+        print('REGRESSION {}: {} {:.4g} -> {:.4g}'.format(name, metric, base, current))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
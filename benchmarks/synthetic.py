@@ -0,0 +1,270 @@
+# Copyright 2018 Mosen/Tim Sutton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Generators for synthetic Creative Cloud feeds and CCP packages.
+
+Everything is generated from a seeded random.Random, so the same arguments
+always produce the same data.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import plistlib
+import random
+import string
+import zipfile
+
+CHANNELS = ['ccp_hd_2', 'sti']
+PLATFORMS = ['osx10', 'osx10-64']
+CDN = {'secure': 'https://ccmdls.adobe.com', 'nonsecure': 'http://ccmdl.adobe.com'}
+
+# Number of versions generated per SAP code in a feed
+VERSIONS_PER_PRODUCT = 20
+
+
+def sap_code(index):
+    """Return a unique four letter SAP code for index."""
+    letters = string.ascii_uppercase
+    code = ''
+    for _ in range(4):
+        index, rem = divmod(index, len(letters))
+        code += letters[rem]
+    return code
+
+
+def make_product(rng, sap, base_major, minor, platforms):
+    """Return a feed product fragment."""
+    base_version = '{}.0'.format(base_major)
+    version = '{}.{}.{}'.format(base_major, minor, rng.randint(0, 9))
+    return {
+        'id': sap,
+        'version': version,
+        'displayName': 'Adobe {} CC'.format(sap.title()),
+        'family': 'Creative Cloud',
+        'productInfoPage': 'https://www.adobe.com/products/{}.html'.format(sap.lower()),
+        'productIcons': {
+            'icon': [
+                {'size': '{0}x{0}'.format(size), 'value': 'https://ccmdls.adobe.com/icons/{}/{}.png'.format(sap, size)}
+                for size in (24, 48, 96)
+            ]
+        },
+        'platforms': {
+            'platform': [{
+                'id': platform,
+                'packageType': 'hdPackage',
+                'systemCompatibility': {'operatingSystem': {'range': ['10.12.0-']}},
+                'languageSet': [{
+                    'baseVersion': base_version,
+                    'name': 'Language',
+                    'urls': {
+                        'manifestURL': '/AdobeProducts/{0}/{1}/{2}/{0}{1}.xml'.format(sap, version, platform),
+                    },
+                }],
+            } for platform in platforms],
+        },
+    }
+
+
+def make_feed(num_products, channels=CHANNELS, platforms=PLATFORMS, seed=0):
+    """Return a feed dict with num_products products spread over the given channels.
+
+    Each SAP code gets up to VERSIONS_PER_PRODUCT versions, across a few base versions.
+    """
+    rng = random.Random(seed)
+    feed = {'channel': [{'name': name, 'cdn': CDN, 'products': {'product': []}} for name in channels]}
+    for index in range(num_products):
+        sap_index, version_index = divmod(index, VERSIONS_PER_PRODUCT)
+        channel = feed['channel'][sap_index % len(channels)]
+        base_major = 10 + version_index // 5
+        product = make_product(rng, sap_code(sap_index), base_major, version_index % 5, platforms)
+        channel['products']['product'].append(product)
+    return feed
+
+
+def feed_queries(feed, count=10, seed=0):
+    """Return (sap_code, base_version, version) tuples of products which exist in feed."""
+    rng = random.Random(seed)
+    products = [prod for channel in feed['channel'] for prod in channel['products']['product']]
+    queries = []
+    for prod in rng.sample(products, min(count, len(products))):
+        base_version = prod['platforms']['platform'][0]['languageSet'][0]['baseVersion']
+        queries.append((prod['id'], base_version, 'latest'))
+    return queries
+
+
+def write_feed(path, feed):
+    with open(path, 'w') as fd:
+        json.dump(feed, fd)
+
+
+def make_proxy_xml(version='19.1.0'):
+    """Return the text of a product proxy.xml"""
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<Proxy>\n'
+        '  <InstallDir><Platform>[AdobeProgramFiles]/Adobe Product</Platform></InstallDir>\n'
+        '  <InstallerProperties>\n'
+        '    <Property name="ProductVersion">{}</Property>\n'
+        '  </InstallerProperties>\n'
+        '  <ThirdPartyComponent><Metadata><Properties>\n'
+        '    <Property name="path">[INSTALLDIR]/Adobe Product.app</Property>\n'
+        '  </Properties></Metadata></ThirdPartyComponent>\n'
+        '</Proxy>\n'
+    ).format(version)
+
+
+def make_manifest_xml(proxy_url, num_assets=50, seed=0):
+    """Return the text of a product manifest.xml with num_assets assets"""
+    rng = random.Random(seed)
+    assets = []
+    for index in range(num_assets):
+        size = rng.randint(1024, 512 * 1024 * 1024)
+        assets.append(
+            '    <asset>\n'
+            '      <asset_path>https://ccmdls.adobe.com/AdobeProducts/ASSET/{0}/Asset{0}.zip</asset_path>\n'
+            '      <asset_size>{1}</asset_size>\n'
+            '      <valid_ms>{2}</valid_ms>\n'
+            '{3}'
+            '    </asset>\n'.format(
+                index, size, rng.randint(0, 1),
+                '      <proxy_data>{}</proxy_data>\n'.format(proxy_url) if index == 0 else ''))
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<manifest>\n'
+        '  <asset_list>\n'
+        '{}'
+        '  </asset_list>\n'
+        '</manifest>\n'
+    ).format(''.join(assets))
+
+
+def _write_filler(myzip, name, size, rng, chunk_size=1024 * 1024):
+    """Write size bytes of filler members to the zip, chunk_size bytes per member.
+
+    ZipFile.writestr() needs each member in memory, so the filler is split
+    up to keep generation memory-bounded.
+    """
+    block = bytes(bytearray(rng.getrandbits(8) for _ in range(64 * 1024)))
+    chunk = (block * (chunk_size // len(block) + 1))[:chunk_size]
+    part = 0
+    while size > 0:
+        myzip.writestr('{}.{:04d}'.format(name, part), chunk[:min(chunk_size, size)])
+        size -= chunk_size
+        part += 1
+
+
+def make_hd_package(pkg_path, sap='PHSP', base_version='19.0', num_apps=3, num_assets=2000, payload_mb=64,
+                    seed=0):
+    """Create a CCP package with a single HD product at pkg_path.
+
+    The payload zip contains a .pimx with num_assets assets, num_apps application bundles, and payload_mb
+    megabytes of filler members.
+
+    Returns:
+        str: The path to the product's Application.json
+    """
+    rng = random.Random(seed)
+    product_dir = os.path.join(pkg_path, 'Contents', 'Resources', 'HD', sap + base_version)
+    if not os.path.isdir(product_dir):
+        os.makedirs(product_dir)
+
+    package_name = 'Adobe{}{}-mul'.format(sap, base_version)
+    folder = 'Adobe {} CC'.format(sap.title())
+    apps = ['{} {}.app'.format(folder, index) if index else '{}.app'.format(folder) for index in range(num_apps)]
+
+    with open(os.path.join(product_dir, 'Application.json'), 'w') as fd:
+        json.dump({
+            'SAPCode': sap,
+            'BaseVersion': base_version,
+            'AppLaunch': '[INSTALLDIR]/{}/{}/Contents/MacOS/{}'.format(folder, apps[0], apps[0][:-4]),
+            'InstallDir': {'value': '[AdobeProgramFiles]/{}'.format(folder)},
+            'Packages': {'Package': [{'PackageName': package_name}]},
+        }, fd)
+
+    assets = ['<Asset target="[INSTALLDIR]/Shared/{0}" source="[StagingFolder]/Shared/{0}"/>'.format(index)
+              for index in range(num_assets)]
+    assets.append('<Asset target="[INSTALLDIR]/{0}" source="[StagingFolder]/{0}"/>'.format(folder))
+    pimx = '<?xml version="1.0" encoding="utf-8"?>\n<PIMX><Assets>{}</Assets></PIMX>\n'.format('\n'.join(assets))
+
+    with zipfile.ZipFile(os.path.join(product_dir, package_name + '.zip'), 'w', zipfile.ZIP_STORED,
+                         allowZip64=True) as myzip:
+        myzip.writestr(package_name + '.pimx', pimx)
+        for index, app in enumerate(apps):
+            info_plist = {
+                'CFBundleShortVersionString': '{}.{}.0'.format(base_version.split('.')[0], index),
+                'CFBundleIdentifier': 'com.adobe.{}.{}'.format(sap.lower(), index),
+                'CFBundleExecutable': app[:-4],
+            }
+            to_string = getattr(plistlib, 'dumps', None) or plistlib.writePlistToString
+            myzip.writestr('1/{}/{}/Contents/Info.plist'.format(folder, app), to_string(info_plist))
+            myzip.writestr('1/{}/{}/Contents/MacOS/{}'.format(folder, app, app[:-4]), b'\0' * 4096)
+        for index in range(num_assets):
+            myzip.writestr('1/Shared/{}/resource.dat'.format(index), b'')
+        _write_filler(myzip, '1/{}/payload.bin'.format(folder), payload_mb * 1024 * 1024, rng)
+
+    return os.path.join(product_dir, 'Application.json')
+
+
+OPTION_XML = '''<?xml version="1.0" encoding="utf-8"?>
+<CCPPackage>
+  <prodVersion>1.14.0.97</prodVersion>
+  <Configurations>
+    <SuppressOptions>
+      <ACC suppress="false"/>
+      <Update isEnabled="1"/>
+    </SuppressOptions>
+    <ACCPanelMaskingConfig>
+      <config>
+        <panel><name>AppsPanel</name><visible>true</visible></panel>
+        <feature><name>SelfServeInstalls</name><enabled>true</enabled></feature>
+      </config>
+    </ACCPanelMaskingConfig>
+  </Configurations>
+  <AAMInfo><name>Synthetic</name></AAMInfo>
+  <Medias>
+{medias}
+  </Medias>
+  <HDMedias>
+{hd_medias}
+  </HDMedias>
+</CCPPackage>
+'''
+
+
+def make_modifiable_package(pkg_path, num_medias=200, num_packages=500):
+    """Create a CCP package with optionXML.xml and ASU/packages/ApplicationInfo.xml for the build modifier."""
+    resources = os.path.join(pkg_path, 'Contents', 'Resources')
+    asu_packages = os.path.join(resources, 'ASU', 'packages')
+    if not os.path.isdir(asu_packages):
+        os.makedirs(asu_packages)
+
+    medias = '\n'.join(
+        '    <Media><SAPCode>{0}</SAPCode><prodVersion>1.{1}</prodVersion>'
+        '<TargetFolderName>{0}</TargetFolderName></Media>'.format(sap_code(index), index)
+        for index in range(num_medias))
+    hd_medias = '\n'.join(
+        '    <HDMedia><SAPCode>{0}</SAPCode><prodVersion>2.{1}</prodVersion><baseVersion>2.0</baseVersion>'
+        '<TargetFolderName>{0}2.0</TargetFolderName></HDMedia>'.format(sap_code(index + num_medias), index)
+        for index in range(num_medias))
+    with open(os.path.join(resources, 'optionXML.xml'), 'w') as fd:
+        fd.write(OPTION_XML.format(medias=medias, hd_medias=hd_medias))
+
+    names = ['ACCC', 'Utils', 'CoreSync', 'HomePanel', 'CCXProcess', 'HDCore', 'AppsPanel']
+    names.extend('Package{}'.format(index) for index in range(num_packages))
+    packages = ''.join('<package><name>{}</name></package>'.format(name) for name in names)
+    with open(os.path.join(asu_packages, 'ApplicationInfo.xml'), 'w') as fd:
+        fd.write('<?xml version="1.0" encoding="UTF-8"?>\n<application><packageSets>'
+                 '<packageSet><name>ACC</name><packages>{}</packages></packageSet>'
+                 '<packageSet><name>ADC</name><packages><package><name>ADC</name></package></packages></packageSet>'
+                 '</packageSets></application>\n'.format(packages))